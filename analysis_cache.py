@@ -0,0 +1,147 @@
+"""Persistent transposition table for Stockfish position analyses."""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+import chess
+import chess.polyglot
+
+try:
+    import orjson
+except ImportError:  # optional fast JSON encoder
+    orjson = None
+
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+
+def _json_dumps(data: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data)
+
+
+class AnalysisCache:
+    """SQLite-backed store of `analyze_position` results keyed by Zobrist hash.
+
+    Each position keeps a single entry; a new result only replaces it when its
+    search budget (nodes and MultiPV) is at least as large, so the deepest
+    analysis wins. Lookups are served by any entry that covers the request.
+    With max_ply set, only positions up to that ply (the shared opening
+    phase) are cached, which keeps the file small.
+    """
+
+    def __init__(self, path: str, max_ply: Optional[int] = None):
+        self.path = path
+        self.max_ply = max_ply
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS position_analysis (
+                    zobrist TEXT PRIMARY KEY,
+                    multipv INTEGER NOT NULL,
+                    nodes INTEGER NOT NULL,
+                    result TEXT NOT NULL
+                )
+                """
+            )
+
+    @staticmethod
+    def key(board: chess.Board) -> str:
+        # SQLite integers are signed 64-bit; store the hash as hex text
+        return format(chess.polyglot.zobrist_hash(board), "016x")
+
+    def covers(self, board: chess.Board) -> bool:
+        return self.max_ply is None or board.ply() <= self.max_ply
+
+    def get(self, board: chess.Board, multipv: int, nodes: int) -> Optional[Dict[str, Any]]:
+        if not self.covers(board):
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT multipv, result FROM position_analysis WHERE zobrist = ? AND multipv >= ? AND nodes >= ?",
+                (self.key(board), multipv, nodes),
+            ).fetchone()
+        if row is None:
+            return None
+        stored_multipv, payload = row
+        result = _json_loads(payload)
+        if stored_multipv > multipv:
+            result["pv"] = result.get("pv", [])[:multipv]
+        return result
+
+    def put(self, board: chess.Board, multipv: int, nodes: int, result: Dict[str, Any]) -> None:
+        if result.get("error") or not self.covers(board):
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO position_analysis (zobrist, multipv, nodes, result) VALUES (?, ?, ?, ?)
+                ON CONFLICT(zobrist) DO UPDATE SET
+                    multipv = excluded.multipv, nodes = excluded.nodes, result = excluded.result
+                WHERE excluded.multipv >= position_analysis.multipv AND excluded.nodes >= position_analysis.nodes
+                """,
+                (self.key(board), multipv, nodes, _json_dumps(result)),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class MemoryAnalysisCache:
+    """Bounded in-process LRU with the same interface and budget rules as AnalysisCache.
+
+    Used by live sessions (streamed and plain moves), where the same positions
+    are searched again within one server process (the quick pass and the full
+    pass of a move, the position after a move and before the reply, openings
+    replayed across sessions).
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+
+    def get(self, board: chess.Board, multipv: int, nodes: int) -> Optional[Dict[str, Any]]:
+        key = chess.polyglot.zobrist_hash(board)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < multipv or entry[1] < nodes:
+                return None
+            self._entries.move_to_end(key)
+        result = entry[2]
+        # Hand out a copy so callers cannot alter the stored entry
+        return {**result, "pv": result.get("pv", [])[:multipv]}
+
+    def put(self, board: chess.Board, multipv: int, nodes: int, result: Dict[str, Any]) -> None:
+        if result.get("error"):
+            return
+        key = chess.polyglot.zobrist_hash(board)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (multipv >= entry[0] and nodes >= entry[1]):
+                self._entries[key] = (multipv, nodes, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+@lru_cache(maxsize=1)
+def get_analysis_cache() -> Optional[AnalysisCache]:
+    """Return the process-wide cache configured by ANALYSIS_CACHE_PATH, if any.
+
+    ANALYSIS_CACHE_MAX_PLY optionally limits caching to the first N plies.
+    """
+    path = os.getenv("ANALYSIS_CACHE_PATH")
+    if not path:
+        return None
+    max_ply = os.getenv("ANALYSIS_CACHE_MAX_PLY")
+    return AnalysisCache(path, max_ply=int(max_ply) if max_ply else None)
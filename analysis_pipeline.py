@@ -1,14 +1,31 @@
 from typing import Dict, Any, List, Optional
 import io
+import os
+import re
 import asyncio
 import chess
 import chess.pgn
 
+from analysis_cache import get_analysis_cache
 from stockfish_engine import StockfishAnalyzer, DEFAULT_MULTIPV, DEFAULT_NODES_PER_PV
-from llm_coach import coach_move_with_llm, severity_from_cp_loss
+from llm_coach import coach_move_with_llm, severities_from_cp_losses
+
+# Cap on in-flight LLM requests per analysis run
+LLM_MAX_CONCURRENCY = max(1, int(os.getenv("LLM_MAX_CONCURRENCY", "8")))
+
+
+# A non-header line holding something move-like (a square or castling)
+_MOVETEXT_RE = re.compile(r"^(?![ \t]*[\[%]).*?(?:[a-h][1-8]|O-O|0-0)", re.MULTILINE)
+
+
+def has_movetext(pgn: str) -> bool:
+    """Cheap precheck: False when the PGN cannot contain any moves (empty or headers only)."""
+    return _MOVETEXT_RE.search(pgn) is not None
 
 
 def _safe_read_game(pgn: str) -> Optional[chess.pgn.Game]:
+    if not has_movetext(pgn):
+        return None
     try:
         game = chess.pgn.read_game(io.StringIO(pgn))
         return game
@@ -16,91 +33,151 @@ def _safe_read_game(pgn: str) -> Optional[chess.pgn.Game]:
         return None
 
 
+def _engine_feedback(
+    game: chess.pgn.Game, analyzer: StockfishAnalyzer, max_plies: Optional[int]
+) -> List[Dict[str, Any]]:
+    """Evaluate each mainline move with a running analyzer (blocking)."""
+    board = game.board()
+    moves_feedback: List[Dict[str, Any]] = []
+    move_no = 0
+    # Each position's FEN is built once: fen_after of one ply is fen_before of the next
+    fen_before = board.fen()
+    # Each position is searched once: one move's eval_after is the next move's eval_before
+    eval_before = None
+    for node in game.mainline():
+        move = node.move
+        side = "white" if board.turn else "black"
+        comparison = analyzer.compare_move(board, move, eval_before=eval_before)
+        eval_before = comparison["eval_before"]
+        # compare_move already rendered the played move's SAN
+        san = comparison["move_played_san"]
+        board.push(move)
+        fen_after = board.fen()
+
+        before_cp_white = eval_before.get("score", {}).get("cp")
+        after_cp_white = comparison.get("eval_after", {}).get("score", {}).get("cp")
+        mover_is_white = (side == "white")
+        # Centipawns are whole numbers; keep them ints so the JSON stays compact
+        cp_before = None if before_cp_white is None else int(before_cp_white if mover_is_white else -before_cp_white)
+        cp_after = None if after_cp_white is None else int(after_cp_white if mover_is_white else -after_cp_white)
+        cp_loss = comparison.get("eval_loss", 0.0)
+        best_move_san = eval_before.get("best_move_san")
+        multipv = eval_before.get("pv", [])
+
+        payload = {
+            "move_no": (move_no // 2) + 1,
+            "side": side,
+            "san": san,
+            "uci": move.uci(),
+            "fen_before": fen_before,
+            "fen_after": fen_after,
+            "cp_before": cp_before,
+            "cp_after": cp_after,
+            "cp_loss": cp_loss,
+            "cp_loss_cp": int(round(cp_loss * 100)),
+            "best_move_san": best_move_san,
+            "multipv": multipv,
+        }
+        moves_feedback.append(payload)
+        fen_before = fen_after
+        eval_before = comparison["eval_after"]
+        move_no += 1
+        if max_plies is not None and move_no >= max_plies:
+            break
+    return moves_feedback
+
+
+def _engine_feedback_new_engine(game: chess.pgn.Game, max_plies: Optional[int]) -> List[Dict[str, Any]]:
+    with StockfishAnalyzer(
+        multipv=DEFAULT_MULTIPV, nodes_per_pv=DEFAULT_NODES_PER_PV, cache=get_analysis_cache()
+    ) as analyzer:
+        return _engine_feedback(game, analyzer, max_plies)
+
+
 async def analyze_pgn_to_feedback(
     pgn_content: str,
     level: str = "intermediate",
     max_plies: Optional[int] = None,
     use_llm: bool = True,
     llm_mode: str = "all",
+    analyzer: Optional[StockfishAnalyzer] = None,
+    engine_pool=None,
 ) -> Optional[Dict[str, Any]]:
+    """Analyze a PGN and coach each move.
+
+    Pass a running analyzer to reuse its engine, or an EnginePool to borrow one
+    for the engine pass only (it is handed back before LLM coaching starts).
+    """
     game = _safe_read_game(pgn_content)
     if not game:
         return None
 
-    board = game.board()
-    moves_feedback: List[Dict[str, Any]] = []
+    # Engine calls block, so the engine pass runs in a worker thread
+    if analyzer is not None:
+        analyzer.newgame()
+        moves_feedback = await asyncio.to_thread(_engine_feedback, game, analyzer, max_plies)
+    elif engine_pool is not None:
+        async with engine_pool.acquire() as pooled:
+            moves_feedback = await asyncio.to_thread(_engine_feedback, game, pooled, max_plies)
+    else:
+        moves_feedback = await asyncio.to_thread(_engine_feedback_new_engine, game, max_plies)
+    llm_enabled: List[bool] = []
 
-    with StockfishAnalyzer(multipv=DEFAULT_MULTIPV, nodes_per_pv=DEFAULT_NODES_PER_PV) as analyzer:
-        move_no = 0
-        for node in game.mainline():
-            move = node.move
-            side = "white" if board.turn else "black"
-            fen_before = board.fen()
-            san = board.san(move)
-            eval_before = analyzer.analyze_position(board)
-            comparison = analyzer.compare_move(board, move)
-            board.push(move)
-            fen_after = board.fen()
-
-            before_cp_white = eval_before.get("score", {}).get("cp")
-            after_cp_white = comparison.get("eval_after", {}).get("score", {}).get("cp")
-            mover_is_white = (side == "white")
-            cp_before = before_cp_white if mover_is_white else (-before_cp_white if before_cp_white is not None else None)
-            cp_after = after_cp_white if mover_is_white else (-after_cp_white if after_cp_white is not None else None)
-            cp_loss = comparison.get("eval_loss", 0.0)
-            best_move_san = eval_before.get("best_move_san")
-            multipv = eval_before.get("pv", [])
-
-            payload = {
-                "move_no": (move_no // 2) + 1,
-                "side": side,
-                "san": san,
-                "uci": move.uci(),
-                "fen_before": fen_before,
-                "fen_after": fen_after,
-                "cp_before": cp_before,
-                "cp_after": cp_after,
-                "cp_loss": cp_loss,
-                "severity": severity_from_cp_loss(cp_loss),
-                "best_move_san": best_move_san,
-                "multipv": multipv,
+    # Classify every move at once, then decide which ones go to the LLM
+    severities = severities_from_cp_losses([m["cp_loss"] or 0.0 for m in moves_feedback])
+    for payload, severity in zip(moves_feedback, severities):
+        payload["severity"] = severity
+        llm_enabled.append(use_llm and (llm_mode == "all" or severity in ("mistake", "blunder")))
+
+    # Coach all moves concurrently once engine work is done; results keep move order
+    semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+    async def _coach(payload: Dict[str, Any], enable_for_move: bool) -> Dict[str, Any]:
+        async with semaphore:
+            return await coach_move_with_llm(payload, level=level, use_llm=enable_for_move)
+
+    coaches = await asyncio.gather(*(_coach(p, e) for p, e in zip(moves_feedback, llm_enabled)))
+    for payload, coach in zip(moves_feedback, coaches):
+        payload.update(
+            {
+                "basic": coach.get("basic"),
+                "source": coach.get("source", "rules"),
             }
-            # Decide whether to invoke LLM for this move
-            enable_for_move = use_llm and (llm_mode == "all" or payload["severity"] in ("mistake", "blunder"))
-            coach = await coach_move_with_llm(payload, level=level, use_llm=enable_for_move)
-            payload.update(
-                {
-                    "basic": coach.get("basic"),
-                    "source": coach.get("source", "rules"),
-                }
-            )
-            moves_feedback.append(payload)
-            move_no += 1
-            if max_plies is not None and move_no >= max_plies:
-                break
-
-    # Summaries (simple ACPL and counts)
-    def _side_stats(side: str) -> Dict[str, Any]:
-        side_moves = [m for m in moves_feedback if m["side"] == side]
-        acpl = None
-        if side_moves:
-            cp_losses = [abs(m.get("cp_loss") or 0.0) * 100 for m in side_moves]  # to centipawns
-            acpl = sum(cp_losses) / len(cp_losses) if cp_losses else 0
-        best_rate = 0.0
-        if side_moves:
-            best_count = sum(1 for m in side_moves if m.get("severity") in ("best", "good"))
-            best_rate = best_count * 100.0 / len(side_moves)
-        mistakes = sum(1 for m in side_moves if m.get("severity") == "mistake")
-        blunders = sum(1 for m in side_moves if m.get("severity") == "blunder")
+        )
+
+    # Summaries (simple ACPL and counts), accumulated for both sides in one pass
+    counters = {
+        side: {"n": 0, "cp_sum": 0.0, "best": 0, "mistakes": 0, "blunders": 0}
+        for side in ("white", "black")
+    }
+    critical_positions: List[int] = []
+    for i, m in enumerate(moves_feedback, 1):
+        get = m.get
+        s = counters[m["side"]]
+        severity = get("severity")
+        s["n"] += 1
+        s["cp_sum"] += abs(get("cp_loss") or 0.0)  # pawns
+        if severity in ("best", "good"):
+            s["best"] += 1
+        elif severity == "mistake":
+            s["mistakes"] += 1
+            critical_positions.append(i)
+        elif severity == "blunder":
+            s["blunders"] += 1
+            critical_positions.append(i)
+
+    def _side_summary(side: str) -> Dict[str, Any]:
+        s = counters[side]
+        n = s["n"]
         return {
-            "acpl": (acpl / 100.0) if acpl is not None else None,  # pawns
-            "best_move_rate": best_rate,
-            "mistakes": mistakes,
-            "blunders": blunders,
+            "acpl": (s["cp_sum"] / n) if n else None,  # pawns
+            "best_move_rate": (s["best"] * 100.0 / n) if n else 0.0,
+            "mistakes": s["mistakes"],
+            "blunders": s["blunders"],
         }
 
-    w = _side_stats("white")
-    b = _side_stats("black")
+    w = _side_summary("white")
+    b = _side_summary("black")
 
     summary = {
         "moves": moves_feedback,
@@ -113,6 +190,6 @@ async def analyze_pgn_to_feedback(
         "blunders_white": w.get("blunders"),
         "blunders_black": b.get("blunders"),
         "openings": [game.headers.get("Opening", "Unknown")],
-        "critical_positions": [i + 1 for i, m in enumerate(moves_feedback) if m.get("severity") in ("mistake", "blunder")],
+        "critical_positions": critical_positions,
     }
     return summary
@@ -4,13 +4,37 @@ import chess.pgn
 import chess
 import io
 import re
+import hashlib
+from collections import Counter, OrderedDict
+from itertools import islice
 from openai import OpenAI
 import concurrent.futures
+import numpy as np
 import multiprocessing
+import multiprocessing.util
 import json
-from typing import Dict, List, Any, Optional
+from typing import Dict, Iterator, List, Any, Optional
 import time
 from datetime import datetime
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:  # optional fast JSON encoder
+    orjson = None
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers catch either
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+
+def _json_dumps(data: Any, indent: bool = True) -> str:
+    """JSON text (indented unless indent=False), using orjson's native encoder when it is installed."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(data, option=option).decode()
+    if indent:
+        return json.dumps(data, indent=2)
+    return json.dumps(data, separators=(',', ':'))
 
 
 def _env_float(name: str, default: float) -> float:
@@ -26,88 +50,93 @@ def _env_float(name: str, default: float) -> float:
 
 LLM_DEBUG_ENABLED = os.getenv("LLM_DEBUG") == "1"
 LLM_REQUEST_TIMEOUT_SECONDS = max(0.5, _env_float("LLM_TIMEOUT_SECONDS", _env_float("LLM_TIMEOUT", 8.0)))
+# Cap on concurrent commentary requests when a long game is split into batches
+LLM_MAX_CONCURRENCY = max(1, int(os.getenv("LLM_MAX_CONCURRENCY", "8")))
+# Short games are packed into one commentary request up to this estimated prompt size (0 disables)
+LLM_PACK_TOKEN_BUDGET = max(0, int(os.getenv("LLM_PACK_TOKEN_BUDGET", "30000")))
+LLM_PACK_MAX_GAMES = 8
+# A game is short enough to pack when at least this many of its size fit the budget
+_LLM_PACK_MIN_GAMES = 4
+
+
+@lru_cache(maxsize=1)
+def _get_openai_client() -> OpenAI:
+    """Shared OpenAI client so every call in this process reuses one connection pool."""
+    return OpenAI()
 
 # Import the enhanced stockfish engine
 from stockfish_engine import (
-    StockfishAnalyzer, 
-    evaluate_game_detailed,
-    get_game_statistics,
-    evaluate_game
+    StockfishAnalyzer,
+    evaluate_game_detailed_from_game,
+    get_game_statistics_from_arrays,
 )
+from analysis_cache import get_analysis_cache
+from llm_coach import severities_from_cp_losses
+
+def players_from_headers(headers) -> tuple:
+    """Return the White and Black player names from already-parsed PGN headers."""
+    return headers.get("White", "Unknown"), headers.get("Black", "Unknown")
 
 def extract_players_from_pgn(pgn_content: str) -> tuple:
     """Extract White and Black players from PGN content with error handling."""
     try:
-        game = chess.pgn.read_game(io.StringIO(pgn_content))
-        if not game:
+        # Only the header block is needed; skip parsing the movetext
+        headers = chess.pgn.read_headers(io.StringIO(pgn_content))
+        if not headers:
             return "Unknown", "Unknown"
-        white_player = game.headers.get("White", "Unknown")
-        black_player = game.headers.get("Black", "Unknown")
-        return white_player, black_player
+        return players_from_headers(headers)
     except Exception as e:
         print(f"Warning: Could not extract players from PGN: {e}")
         return "Unknown", "Unknown"
 
-def get_game_from_pgn(pgn_content: str):
+# Parsed mainlines keyed by a BLAKE2b digest of the PGN text
+_GAME_CACHE_MAX = 1024
+_game_cache: "OrderedDict[bytes, Optional[tuple]]" = OrderedDict()
+
+
+def get_game_from_pgn(pgn_content: str, verbose: bool = False):
+    """Parse PGN content, reusing earlier parses of identical text.
+
+    Each call returns a fresh Game (headers and mainline), so callers may
+    mutate it freely. verbose reports each token the repair path skips.
+    """
+    key = hashlib.blake2b(pgn_content.encode("utf-8"), digest_size=16).digest()
+    if key in _game_cache:
+        _game_cache.move_to_end(key)
+    else:
+        game = _parse_game_from_pgn(pgn_content, verbose)
+        _game_cache[key] = None if game is None else (dict(game.headers), list(game.mainline_moves()))
+        if len(_game_cache) > _GAME_CACHE_MAX:
+            _game_cache.popitem(last=False)
+    entry = _game_cache[key]
+    if entry is None:
+        return None
+    headers, moves = entry
+    game = chess.pgn.Game(headers)
+    node = game
+    for move in moves:
+        node = node.add_variation(move)
+    return game
+
+def _parse_game_from_pgn(pgn_content: str, verbose: bool = False):
     """Parse PGN content and return game object with error handling."""
     try:
-        # Create a custom visitor that ignores variations and comments
-        class SimpleGameBuilder(chess.pgn.BaseVisitor):
-            def __init__(self):
-                self.game = chess.pgn.Game()
-                self.current_node = self.game
-                self.board_stack = [self.game.board()]
-                
-            def visit_header(self, tagname, tagvalue):
-                self.game.headers[tagname] = tagvalue
-                
-            def visit_move(self, board, move):
-                self.current_node = self.current_node.add_variation(move)
-                board.push(move)
-                
-            def result(self):
-                return self.game
-        
         # First try standard parsing
         game = None
         try:
             game = chess.pgn.read_game(io.StringIO(pgn_content))
-            # Validate by replaying
-            if game:
-                board = game.board()
-                for move in game.mainline_moves():
-                    if move not in board.legal_moves:
-                        print(f"Warning: Found illegal move, attempting repair...")
-                        game = None
-                        break
-                    board.push(move)
+            # read_game only keeps legal moves and records anything it had to drop
+            if game and game.errors:
+                print(f"Warning: Found illegal move, attempting repair...")
+                game = None
         except Exception as e:
             print(f"Standard parsing failed: {e}")
             game = None
         
-        # If standard parsing failed, try simplified parsing
+        # If standard parsing failed, rebuild the game from its headers and tokens
         if not game:
             print("  Attempting simplified parsing...")
-            visitor = SimpleGameBuilder()
-            
-            # Parse headers manually
-            lines = pgn_content.strip().split('\n')
-            movetext_lines = []
-            
-            for line in lines:
-                line = line.strip()
-                if line.startswith('[') and line.endswith(']'):
-                    # Parse header
-                    import re
-                    match = re.match(r'\[(\w+)\s+"(.*)"\]', line)
-                    if match:
-                        visitor.visit_header(match.group(1), match.group(2))
-                elif line and not line.startswith('['):
-                    movetext_lines.append(line)
-            
-            # Parse movetext
-            movetext = ' '.join(movetext_lines)
-            game = repair_pgn(pgn_content)
+            game = repair_pgn(pgn_content, verbose)
         
         return game
         
@@ -115,37 +144,55 @@ def get_game_from_pgn(pgn_content: str):
         print(f"Critical error parsing PGN: {e}")
         return None
 
-def repair_pgn(pgn_content: str):
-    """Attempt to repair a malformed PGN by extracting moves and rebuilding."""
+# Patterns used by repair_pgn, compiled once
+_HEADER_LINE_RE = re.compile(r'^[ \t]*\[(\w+)\s+"(.*)"\][ \t\r]*$', re.MULTILINE)
+_RESULT_RE = re.compile(r'(1-0|0-1|1/2-1/2|\*)$')
+_COMMENT_RE = re.compile(r'\{[^}]*\}')
+_VARIATION_RE = re.compile(r'\([^)]*\)')
+_NAG_RE = re.compile(r'\$\d+')
+_ANNOT_RE = re.compile(r'[!?]+')
+# First characters a SAN move can start with, in either case
+_MOVE_FIRST = frozenset('abcdefghNBRQKOnbrqko')
+
+_SAN_ANNOTATIONS = str.maketrans('', '', '+#!?')
+_MOVENUM_PREFIX_RE = re.compile(r'^\d+\.+')
+
+def _clean_san(token: str) -> str:
+    """Normalize a hand-written SAN token (annotations, 0-0, stray case) for parse_san."""
+    san = _MOVENUM_PREFIX_RE.sub('', token.strip()).translate(_SAN_ANNOTATIONS).strip('.,x ')
+    castle = san.upper().replace('0', 'O')
+    if castle in ('O-O', 'O-O-O'):
+        return castle
+    if len(san) > 2 and san[0] in 'nrqk':
+        # Lowercase piece letter ("nf3"); 'b' stays a pawn file
+        return san[0].upper() + san[1:]
+    if san[:1] in 'ACDEFGH':
+        # Uppercase pawn file ("E4", "Exd5"); 'B' stays a bishop
+        return san[0].lower() + san[1:]
+    return san
+
+def _split_pgn(pgn_content: str) -> tuple:
+    """Split PGN text into a tag-pair dict and its movetext joined onto one line."""
+    headers = dict(_HEADER_LINE_RE.findall(pgn_content))
+    movetext = ' '.join(_HEADER_LINE_RE.sub('', pgn_content).split())
+    return headers, movetext
+
+def repair_pgn(pgn_content: str, verbose: bool = False):
+    """Attempt to repair a malformed PGN by extracting moves and rebuilding.
+
+    Per-token messages are only printed when verbose is set.
+    """
     try:
-        import re
-        
-        # Extract headers and movetext
-        lines = pgn_content.split('\n')
-        headers = {}
-        movetext_lines = []
-        
-        for line in lines:
-            line = line.strip()
-            if line.startswith('[') and line.endswith(']'):
-                # Header line
-                match = re.match(r'\[(\w+)\s+"(.*)"\]', line)
-                if match:
-                    headers[match.group(1)] = match.group(2)
-            elif line and not line.startswith('['):
-                movetext_lines.append(line)
-        
-        # Join and clean movetext
-        full_movetext = ' '.join(movetext_lines)
+        headers, full_movetext = _split_pgn(pgn_content)
         
         # Remove result from movetext
-        full_movetext = re.sub(r'(1-0|0-1|1/2-1/2|\*)$', '', full_movetext)
+        full_movetext = _RESULT_RE.sub('', full_movetext)
         
         # Remove comments, variations, and NAGs
-        full_movetext = re.sub(r'\{[^}]*\}', '', full_movetext)  # Remove comments
-        full_movetext = re.sub(r'\([^)]*\)', '', full_movetext)  # Remove variations
-        full_movetext = re.sub(r'\$\d+', '', full_movetext)      # Remove NAG annotations
-        full_movetext = re.sub(r'[!?]+', '', full_movetext)       # Remove annotations like !, ?, !!, etc.
+        full_movetext = _COMMENT_RE.sub('', full_movetext)    # Remove comments
+        full_movetext = _VARIATION_RE.sub('', full_movetext)  # Remove variations
+        full_movetext = _NAG_RE.sub('', full_movetext)        # Remove NAG annotations
+        full_movetext = _ANNOT_RE.sub('', full_movetext)      # Remove annotations like !, ?, !!, etc.
         
         # Extract moves more carefully
         # Match move numbers and moves separately
@@ -169,55 +216,27 @@ def repair_pgn(pgn_content: str):
             token = tokens[i].strip()
             
             # Skip move numbers
-            if re.match(r'^\d+\.+$', token):
+            if token.endswith('.') and token.rstrip('.').isdigit():
                 i += 1
                 continue
             
-            # Check if it looks like a move
-            if re.match(r'^[a-hNBRQKO]', token, re.IGNORECASE):
-                # Clean the move text
-                move_text = token.strip('.,+#x ')
-                
-                # Handle castling
-                if move_text.upper() in ['O-O', '0-0']:
-                    move_text = 'O-O'
-                elif move_text.upper() in ['O-O-O', '0-0-0']:
-                    move_text = 'O-O-O'
-                
+            # Normalize once, then a single parse attempt
+            move_text = _clean_san(token)
+            if move_text and move_text[0] in _MOVE_FIRST:
                 try:
-                    # Try to parse the move
                     move = board.parse_san(move_text)
                     node = node.add_variation(move)
                     board.push(move)
-                except Exception as e:
-                    # Try alternative interpretations
-                    alternatives = [
-                        move_text.replace('x', ''),  # Remove capture notation
-                        move_text.replace('+', ''),   # Remove check notation
-                        move_text.replace('#', ''),   # Remove checkmate notation
-                        move_text.upper(),            # Try uppercase
-                        move_text.lower(),            # Try lowercase
-                    ]
-                    
-                    move_parsed = False
-                    for alt in alternatives:
-                        try:
-                            move = board.parse_san(alt)
-                            node = node.add_variation(move)
-                            board.push(move)
-                            move_parsed = True
-                            break
-                        except:
-                            continue
-                    
-                    if not move_parsed:
+                except ValueError:
+                    if verbose:
                         print(f"  Skipping unparseable move: {token}")
             
             i += 1
         
         # Return the game if we got any valid moves
-        if len(list(game.mainline_moves())) > 0:
-            print(f"  Successfully repaired PGN with {len(list(game.mainline_moves()))} moves")
+        move_count = len(board.move_stack)
+        if move_count > 0:
+            print(f"  Successfully repaired PGN with {move_count} moves")
             return game
         else:
             print("  Could not extract any valid moves from PGN")
@@ -235,9 +254,9 @@ def format_stockfish_eval(eval_data: Dict[str, Any]) -> str:
     formatted = []
     
     # Handle both direct evaluation and comparison formats
-    if 'evaluation' in eval_data:
-        # This is a move comparison
-        eval_info = eval_data['evaluation']
+    if 'evaluation' in eval_data or 'eval_before' in eval_data:
+        # This is a move comparison, either wrapped or straight from compare_move
+        eval_info = eval_data.get('evaluation', eval_data)
         eval_before = eval_info.get('eval_before', {})
         
         if eval_before.get('score'):
@@ -251,8 +270,9 @@ def format_stockfish_eval(eval_data: Dict[str, Any]) -> str:
         if eval_info.get('best_move_san'):
             formatted.append(f"Best: {eval_info['best_move_san']}")
         
-        if not eval_info.get('is_best') and eval_info.get('eval_loss'):
-            formatted.append(f"Loss: {eval_info['eval_loss']:.2f} pawns")
+        if not eval_info.get('is_best') and eval_info.get('eval_loss_cp', eval_info.get('eval_loss')):
+            loss = eval_info['eval_loss_cp'] / 100 if 'eval_loss_cp' in eval_info else eval_info['eval_loss']
+            formatted.append(f"Loss: {loss:.2f} pawns")
             
     else:
         # Direct position evaluation
@@ -272,64 +292,11 @@ def format_stockfish_eval(eval_data: Dict[str, Any]) -> str:
     
     return " | ".join(formatted) if formatted else "No evaluation available"
 
-def analyze_all_positions_batch(positions_data: List[Dict[str, Any]], white_player: str, 
-                               black_player: str, user_alias: str, max_moves_per_batch: int = 100) -> List[str]:
-    """
-    Generate ChatGPT analysis for all positions in batch calls.
-    Will split into multiple batches if game is very long.
-    """
-    client = OpenAI()
-    all_commentaries = []
-    
-    # Process in batches if game is very long
-    for batch_start in range(0, len(positions_data), max_moves_per_batch):
-        batch_end = min(batch_start + max_moves_per_batch, len(positions_data))
-        batch_positions = positions_data[batch_start:batch_end]
-        
-        if len(positions_data) > max_moves_per_batch:
-            print(f"    Processing moves {batch_start+1}-{batch_end} of {len(positions_data)}...")
-        
-        # Build a comprehensive prompt with positions in this batch
-        positions_info = []
-        for pos in batch_positions:
-            move_number = pos['move_number']
-            side = pos['side']
-            move_played = pos['move']
-            stockfish_eval = pos['stockfish_eval']
-            game_phase = pos['game_phase']
-            
-            # Format evaluation
-            eval_str = format_stockfish_eval(stockfish_eval)
-            
-            # Extract move quality info
-            is_best_move = False
-            eval_loss = 0
-            better_move = None
-            
-            if 'evaluation' in stockfish_eval:
-                eval_info = stockfish_eval['evaluation']
-                is_best_move = eval_info.get('is_best', False)
-                eval_loss = eval_info.get('eval_loss', 0)
-                better_move = eval_info.get('best_move_san')
-            
-            move_quality = 'Best move' if is_best_move else f'Loses {eval_loss:.2f} pawns' if eval_loss > 0.1 else 'Good move'
-            
-            position_entry = {
-                "move_number": move_number,
-                "side": side,
-                "move": move_played,
-                "phase": game_phase,
-                "stockfish_eval": eval_str,
-                "is_best": is_best_move,
-                "better_move": better_move if not is_best_move else None,
-                "eval_loss": eval_loss
-            }
-            positions_info.append(position_entry)
-        
-        # Create the batch prompt
-        prompt = f"""You are an instructive chess coach analyzing {'a portion of' if len(positions_data) > max_moves_per_batch else ''} a game between {white_player} (White) and {black_player} (Black) for {user_alias}.
+_BATCH_SYSTEM_PROMPT = "You are a chess instructor. Return ONLY a valid JSON array of commentary strings."
 
-I will provide you with {'some' if len(positions_data) > max_moves_per_batch else 'all the'} moves and their Stockfish evaluations. Please provide educational commentary for EACH move.
+_BATCH_PROMPT_TMPL = """You are an instructive chess coach analyzing {portion} a game between {white_player} (White) and {black_player} (Black) for {user_alias}.
+
+I will provide you with {scope} moves and their Stockfish evaluations. Please provide educational commentary for EACH move.
 
 For each move, provide 2-3 sentences of instructive commentary that:
 1. Explains the key idea behind the move or position
@@ -340,7 +307,7 @@ IMPORTANT: Return your response as a valid JSON array where each element corresp
 
 Here are the moves to analyze:
 
-{json.dumps(positions_info, indent=2)}
+{positions_json}
 
 Return ONLY a JSON array of commentary strings, one for each move, in the exact same order as provided above. Example format:
 [
@@ -350,12 +317,99 @@ Return ONLY a JSON array of commentary strings, one for each move, in the exact
 ]
 """
 
+def _position_entries(positions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """The per-move records sent to the LLM for a list of positions."""
+    positions_info = []
+    for pos in positions:
+        move_number = pos['move_number']
+        side = pos['side']
+        move_played = pos['move']
+        stockfish_eval = pos['stockfish_eval']
+        game_phase = pos['game_phase']
+        
+        # Format evaluation (already done while walking the game)
+        eval_str = pos.get('stockfish_formatted') or format_stockfish_eval(stockfish_eval)
+        
+        # Extract move quality info
+        is_best_move = False
+        eval_loss = 0
+        better_move = None
+        
+        if 'evaluation' in stockfish_eval or 'eval_before' in stockfish_eval:
+            eval_info = stockfish_eval.get('evaluation', stockfish_eval)
+            is_best_move = eval_info.get('is_best', False)
+            eval_loss = eval_info.get('eval_loss', 0)
+            better_move = eval_info.get('best_move_san')
+        
+        position_entry = {
+            "move_number": move_number,
+            "side": side,
+            "move": move_played,
+            "phase": game_phase,
+            "stockfish_eval": eval_str,
+            "is_best": is_best_move,
+            "better_move": better_move if not is_best_move else None,
+            "eval_loss": eval_loss
+        }
+        positions_info.append(position_entry)
+    return positions_info
+
+def _strip_code_fence(response: str) -> str:
+    """Remove a markdown code block around an LLM JSON response, if present."""
+    if response.startswith("```json"):
+        response = response[7:]
+    if response.startswith("```"):
+        response = response[3:]
+    if response.endswith("```"):
+        response = response[:-3]
+    return response.strip()
+
+def _fit_commentaries(commentaries: List[str], expected: int) -> List[str]:
+    """Pad or truncate LLM commentaries to one per requested move."""
+    if len(commentaries) != expected:
+        print(f"Warning: Expected {expected} commentaries, got {len(commentaries)}")
+        commentaries = list(commentaries[:expected])
+        commentaries.extend(["Position analysis unavailable."] * (expected - len(commentaries)))
+    return commentaries
+
+def analyze_all_positions_batch(positions_data: List[Dict[str, Any]], white_player: str, 
+                               black_player: str, user_alias: str, max_moves_per_batch: int = 100) -> List[str]:
+    """
+    Generate ChatGPT analysis for all positions in batch calls.
+    Will split into multiple batches if game is very long.
+    """
+    client = _get_openai_client()
+    # Only the batching wording varies between calls
+    is_split = len(positions_data) > max_moves_per_batch
+    portion = 'a portion of' if is_split else ''
+    scope = 'some' if is_split else 'all the'
+    
+    def _run_one_batch(batch_start: int) -> List[str]:
+        batch_end = min(batch_start + max_moves_per_batch, len(positions_data))
+        batch_positions = positions_data[batch_start:batch_end]
+        
+        if is_split:
+            print(f"    Processing moves {batch_start+1}-{batch_end} of {len(positions_data)}...")
+        
+        positions_info = _position_entries(batch_positions)
+        
+        # Create the batch prompt
+        prompt = _BATCH_PROMPT_TMPL.format_map({
+            "portion": portion,
+            "white_player": white_player,
+            "black_player": black_player,
+            "user_alias": user_alias,
+            "scope": scope,
+            # Compact JSON: indentation only costs input tokens
+            "positions_json": _json_dumps(positions_info, indent=False),
+        })
+
         start_ts = time.monotonic()
         try:
             completion = client.chat.completions.create(
                 model="gpt-5-nano",
                 messages=[
-                    {"role": "system", "content": "You are a chess instructor. Return ONLY a valid JSON array of commentary strings."},
+                    {"role": "system", "content": _BATCH_SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ],
                 timeout=LLM_REQUEST_TIMEOUT_SECONDS,
@@ -371,59 +425,142 @@ Return ONLY a JSON array of commentary strings, one for each move, in the exact
             print(
                 f"Error calling OpenAI for commentary batch {batch_start + 1}-{batch_end} after {elapsed:.2f}s: {call_err}"
             )
-            all_commentaries.extend([
+            return [
                 f"Move {pos['move_number']}: Analysis unavailable due to LLM error."
                 for pos in batch_positions
-            ])
-            continue
+            ]
 
         # Parse the JSON response
         try:
-            # Clean the response if needed (remove markdown code blocks if present)
-            if response.startswith("```json"):
-                response = response[7:]
-            if response.startswith("```"):
-                response = response[3:]
-            if response.endswith("```"):
-                response = response[:-3]
-            
-            commentaries = json.loads(response.strip())
-            
-            # Validate we got the right number of commentaries
-            if len(commentaries) != len(batch_positions):
-                print(f"Warning: Expected {len(batch_positions)} commentaries, got {len(commentaries)}")
-                # Pad or truncate as needed
-                while len(commentaries) < len(batch_positions):
-                    commentaries.append("Position analysis unavailable.")
-                commentaries = commentaries[:len(batch_positions)]
-            
-            all_commentaries.extend(commentaries)
+            commentaries = _json_loads(_strip_code_fence(response))
+            return _fit_commentaries(commentaries, len(batch_positions))
             
         except json.JSONDecodeError as e:
             print(f"Error parsing ChatGPT JSON response: {e}")
             print(f"Response preview: {response[:500]}...")
             # Fallback: return generic commentaries for this batch
-            all_commentaries.extend([f"Move {pos['move_number']}: Analysis unavailable due to parsing error." 
-                                    for pos in batch_positions])
-                
+            return [f"Move {pos['move_number']}: Analysis unavailable due to parsing error." 
+                    for pos in batch_positions]
+    
+    # Long games are split into batches; their requests run concurrently, results keep move order
+    batch_starts = list(range(0, len(positions_data), max_moves_per_batch))
+    if len(batch_starts) <= 1:
+        return _run_one_batch(0) if batch_starts else []
+    
+    all_commentaries = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(LLM_MAX_CONCURRENCY, len(batch_starts))) as pool:
+        for commentaries in pool.map(_run_one_batch, batch_starts):
+            all_commentaries.extend(commentaries)
     
     return all_commentaries
 
-def analyze_game_combined(pgn_content: str, user_alias: str, stockfish_depth: int = 18, batch_size: int = 140) -> Optional[Dict[str, Any]]:
-    """Analyze a chess game by combining Stockfish evaluation with ChatGPT commentary."""
-    game = get_game_from_pgn(pgn_content)
+_MULTI_GAME_SYSTEM_PROMPT = (
+    "You are a chess instructor. Return ONLY a valid JSON object mapping each game key to an array of commentary strings."
+)
+
+_MULTI_GAME_PROMPT_TMPL = """You are an instructive chess coach analyzing {game_count} short games for {user_alias}.
+
+Each game below starts with a "=== GAME k ===" line naming its players, followed by its moves and their Stockfish evaluations. Please provide educational commentary for EACH move of EACH game.
+
+For each move, provide 2-3 sentences of instructive commentary that:
+1. Explains the key idea behind the move or position
+2. Praises accurate play or suggests improvements when moves are suboptimal
+3. Mentions tactical themes, strategic plans, or instructive patterns
+
+{games_text}
+
+Return ONLY a JSON object with one key per game ("game_1", "game_2", ...). Each value is an array of commentary strings, one for each move of that game, in the exact same order as provided above. Example format:
+{{
+  "game_1": ["Commentary for move 1...", "Commentary for move 2..."],
+  "game_2": ["Commentary for move 1..."]
+}}
+"""
+
+def _estimated_tokens(positions: List[Dict[str, Any]]) -> int:
+    """Rough prompt size of a list of positions, used to pack short games into one call."""
+    return sum(len(pos['move']) + 30 for pos in positions)
+
+def analyze_games_batch(games: List[tuple], user_alias: str) -> List[List[str]]:
+    """
+    Generate ChatGPT analysis for several short games in a single call.
+    games holds (positions_data, white_player, black_player) tuples; one
+    commentary list is returned per game, in the same order.
+    """
+    client = _get_openai_client()
+    games_text = "\n\n".join(
+        f"=== GAME {k} === {white_player} (White) vs {black_player} (Black)\n"
+        + _json_dumps(_position_entries(positions), indent=False)
+        for k, (positions, white_player, black_player) in enumerate(games, 1)
+    )
+    prompt = _MULTI_GAME_PROMPT_TMPL.format_map({
+        "game_count": len(games),
+        "user_alias": user_alias,
+        "games_text": games_text,
+    })
+
+    start_ts = time.monotonic()
+    try:
+        completion = client.chat.completions.create(
+            model="gpt-5-nano",
+            messages=[
+                {"role": "system", "content": _MULTI_GAME_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            timeout=LLM_REQUEST_TIMEOUT_SECONDS,
+        )
+        response = completion.choices[0].message.content.strip()
+        elapsed = time.monotonic() - start_ts
+        if LLM_DEBUG_ENABLED:
+            print(f"LLM commentary for {len(games)} packed games succeeded in {elapsed:.2f}s.")
+    except Exception as call_err:
+        elapsed = time.monotonic() - start_ts
+        print(f"Error calling OpenAI for {len(games)} packed games after {elapsed:.2f}s: {call_err}")
+        return [
+            [f"Move {pos['move_number']}: Analysis unavailable due to LLM error." for pos in positions]
+            for positions, _, _ in games
+        ]
+
+    try:
+        by_game = _json_loads(_strip_code_fence(response))
+        if not isinstance(by_game, dict):
+            raise json.JSONDecodeError("expected a JSON object", response, 0)
+    except json.JSONDecodeError as e:
+        print(f"Error parsing ChatGPT JSON response: {e}")
+        print(f"Response preview: {response[:500]}...")
+        by_game = {}
+    all_commentaries = []
+    for k, (positions, _, _) in enumerate(games, 1):
+        commentaries = by_game.get(f"game_{k}")
+        if isinstance(commentaries, list):
+            all_commentaries.append(_fit_commentaries(commentaries, len(positions)))
+        else:
+            # Fallback: generic commentaries for a game missing from the response
+            all_commentaries.append(
+                [f"Move {pos['move_number']}: Analysis unavailable due to parsing error." for pos in positions]
+            )
+    return all_commentaries
+
+def _prepare_game_analysis(pgn_content: str, user_alias: str, stockfish_depth: int = 18,
+                           engine_threads: Optional[int] = None, llm_mode: str = "critical",
+                           analyzer: Optional[StockfishAnalyzer] = None,
+                           verbose: bool = False) -> Optional[tuple]:
+    """Stockfish half of analyze_game_combined.
+
+    Returns (analysis, llm_indices, llm_positions): the analysis carries
+    templated commentaries only, and llm_positions are the moves at
+    llm_indices that still need LLM commentary (see _apply_commentaries).
+    """
+    game = get_game_from_pgn(pgn_content, verbose)
     if not game:
         print("  Warning: Could not parse PGN file")
         return None
     
     # Validate that the game has moves
-    move_count = len(list(game.mainline_moves()))
-    if move_count == 0:
+    if game.next() is None:
         print("  Warning: Game has no valid moves")
         return None
     
-    white_player = game.headers.get("White", "Unknown")
-    black_player = game.headers.get("Black", "Unknown")
+    white_player, black_player = players_from_headers(game.headers)
     result = game.headers.get("Result", "*")
     date = game.headers.get("Date", "Unknown")
     event = game.headers.get("Event", "Unknown")
@@ -431,8 +568,10 @@ def analyze_game_combined(pgn_content: str, user_alias: str, stockfish_depth: in
     print(f"Analyzing game: {white_player} vs {black_player}")
     print(f"Running Stockfish analysis (depth={stockfish_depth})...")
     
-    # Get detailed Stockfish analysis
-    stockfish_analysis = evaluate_game_detailed(pgn_content, depth=stockfish_depth)
+    # Get detailed Stockfish analysis on the game parsed above
+    stockfish_analysis = evaluate_game_detailed_from_game(
+        game, depth=stockfish_depth, threads=engine_threads, analyzer=analyzer
+    )
     
     # Prepare combined analysis structure
     combined_analysis = {
@@ -449,7 +588,20 @@ def analyze_game_combined(pgn_content: str, user_alias: str, stockfish_depth: in
     
     board = game.board()
     move_number = 0
-    positions_data = []
+    # Per-move columns; move dicts are only assembled for the LLM and the final JSON
+    sides: List[str] = []
+    sans: List[str] = []
+    fens_before: List[str] = []
+    evals: List[Dict[str, Any]] = []
+    evals_formatted: List[str] = []
+    phases: List[str] = []
+    preset_commentaries: List[Optional[str]] = []
+    # Per-move engine numbers for the statistics pass
+    stat_is_white: List[bool] = []
+    stat_eval_loss: List[float] = []
+    stat_cp_before: List[int] = []
+    stat_cp_after: List[int] = []
+    stat_is_best: List[bool] = []
     
     # Add initial position evaluation
     if -1 in stockfish_analysis:
@@ -461,13 +613,12 @@ def analyze_game_combined(pgn_content: str, user_alias: str, stockfish_depth: in
     # First pass: Collect all position data for batch processing
     for move_node in game.mainline():
         move = move_node.move
-        san_move = board.san(move)
         
         # Get Stockfish evaluation for this move
         stockfish_eval = stockfish_analysis.get(move_number, {})
         
         # Determine game phase
-        piece_count = len(board.piece_map())
+        piece_count = chess.popcount(board.occupied)
         if piece_count <= 7:
             game_phase = "endgame"
         elif piece_count >= 28:
@@ -475,107 +626,181 @@ def analyze_game_combined(pgn_content: str, user_alias: str, stockfish_depth: in
         else:
             game_phase = "middlegame"
         
-        # Store position data for batch processing
-        positions_data.append({
-            "move_number": move_number // 2 + 1,
-            "side": "white" if move_number % 2 == 0 else "black",
-            "move": san_move,
-            "fen_before": board.fen(),
-            "stockfish_eval": stockfish_eval,
-            "game_phase": game_phase
-        })
+        # Forced moves have little to teach; skip the LLM for them
+        preset_commentaries.append("Forced move." if len(list(islice(board.legal_moves, 2))) == 1 else None)
         
-        # Make the move on the board
-        board.push(move)
+        if 'eval_loss' in stockfish_eval:
+            stat_is_white.append(move_number % 2 == 0)
+            stat_eval_loss.append(stockfish_eval['eval_loss'] or 0.0)
+            stat_cp_before.append(stockfish_eval.get('eval_before', {}).get('score', {}).get('cp', 0))
+            stat_cp_after.append(stockfish_eval.get('eval_after', {}).get('score', {}).get('cp', 0))
+            stat_is_best.append(bool(stockfish_eval.get('is_best')))
+        
+        fens_before.append(board.fen())
+        
+        # Make the move on the board, reusing the engine's SAN when it has one
+        san_move = stockfish_eval.get("move_played_san")
+        if san_move:
+            board.push(move)
+        else:
+            san_move = board.san_and_push(move)
+        
+        sides.append("white" if move_number % 2 == 0 else "black")
+        sans.append(san_move)
+        evals.append(stockfish_eval)
+        evals_formatted.append(format_stockfish_eval(stockfish_eval))
+        phases.append(game_phase)
         move_number += 1
         
         # Progress indicator
-        if move_number % 10 == 0:
+        if verbose and move_number % 10 == 0:
             print(f"  Processed {move_number} moves...")
     
-    # Batch process all positions with ChatGPT
-    num_batches = (len(positions_data) + batch_size - 1) // batch_size
-    if num_batches > 1:
-        print(f"Generating commentary for {len(positions_data)} moves in {num_batches} batches...")
-    else:
-        print(f"Generating commentary for all {len(positions_data)} moves in a single batch...")
+    move_numbers = [i // 2 + 1 for i in range(move_number)]
     
-    commentaries = analyze_all_positions_batch(
-        positions_data, white_player, black_player, user_alias, max_moves_per_batch=batch_size
-    )
+    # Accurate moves get a templated comment too, classified in one pass over the losses
+    if llm_mode != "all":
+        severities = severities_from_cp_losses([e.get("eval_loss") or 0.0 for e in evals])
+        for i, (stockfish_eval, severity) in enumerate(zip(evals, severities)):
+            if preset_commentaries[i] is None and 'eval_loss' in stockfish_eval and severity in ("best", "good"):
+                preset_commentaries[i] = "Accurate."
     
-    # Second pass: Combine Stockfish analysis with ChatGPT commentary
-    board = game.board()  # Reset board
-    for i, move_node in enumerate(game.mainline()):
-        move = move_node.move
-        
-        # Get the position data and commentary
-        pos_data = positions_data[i]
-        commentary = commentaries[i] if i < len(commentaries) else "Analysis unavailable."
-        
-        # Create the combined move analysis
-        move_analysis = {
-            "move_number": pos_data["move_number"],
-            "side": pos_data["side"],
-            "move": pos_data["move"],
-            "fen_before": pos_data["fen_before"],
-            "stockfish": pos_data["stockfish_eval"],
-            "commentary": commentary
+    # The remaining positions are left for ChatGPT
+    llm_indices = [i for i, preset in enumerate(preset_commentaries) if preset is None]
+    llm_positions = [
+        {
+            "move_number": move_numbers[i],
+            "side": sides[i],
+            "move": sans[i],
+            "fen_before": fens_before[i],
+            "stockfish_eval": evals[i],
+            "stockfish_formatted": evals_formatted[i],
+            "game_phase": phases[i],
         }
-        
-        # Add the move to get fen_after
-        board.push(move)
-        move_analysis["fen_after"] = board.fen()
-        
-        combined_analysis["moves"].append(move_analysis)
+        for i in llm_indices
+    ]
+    
+    # Second pass: zip the columns into the per-move records of the JSON output.
+    # fen_after of each move is the next move's fen_before; the board is now at the final position.
+    fens_after = fens_before[1:] + [board.fen()]
+    combined_analysis["moves"] = [
+        {
+            "move_number": number,
+            "side": side,
+            "move": san,
+            "fen_before": fen_before,
+            "stockfish": stockfish_eval,
+            "stockfish_formatted": formatted,
+            "commentary": commentary,
+            "fen_after": fen_after,
+        }
+        for number, side, san, fen_before, stockfish_eval, formatted, commentary, fen_after in zip(
+            move_numbers, sides, sans, fens_before, evals, evals_formatted, preset_commentaries, fens_after
+        )
+    ]
     
     # Calculate game statistics
-    stats = get_game_statistics([{
-        'side': m['side'],
-        'evaluation': m['stockfish']
-    } for m in combined_analysis['moves'] if 'evaluation' in m['stockfish']])
+    stats = get_game_statistics_from_arrays(
+        np.asarray(stat_is_white, dtype=bool),
+        np.asarray(stat_eval_loss, dtype=np.float32),
+        np.asarray(stat_cp_before, dtype=np.float32),
+        np.asarray(stat_cp_after, dtype=np.float32),
+        np.asarray(stat_is_best, dtype=bool),
+    )
     
     combined_analysis["statistics"] = stats
     
-    print(f"  Analysis complete - processed {len(combined_analysis['moves'])} moves")
+    return combined_analysis, llm_indices, llm_positions
+
+def _apply_commentaries(analysis: Dict[str, Any], llm_indices: List[int], commentaries: List[str]) -> None:
+    """Fill in the LLM commentaries of a prepared analysis; moves still missing one get a placeholder."""
+    moves = analysis["moves"]
+    for i, commentary in zip(llm_indices, commentaries):
+        moves[i]["commentary"] = commentary
+    for move in moves:
+        if not move["commentary"]:
+            move["commentary"] = "Analysis unavailable."
+
+def analyze_game_combined(pgn_content: str, user_alias: str, stockfish_depth: int = 18, batch_size: int = 140,
+                          engine_threads: Optional[int] = None, llm_mode: str = "critical",
+                          analyzer: Optional[StockfishAnalyzer] = None,
+                          verbose: bool = False) -> Optional[Dict[str, Any]]:
+    """Analyze a chess game by combining Stockfish evaluation with ChatGPT commentary.
+
+    Forced moves never go to the LLM. Unless llm_mode is "all", accurate moves
+    (best/good severity) also get a templated comment instead of an LLM one.
+    Pass a running analyzer to reuse its engine instead of starting one per game.
+    verbose adds per-move progress and repair messages.
+    """
+    prepared = _prepare_game_analysis(
+        pgn_content, user_alias, stockfish_depth, engine_threads, llm_mode, analyzer=analyzer, verbose=verbose
+    )
+    if prepared is None:
+        return None
+    return _complete_game_analysis(*prepared, user_alias, batch_size)
+
+def _complete_game_analysis(analysis: Dict[str, Any], llm_indices: List[int], llm_positions: List[Dict[str, Any]],
+                            user_alias: str, batch_size: int) -> Dict[str, Any]:
+    """LLM half of analyze_game_combined: comment on one prepared game on its own."""
+    white_player, black_player = analysis["white"], analysis["black"]
     
-    return combined_analysis
+    # Batch process the remaining positions with ChatGPT
+    llm_commentaries: List[str] = []
+    if llm_positions:
+        num_batches = (len(llm_positions) + batch_size - 1) // batch_size
+        if num_batches > 1:
+            print(f"Generating commentary for {len(llm_positions)} of {len(analysis['moves'])} moves in {num_batches} batches...")
+        else:
+            print(f"Generating commentary for {len(llm_positions)} of {len(analysis['moves'])} moves in a single batch...")
+        
+        llm_commentaries = analyze_all_positions_batch(
+            llm_positions, white_player, black_player, user_alias, max_moves_per_batch=batch_size
+        )
+    else:
+        print("No moves need LLM commentary.")
+    _apply_commentaries(analysis, llm_indices, llm_commentaries)
+    
+    print(f"  Analysis complete - processed {len(analysis['moves'])} moves")
+    
+    return analysis
+
+
+def _side_accuracies(games: List[Dict[str, Any]], side: str) -> np.ndarray:
+    """Accuracy of one side across games, skipping games without statistics for it."""
+    acc = np.fromiter(
+        ((g.get('statistics') or {}).get(side, {}).get('accuracy', np.nan) for g in games),
+        dtype=np.float64, count=len(games),
+    )
+    return acc[~np.isnan(acc)]
 
 
 def generate_overall_analysis(all_games_analysis: List[Dict[str, Any]], user_alias: str) -> str:
     """Generate comprehensive overall analysis based on multiple games."""
-    client = OpenAI()
+    client = _get_openai_client()
     
     if not all_games_analysis:
         return "No games to analyze."
     
-    # Aggregate statistics
+    # Aggregate statistics; accepts full analyses or summary.jsonl records
     total_games = len(all_games_analysis)
-    total_moves = sum(len(g.get('moves', [])) for g in all_games_analysis)
+    total_moves = sum(g.get('move_count', len(g.get('moves', []))) for g in all_games_analysis)
+    white_acc = _side_accuracies(all_games_analysis, 'white')
+    black_acc = _side_accuracies(all_games_analysis, 'black')
+    common_openings = Counter(
+        opening for opening in (g.get('opening', 'Unknown') for g in all_games_analysis) if opening != 'Unknown'
+    )
     
-    # Calculate average statistics
-    avg_white_accuracy = []
-    avg_black_accuracy = []
-    common_openings = {}
-    
-    for game in all_games_analysis:
-        stats = game.get('statistics', {})
-        if 'white' in stats:
-            avg_white_accuracy.append(stats['white'].get('accuracy', 0))
-        if 'black' in stats:
-            avg_black_accuracy.append(stats['black'].get('accuracy', 0))
-        
-        opening = game.get('opening', 'Unknown')
-        if opening != 'Unknown':
-            common_openings[opening] = common_openings.get(opening, 0) + 1
+    w_acc_count, b_acc_count = white_acc.size, black_acc.size
+    avg_white_accuracy = float(white_acc.mean()) if w_acc_count else 0.0
+    avg_black_accuracy = float(black_acc.mean()) if b_acc_count else 0.0
     
     # Prepare statistics summary
     stats_summary = f"""
 Games analyzed: {total_games}
 Total moves: {total_moves}
-Average accuracy as White: {sum(avg_white_accuracy)/len(avg_white_accuracy):.1f}% (across {len(avg_white_accuracy)} games)
-Average accuracy as Black: {sum(avg_black_accuracy)/len(avg_black_accuracy):.1f}% (across {len(avg_black_accuracy)} games)
-Most common openings: {', '.join([f"{k} ({v})" for k, v in sorted(common_openings.items(), key=lambda x: x[1], reverse=True)[:3]])}
+Average accuracy as White: {avg_white_accuracy:.1f}% (across {w_acc_count} games)
+Average accuracy as Black: {avg_black_accuracy:.1f}% (across {b_acc_count} games)
+Most common openings: {', '.join([f"{k} ({v})" for k, v in common_openings.most_common(3)])}
 """
     
     prompt = f"""You are a chess grandmaster and coach providing a comprehensive analysis for {user_alias}.
@@ -618,146 +843,364 @@ Make your advice actionable and encouraging while being honest about areas for i
         fallback = "Overall coaching summary unavailable due to LLM error."
         return stats_summary + "\n" + fallback
 
+def _write_json(path: str, data: Any) -> None:
+    """Write data as indented JSON, using orjson's native encoder when it is installed."""
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    else:
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+
+def _read_json(path: str) -> Any:
+    """Load a JSON file, decoding the raw bytes with orjson when it is installed."""
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r') as f:
+        return json.load(f)
+
 def save_analysis_results(analysis: Dict[str, Any], output_dir: str, game_name: str):
     """Save analysis results in multiple formats."""
     # Save JSON format
     json_file = os.path.join(output_dir, f'{game_name}_analysis.json')
-    with open(json_file, 'w') as f:
-        json.dump(analysis, f, indent=2)
+    _write_json(json_file, analysis)
     print(f"  JSON analysis saved to {json_file}")
     
-    # Save human-readable format
+    # Build the human-readable report, then write it in one call
+    parts = [
+        f"Chess Game Analysis\n",
+        f"{'=' * 70}\n",
+        f"White: {analysis['white']}\n",
+        f"Black: {analysis['black']}\n",
+        f"Result: {analysis.get('result', '*')}\n",
+        f"Date: {analysis.get('date', 'Unknown')}\n",
+        f"Opening: {analysis.get('opening', 'Unknown')} [{analysis.get('eco', '')}]\n",
+        f"\nGame Statistics:\n",
+    ]
+    
+    stats = analysis.get('statistics', {})
+    if 'white' in stats:
+        parts.append(f"  White - Accuracy: {stats['white']['accuracy']:.1f}%, ")
+        parts.append(f"Avg. Loss: {stats['white']['avg_centipawn_loss']:.2f} pawns\n")
+    if 'black' in stats:
+        parts.append(f"  Black - Accuracy: {stats['black']['accuracy']:.1f}%, ")
+        parts.append(f"Avg. Loss: {stats['black']['avg_centipawn_loss']:.2f} pawns\n")
+    
+    parts.append(f"\n{'=' * 70}\n")
+    parts.append("Move-by-Move Analysis\n")
+    parts.append(f"{'=' * 70}\n\n")
+    
+    for move in analysis['moves']:
+        move_num = move['move_number']
+        side = move['side'].capitalize()
+        move_str = move['move']
+        
+        parts.append(f"Move {move_num}. {move_str} ({side})\n")
+        
+        if 'stockfish' in move and move['stockfish']:
+            eval_str = move.get('stockfish_formatted') or format_stockfish_eval(move['stockfish'])
+            parts.append(f"Engine: {eval_str}\n")
+        
+        parts.append(f"Commentary: {move['commentary']}\n")
+        parts.append(f"{'-' * 50}\n\n")
+    
     text_file = os.path.join(output_dir, f'{game_name}_readable.txt')
-    with open(text_file, 'w') as f:
-        f.write(f"Chess Game Analysis\n")
-        f.write(f"{'=' * 70}\n")
-        f.write(f"White: {analysis['white']}\n")
-        f.write(f"Black: {analysis['black']}\n")
-        f.write(f"Result: {analysis.get('result', '*')}\n")
-        f.write(f"Date: {analysis.get('date', 'Unknown')}\n")
-        f.write(f"Opening: {analysis.get('opening', 'Unknown')} [{analysis.get('eco', '')}]\n")
-        f.write(f"\nGame Statistics:\n")
-        
-        stats = analysis.get('statistics', {})
-        if 'white' in stats:
-            f.write(f"  White - Accuracy: {stats['white']['accuracy']:.1f}%, ")
-            f.write(f"Avg. Loss: {stats['white']['avg_centipawn_loss']:.2f} pawns\n")
-        if 'black' in stats:
-            f.write(f"  Black - Accuracy: {stats['black']['accuracy']:.1f}%, ")
-            f.write(f"Avg. Loss: {stats['black']['avg_centipawn_loss']:.2f} pawns\n")
-        
-        f.write(f"\n{'=' * 70}\n")
-        f.write("Move-by-Move Analysis\n")
-        f.write(f"{'=' * 70}\n\n")
-        
-        for move in analysis['moves']:
-            move_num = move['move_number']
-            side = move['side'].capitalize()
-            move_str = move['move']
-            
-            f.write(f"Move {move_num}. {move_str} ({side})\n")
-            
-            if 'stockfish' in move and move['stockfish']:
-                eval_str = format_stockfish_eval(move['stockfish'])
-                f.write(f"Engine: {eval_str}\n")
-            
-            f.write(f"Commentary: {move['commentary']}\n")
-            f.write(f"{'-' * 50}\n\n")
+    with open(text_file, 'wb') as f:
+        f.write(''.join(parts).encode('utf-8'))
     
     print(f"  Readable analysis saved to {text_file}")
 
-def analyze_games(pgn_folder: str, user_alias: str, stockfish_depth: int = 18, 
-                 max_workers: Optional[int] = None, batch_size: int = 180):
-    """Analyze a batch of chess games with combined Stockfish and ChatGPT analysis."""
-    
-    game_data = []
-    all_analyses = []
+def iter_pgn_games(pgn_path: str) -> Iterator[str]:
+    """Yield the raw PGN text of each game in a file, reading it line by line.
 
-    # Collect all PGN files
-    for root, dirs, files in os.walk(pgn_folder):
-        for file in files:
-            if file.endswith(".pgn"):
-                pgn_file_path = os.path.join(root, file)
-                try:
-                    with open(pgn_file_path, 'r') as pgn_file:
-                        pgn_content = pgn_file.read()
-                    if pgn_content:
-                        game_data.append((pgn_content, file))
-                except Exception as e:
-                    print(f"Error reading {file}: {e}")
+    A tag line that follows movetext starts the next game; brace comments that
+    span lines are tracked so a '[' inside them does not split a game.
+    """
+    lines: List[str] = []
+    in_movetext = False
+    comment_depth = 0
+    with open(pgn_path, 'r') as pgn_file:
+        for line in pgn_file:
+            stripped = line.strip()
+            if comment_depth == 0 and in_movetext and stripped.startswith('['):
+                yield ''.join(lines)
+                lines = []
+                in_movetext = False
+            elif stripped and (comment_depth or not stripped.startswith('[')):
+                in_movetext = True
+                comment_depth = max(0, comment_depth + stripped.count('{') - stripped.count('}'))
+            lines.append(line)
+    if any(line.strip() for line in lines):
+        yield ''.join(lines)
 
-    if not game_data:
-        print("No PGN files found in the specified folder.")
-        return False
+def iter_pgn_paths(root: str) -> Iterator[str]:
+    """Yield .pgn paths under root, files before subfolders; symlinked dirs are not followed."""
+    subdirs = []
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.name.endswith(".pgn"):
+                yield entry.path
+    for subdir in subdirs:
+        yield from iter_pgn_paths(subdir)
+
+def iter_games(pgn_folder: str) -> Iterator[tuple]:
+    """Yield (pgn_content, source_path, game_index) for every game under a folder."""
+    for pgn_file_path in iter_pgn_paths(pgn_folder):
+        try:
+            for game_index, pgn_content in enumerate(iter_pgn_games(pgn_file_path), 1):
+                yield pgn_content, pgn_file_path, game_index
+        except Exception as e:
+            print(f"Error reading {os.path.basename(pgn_file_path)}: {e}")
+
+# Engine owned by the current worker process, started once by _init_worker
+_worker_analyzer: Optional[StockfishAnalyzer] = None
+
+
+def _init_worker(stockfish_depth: int, engine_threads: int) -> None:
+    """Worker-process initializer: start one Stockfish that serves every game of this worker."""
+    global _worker_analyzer
+    analyzer = StockfishAnalyzer(depth=stockfish_depth, cache=get_analysis_cache(), threads=engine_threads)
+    analyzer.__enter__()
+    # Workers skip atexit hooks; multiprocessing finalizers still run on shutdown
+    multiprocessing.util.Finalize(analyzer, analyzer.__exit__, args=(None, None, None), exitpriority=10)
+    _worker_analyzer = analyzer
+
+def _summary_record(game_name: str, analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """The per-game fields the run summary needs, small enough for one line of summary.jsonl."""
+    return {
+        "game": game_name,
+        "white": analysis.get("white"),
+        "black": analysis.get("black"),
+        "result": analysis.get("result"),
+        "date": analysis.get("date"),
+        "opening": analysis.get("opening"),
+        "move_count": len(analysis.get("moves", [])),
+        "statistics": analysis.get("statistics"),
+    }
+
+def _load_summary_index(path: str) -> Dict[str, Dict[str, Any]]:
+    """Read summary.jsonl into a dict keyed by game name; later lines win."""
+    index: Dict[str, Dict[str, Any]] = {}
+    if not os.path.exists(path):
+        return index
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                record = _json_loads(line)
+            except ValueError:
+                continue  # torn line from an interrupted run
+            index[record["game"]] = record
+    return index
+
+def _append_summary(path: str, record: Dict[str, Any]) -> None:
+    line = orjson.dumps(record) if orjson is not None else json.dumps(record).encode()
+    with open(path, 'ab') as f:
+        f.write(line + b"\n")
+
+def _is_packable(llm_positions: List[Dict[str, Any]], batch_size: int) -> bool:
+    """Whether a game's LLM positions are small enough to share a request with other short games."""
+    return (
+        bool(llm_positions)
+        and len(llm_positions) <= batch_size
+        and _estimated_tokens(llm_positions) * _LLM_PACK_MIN_GAMES <= LLM_PACK_TOKEN_BUDGET
+    )
+
+def _analyze_game_job(pgn_content: str, user_alias: str, stockfish_depth: int, batch_size: int,
+                      engine_threads: int, llm_mode: str, verbose: bool = False) -> tuple:
+    """Worker-process entry point: analyze one game and report the time it took.
+
+    Short games come back with their LLM commentary pending, as a third
+    (llm_indices, llm_positions) element, so the parent can pack several of
+    them into one request; it is None otherwise.
+    """
+    start_time = time.time()
+    prepared = _prepare_game_analysis(
+        pgn_content, user_alias, stockfish_depth, engine_threads, llm_mode,
+        analyzer=_worker_analyzer, verbose=verbose,
+    )
+    if prepared is None:
+        return None, time.time() - start_time, None
+    analysis, llm_indices, llm_positions = prepared
+    if _is_packable(llm_positions, batch_size):
+        return analysis, time.time() - start_time, (llm_indices, llm_positions)
+    analysis = _complete_game_analysis(analysis, llm_indices, llm_positions, user_alias, batch_size)
+    return analysis, time.time() - start_time, None
+
+def analyze_games(pgn_folder: str, user_alias: str, stockfish_depth: int = 18, 
+                 max_workers: Optional[int] = None, batch_size: int = 180, llm_mode: str = "critical",
+                 verbose: bool = False):
+    """Analyze a batch of chess games with combined Stockfish and ChatGPT analysis.
+
+    verbose turns on per-move progress output from the workers.
+    """
 
-    # Create analysis directory
     analysis_folder = os.path.join(pgn_folder, 'analysis')
-    os.makedirs(analysis_folder, exist_ok=True)
 
-    print(f"\nFound {len(game_data)} PGN files to analyze")
+    # Each game runs its own Stockfish; split the cores between workers
+    workers = max(1, max_workers or os.cpu_count() or 1)
+    engine_threads = max(1, (os.cpu_count() or 1) // workers)
+    # Games are read lazily; only this many are held in memory awaiting a worker
+    max_in_flight = workers * 2
+
+    print(f"\nAnalyzing PGN files in {pgn_folder} with {workers} workers ({engine_threads} engine threads each)")
     print(f"Using Stockfish depth: {stockfish_depth}")
     print(f"ChatGPT batch size: {batch_size} moves per call")
     print(f"Analysis will be saved to: {analysis_folder}\n")
     
+    total_games = 0
     successful_analyses = 0
     failed_analyses = []
+    # Only the per-game summary records are kept; full analyses go straight to disk
+    summaries_by_idx: Dict[int, Dict[str, Any]] = {}
+    summary_index_file = os.path.join(analysis_folder, "summary.jsonl")
+    summary_index = _load_summary_index(summary_index_file)
+
+    def _write_error_log(game_name: str, message: str, details: str) -> None:
+        error_file = os.path.join(analysis_folder, f'{game_name}_error.txt')
+        with open(error_file, 'w') as f:
+            f.write(message)
+            f.write(details)
+        print(f"  Error details saved to {error_file}")
 
-    # Analyze each game
-    for idx, (pgn_content, filename) in enumerate(game_data, 1):
-        game_name = os.path.splitext(filename)[0]
-        analysis_file = os.path.join(analysis_folder, f'{game_name}_analysis.json')
+    def _save(idx: int, game_name: str, analysis: Dict[str, Any], elapsed: float) -> None:
+        nonlocal successful_analyses
+        # Save the analysis
+        save_analysis_results(analysis, analysis_folder, game_name)
+        record = _summary_record(game_name, analysis)
+        _append_summary(summary_index_file, record)
+        summaries_by_idx[idx] = record
         
-        print(f"\n[{idx}/{len(game_data)}] Processing: {filename}")
-        print("=" * 60)
+        print(f"  Total analysis time: {elapsed:.1f} seconds")
+        successful_analyses += 1
+
+    # Short games whose commentary shares one LLM request, and their estimated prompt size
+    packed_games: List[tuple] = []
+    packed_tokens = 0
+
+    def _flush_packed() -> None:
+        nonlocal packed_tokens
+        if len(packed_games) == 1:
+            idx, filename, game_name, analysis, elapsed, llm_indices, llm_positions = packed_games[0]
+            start_time = time.time()
+            _complete_game_analysis(analysis, llm_indices, llm_positions, user_alias, batch_size)
+            _save(idx, game_name, analysis, elapsed + time.time() - start_time)
+        elif packed_games:
+            print(f"\nGenerating commentary for {len(packed_games)} short games in one request...")
+            start_time = time.time()
+            all_commentaries = analyze_games_batch(
+                [(llm_positions, analysis["white"], analysis["black"])
+                 for _, _, _, analysis, _, _, llm_positions in packed_games],
+                user_alias,
+            )
+            llm_elapsed = time.time() - start_time
+            for (idx, filename, game_name, analysis, elapsed, llm_indices, _), commentaries in zip(
+                packed_games, all_commentaries
+            ):
+                print(f"[{idx}] {filename}")
+                _apply_commentaries(analysis, llm_indices, commentaries)
+                _save(idx, game_name, analysis, elapsed + llm_elapsed)
+        packed_games.clear()
+        packed_tokens = 0
+
+    def _queue_packed(idx: int, filename: str, game_name: str, analysis: Dict[str, Any], elapsed: float,
+                      llm_indices: List[int], llm_positions: List[Dict[str, Any]]) -> None:
+        nonlocal packed_tokens
+        tokens = _estimated_tokens(llm_positions)
+        if packed_tokens + tokens > LLM_PACK_TOKEN_BUDGET:
+            _flush_packed()
+        print("  Commentary deferred to a request shared with other short games")
+        packed_games.append((idx, filename, game_name, analysis, elapsed, llm_indices, llm_positions))
+        packed_tokens += tokens
+        if len(packed_games) >= LLM_PACK_MAX_GAMES:
+            _flush_packed()
+
+    def _collect(future) -> None:
+        idx, pgn_content, filename, game_name = futures.pop(future)
         
-        # Check if analysis already exists
-        if os.path.exists(analysis_file):
-            print(f"  Analysis already exists, loading from cache...")
-            try:
-                with open(analysis_file, 'r') as f:
-                    analysis = json.load(f)
-                all_analyses.append(analysis)
-                successful_analyses += 1
-                continue
-            except Exception as e:
-                print(f"  Error loading cached analysis: {e}")
-                print(f"  Re-analyzing...")
+        print(f"\n[{idx}] Finished: {filename}")
+        print("=" * 60)
         
-        # Perform combined analysis
         try:
-            start_time = time.time()
-            analysis = analyze_game_combined(pgn_content, user_alias, stockfish_depth, batch_size)
-            
-            if analysis:
-                # Save the analysis
-                save_analysis_results(analysis, analysis_folder, game_name)
-                all_analyses.append(analysis)
-                
-                elapsed = time.time() - start_time
-                print(f"  Total analysis time: {elapsed:.1f} seconds")
-                successful_analyses += 1
-            else:
-                print(f"  Skipping game due to parsing errors")
-                failed_analyses.append(filename)
-                # Save error log
-                error_file = os.path.join(analysis_folder, f'{game_name}_error.txt')
-                with open(error_file, 'w') as f:
-                    f.write(f"Failed to analyze {filename}\n")
-                    f.write(f"The PGN file may be corrupted or contain illegal moves.\n")
-                    f.write(f"Original PGN content:\n\n{pgn_content}\n")
-                print(f"  Error details saved to {error_file}")
-                
+            analysis, elapsed, pending = future.result()
         except Exception as e:
             print(f"  Error analyzing game: {e}")
             failed_analyses.append(filename)
-            # Save error log
-            error_file = os.path.join(analysis_folder, f'{game_name}_error.txt')
-            with open(error_file, 'w') as f:
-                f.write(f"Error analyzing {filename}: {e}\n")
-                import traceback
-                f.write(traceback.format_exc())
-            print(f"  Error details saved to {error_file}")
-            continue  # Continue with next game
+            import traceback
+            _write_error_log(game_name, f"Error analyzing {filename}: {e}\n", traceback.format_exc())
+            return
+        
+        if analysis and pending:
+            _queue_packed(idx, filename, game_name, analysis, elapsed, *pending)
+        elif analysis:
+            _save(idx, game_name, analysis, elapsed)
+        else:
+            print(f"  Skipping game due to parsing errors")
+            failed_analyses.append(filename)
+            _write_error_log(
+                game_name,
+                f"Failed to analyze {filename}\nThe PGN file may be corrupted or contain illegal moves.\n",
+                f"Original PGN content:\n\n{pgn_content}\n",
+            )
+
+    futures: Dict[concurrent.futures.Future, tuple] = {}
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(stockfish_depth, engine_threads)
+    ) as executor:
+        for idx, (pgn_content, pgn_file_path, game_index) in enumerate(iter_games(pgn_folder), 1):
+            if idx == 1:
+                # Create analysis directory
+                os.makedirs(analysis_folder, exist_ok=True)
+            total_games = idx
+            file = os.path.basename(pgn_file_path)
+            stem = os.path.splitext(file)[0]
+            # First game keeps the file's name so single-game files map as before
+            filename = file if game_index == 1 else f"{file}#{game_index}"
+            game_name = stem if game_index == 1 else f"{stem}_{game_index}"
+            analysis_file = os.path.join(analysis_folder, f'{game_name}_analysis.json')
+            
+            # Reuse an existing analysis unless the PGN file has changed since it was written
+            if os.path.exists(analysis_file) and os.path.getmtime(analysis_file) >= os.path.getmtime(pgn_file_path):
+                print(f"[{idx}] {filename}: analysis already exists, loading from cache...")
+                if game_name in summary_index:
+                    summaries_by_idx[idx] = summary_index[game_name]
+                    successful_analyses += 1
+                    continue
+                try:
+                    # Analyses from before summary.jsonl existed: load once and backfill the index
+                    record = _summary_record(game_name, _read_json(analysis_file))
+                    _append_summary(summary_index_file, record)
+                    summaries_by_idx[idx] = record
+                    successful_analyses += 1
+                    continue
+                except Exception as e:
+                    print(f"  Error loading cached analysis: {e}")
+                    print(f"  Re-analyzing...")
+            
+            if len(futures) >= max_in_flight:
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    _collect(future)
+            
+            print(f"[{idx}] Queued: {filename}")
+            future = executor.submit(
+                _analyze_game_job, pgn_content, user_alias, stockfish_depth, batch_size, engine_threads, llm_mode,
+                verbose,
+            )
+            futures[future] = (idx, pgn_content, filename, game_name)
+
+        for future in concurrent.futures.as_completed(list(futures)):
+            _collect(future)
+        _flush_packed()
+
+    if not total_games:
+        print("No PGN files found in the specified folder.")
+        return False
+
+    # Keep input order regardless of completion order
+    all_analyses = [summaries_by_idx[idx] for idx in sorted(summaries_by_idx)]
     
     # Generate overall analysis
     if all_analyses:
@@ -765,7 +1208,7 @@ def analyze_games(pgn_folder: str, user_alias: str, stockfish_depth: int = 18,
         print("Generating overall analysis for all games...")
         print("=" * 60)
         
-        total_moves = sum(len(a.get('moves', [])) for a in all_analyses)
+        total_moves = sum(a.get('move_count', 0) for a in all_analyses)
         avg_moves_per_game = total_moves // len(all_analyses) if all_analyses else 0
         
         # overall_analysis = generate_overall_analysis(all_analyses, user_alias)
@@ -800,14 +1243,13 @@ def analyze_games(pgn_folder: str, user_alias: str, stockfish_depth: int = 18,
                 for a in all_analyses
             ]
         }
-        with open(summary_file, 'w') as f:
-            json.dump(summary, f, indent=2)
+        _write_json(summary_file, summary)
         
         print(f"Summary statistics saved to: {summary_file}")
     
     print("\n" + "=" * 60)
     print("Analysis complete!")
-    print(f"Successfully analyzed: {successful_analyses}/{len(game_data)} games")
+    print(f"Successfully analyzed: {successful_analyses}/{total_games} games")
     if failed_analyses:
         print(f"Failed to analyze: {', '.join(failed_analyses)}")
     print("=" * 60)
@@ -824,6 +1266,7 @@ Examples:
   python analyze_game.py --pgn_folder ./games --user_alias "John Doe" --depth 18
   python analyze_game.py --pgn_folder ./games --user_alias "John Doe" --workers 1
   python analyze_game.py --pgn_folder ./games --user_alias "John Doe" --batch_size 180
+  python analyze_game.py --pgn_folder ./games --user_alias "John Doe" --llm_mode all
         """
     )
     parser.add_argument("--pgn_folder", required=True, help="Folder containing PGN files to analyze")
@@ -832,6 +1275,10 @@ Examples:
     parser.add_argument("--workers", type=int, default=None, help="Number of parallel workers (default: auto)")
     parser.add_argument("--batch_size", type=int, default=180, 
                        help="Max moves per ChatGPT batch call (default: 180)")
+    parser.add_argument("--llm_mode", choices=["all", "critical"], default="critical",
+                       help="'critical' skips ChatGPT for accurate moves; forced moves are always skipped (default: critical)")
+    parser.add_argument("--verbose", action="store_true",
+                       help="Print per-move progress and PGN repair details")
 
     args = parser.parse_args()
     
@@ -844,7 +1291,8 @@ Examples:
         print(f"Warning: Depth {args.depth} is unusual. Recommended range is 10-20.")
     
     # Run analysis
-    analyze_games(args.pgn_folder, args.user_alias, args.depth, args.workers, args.batch_size)
+    analyze_games(args.pgn_folder, args.user_alias, args.depth, args.workers, args.batch_size, args.llm_mode,
+                  args.verbose)
 
 if __name__ == "__main__":
     main()
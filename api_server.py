@@ -1,6 +1,6 @@
 from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, status, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, ORJSONResponse
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
 from typing import Optional
@@ -15,8 +15,19 @@ except Exception:  # pragma: no cover - optional legacy dependency for v1 tests
     ChessGameDownloader = None
 import os
 import json
+import random
 import uuid
 import asyncio
+import sqlite3
+import threading
+import chess
+import chess.pgn
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:  # optional fast JSON encoder
+    orjson = None
 
 from env_loader import load_env
 
@@ -34,8 +45,10 @@ from auth_service import (
     issue_backend_token,
 )
 from entitlements import DatabaseConfigurationError, EntitlementError, EntitlementStore
-from live_sessions import session_manager
-from analysis_pipeline import analyze_pgn_to_feedback
+from live_sessions import finish_in_thread, run_in_thread, session_engines, session_fen, session_manager
+from engine_pool import engine_pool
+from analysis_pipeline import analyze_pgn_to_feedback, has_movetext
+from llm_coach import coach_move_with_llm, rule_basic, severity_from_cp_loss
 from schemas import AppleAuthRequest, AppStorePurchaseRequest, AppStoreWebhookRequest
 
 # Import redis for exception handling
@@ -107,9 +120,31 @@ entitlement_store = EntitlementStore()
 # Initialize rate limiter
 limiter = Limiter(key_func=get_remote_address)
 
+def _json_dumps(data) -> str:
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data)
+
+
+def _sse(event: str, data) -> str:
+    """Format one server-sent event frame with a JSON payload."""
+    return f"event: {event}\ndata: {_json_dumps(data)}\n\n"
+
+
+def _mover_cps(comparison: dict, mover_is_white: bool):
+    """Return (cp_before, cp_after) from the mover's point of view; None where there is no cp score."""
+    before = comparison["eval_before"].get("score", {}).get("cp")
+    after = comparison["eval_after"].get("score", {}).get("cp")
+    if mover_is_white:
+        return before, after
+    return (None if before is None else -before), (None if after is None else -after)
+
+
 app = FastAPI(
     title="LLM Chess Coach API",
     version="1.0.0",
+    # Endpoint return values are encoded with orjson when it is installed
+    default_response_class=ORJSONResponse if orjson is not None else JSONResponse,
     docs_url="/docs" if os.getenv("ENVIRONMENT") != "production" else None,
     redoc_url="/redoc" if os.getenv("ENVIRONMENT") != "production" else None
 )
@@ -131,11 +166,44 @@ app.add_middleware(
     max_age=600,
 )
 
+# Request IDs only need to be unique, not unpredictable: draw them from a PRNG seeded
+# once instead of reading os.urandom per request. Reseeded in forked workers so they
+# never share a sequence.
+_request_id_rng = random.Random(os.urandom(32))
+os.register_at_fork(after_in_child=lambda: _request_id_rng.seed(os.urandom(32)))
+
+
+def _new_request_id() -> str:
+    return str(uuid.UUID(int=_request_id_rng.getrandbits(128), version=4))
+
+
+# PGN uploads: the text itself is capped at MAX_PGN_CHARS; the request body
+# may be up to three times larger once form-encoded
+MAX_PGN_CHARS = 100_000
+MAX_PGN_BODY_BYTES = 3 * MAX_PGN_CHARS + 8192
+_BODY_LIMITS = {"/v1/runs": MAX_PGN_BODY_BYTES}
+
+
+class BodySizeLimitMiddleware(BaseHTTPMiddleware):
+    """Reject oversized uploads from their Content-Length before the body is read."""
+
+    async def dispatch(self, request: Request, call_next):
+        limit = _BODY_LIMITS.get(request.url.path)
+        if limit is not None and request.method == "POST":
+            length = request.headers.get("content-length")
+            if length is not None:
+                if not length.isdigit():
+                    return JSONResponse(status_code=400, content={"detail": "Invalid Content-Length"})
+                if int(length) > limit:
+                    return JSONResponse(status_code=413, content={"detail": "Request body too large"})
+        return await call_next(request)
+
+
 # Security headers middleware
 class SecurityHeadersMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
         # Add request ID for tracing
-        request_id = str(uuid.uuid4())
+        request_id = _new_request_id()
         request.state.request_id = request_id
 
         # Process request with timing
@@ -166,6 +234,7 @@ class SecurityHeadersMiddleware(BaseHTTPMiddleware):
 
         return response
 
+app.add_middleware(BodySizeLimitMiddleware)
 app.add_middleware(SecurityHeadersMiddleware)
 
 downloader = ChessGameDownloader() if ChessGameDownloader else None
@@ -260,10 +329,10 @@ def _consume_session_game(sess: dict, user_id: int):
 
 
 def _validate_pgn_payload(pgn: str) -> None:
-    if len(pgn) > 100000:
+    if len(pgn) > MAX_PGN_CHARS:
         raise HTTPException(status_code=400, detail="PGN too large (max 100KB)")
-    import chess.pgn
-
+    if not has_movetext(pgn):
+        raise HTTPException(status_code=400, detail="Invalid or empty PGN")
     game = chess.pgn.read_game(StringIO(pgn))
     if game is None or game.end().board().move_stack == []:
         raise HTTPException(status_code=400, detail="Invalid or empty PGN")
@@ -342,46 +411,90 @@ async def analyze(date: str):
     run_id = os.path.basename(folder)
     return {"run_id": run_id}
 
+def _is_within(path: str, root: str) -> bool:
+    return os.path.commonpath([path, root]) == root
+
+def _read_text(path: str) -> str:
+    with open(path) as f:
+        return f.read()
+
 @app.get("/api/analysis/{run_id}")
 async def get_analysis(run_id: str):
-    base_dir = os.path.abspath('games')
-    analysis_root = os.path.normpath(os.path.join(base_dir, run_id, 'analysis'))
-    result = {}
-    if not analysis_root.startswith(base_dir):
+    base_dir = os.path.realpath('games')
+    analysis_root = os.path.realpath(os.path.join(base_dir, run_id, 'analysis'))
+    if not _is_within(analysis_root, base_dir):
         # Prevent path traversal
         return {}
-    if os.path.exists(analysis_root):
-        for file in os.listdir(analysis_root):
-            file_path = os.path.normpath(os.path.join(analysis_root, file))
-            if not file_path.startswith(analysis_root):
-                continue
-            with open(file_path) as f:
-                result[file] = f.read()
-    return result
-
-SCHEDULE_FILE = 'schedules.json'
+    if not os.path.isdir(analysis_root):
+        return {}
 
-def load_schedules():
+    async def json_chunks():
+        # One {"file": "contents"} member per chunk: only one file is held in memory at a time
+        yield "{"
+        separator = ""
+        with os.scandir(analysis_root) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                file_path = entry.path
+                # Only a symlink can lead out of the folder; the entry's type is already cached
+                if entry.is_symlink():
+                    file_path = os.path.realpath(file_path)
+                    if not _is_within(file_path, base_dir):
+                        continue
+                # The response has started, so an unreadable file is left out rather than failing mid-body
+                try:
+                    text = await asyncio.to_thread(_read_text, file_path)
+                except (OSError, UnicodeDecodeError) as e:
+                    logger.warning(f"Skipping unreadable analysis file {entry.name}: {e}")
+                    continue
+                yield f"{separator}{_json_dumps(entry.name)}:{_json_dumps(text)}"
+                separator = ","
+        yield "}"
+
+    return StreamingResponse(json_chunks(), media_type="application/json")
+
+SCHEDULE_FILE = 'schedules.json'  # previous store, imported into SCHEDULE_DB on first use
+SCHEDULE_DB = 'schedules.db'
+_schedule_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
+def _schedule_db() -> sqlite3.Connection:
+    """Open the schedule store once per process; WAL lets workers read while another writes."""
+    conn = sqlite3.connect(SCHEDULE_DB, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS schedules (id TEXT PRIMARY KEY, date TEXT NOT NULL, frequency TEXT NOT NULL)"
+    )
     if os.path.exists(SCHEDULE_FILE):
         with open(SCHEDULE_FILE) as f:
-            return json.load(f)
-    return []
+            legacy = json.load(f)
+        conn.executemany(
+            "INSERT OR IGNORE INTO schedules (id, date, frequency) VALUES (?, ?, ?)",
+            [(s['id'], s['date'], s['frequency']) for s in legacy],
+        )
+    return conn
 
-def save_schedules(data):
-    with open(SCHEDULE_FILE, 'w') as f:
-        json.dump(data, f)
+def load_schedules():
+    with _schedule_lock:
+        rows = _schedule_db().execute("SELECT id, date, frequency FROM schedules ORDER BY rowid").fetchall()
+    return [{'date': date, 'frequency': frequency, 'id': sid} for sid, date, frequency in rows]
+
+def add_schedule_record(date: str, frequency: str) -> None:
+    with _schedule_lock:
+        _schedule_db().execute(
+            "INSERT INTO schedules (id, date, frequency) VALUES (?, ?, ?)", (str(uuid.uuid4()), date, frequency)
+        )
 
 @app.post("/api/schedule")
 async def add_schedule(date: str, frequency: str):
-    schedules = load_schedules()
-    schedules.append({'date': date, 'frequency': frequency, 'id': str(uuid.uuid4())})
-    save_schedules(schedules)
+    await asyncio.to_thread(add_schedule_record, date, frequency)
     return {"status": "scheduled"}
 
 @app.get("/api/dashboard/{username}")
 async def dashboard(username: str):
     # Placeholder summary
-    schedules = load_schedules()
+    schedules = await asyncio.to_thread(load_schedules)
     return {"username": username, "scheduled_jobs": schedules}
 
 
@@ -538,7 +651,7 @@ async def play_move(
         sess = _load_owned_session(session_id, current_user.user_id)
         board = sess["board"]
         parsed_move, _, _ = session_manager._parse_move(board, move)
-        if parsed_move is None or parsed_move not in board.legal_moves:
+        if parsed_move is None:
             raise HTTPException(status_code=400, detail="Illegal move")
         _consume_session_game(sess, current_user.user_id)
         result = await session_manager.apply_move(session_id, move)
@@ -573,14 +686,19 @@ async def stream_move(
     request: Request,
     session_id: str,
     move: str,
+    delta: bool = False,
     current_user: AuthContext = Depends(get_auth_context),
 ):
-    """SSE stream: emits a quick 'basic' event."""
+    """SSE stream: emits a quick 'basic' event, then the full analysis.
+
+    With delta=true the full analysis is sent as an 'extended_v2' event that
+    only carries the fields that differ from the 'basic' preview.
+    """
     try:
         sess = _load_owned_session(session_id, current_user.user_id)
         board = sess["board"]
         m, san, uci = session_manager._parse_move(board, move)
-        if m is None or m not in board.legal_moves:
+        if m is None:
             raise HTTPException(status_code=400, detail="Illegal move")
         _consume_session_game(sess, current_user.user_id)
     except KeyError:
@@ -595,128 +713,140 @@ async def stream_move(
         raise HTTPException(status_code=500, detail="Internal server error")
 
     async def event_gen():
-        # Compute using the same internal pipeline but split into two phases
-        from stockfish_engine import StockfishAnalyzer, DEFAULT_MULTIPV
-        from llm_coach import rule_basic, coach_move_with_llm, severity_from_cp_loss
-        import chess
-
-        fen_before = board.fen()
-        side = "white" if board.turn else "black"
-
-        # Phase 1: quick analysis for basic comment
-        with StockfishAnalyzer(multipv=DEFAULT_MULTIPV, nodes_per_pv=50_000) as analyzer:
-            eval_before = analyzer.analyze_position(board)
-            comparison = analyzer.compare_move(board, m)
-
-        # Build basic feedback object
-        before_cp_white = eval_before.get("score", {}).get("cp")
-        after_cp_white = comparison.get("eval_after", {}).get("score", {}).get("cp")
-        mover_is_white = (side == "white")
-        cp_before = before_cp_white if mover_is_white else (-before_cp_white if before_cp_white is not None else None)
-        cp_after = after_cp_white if mover_is_white else (-after_cp_white if after_cp_white is not None else None)
-        cp_loss = comparison.get("eval_loss", 0.0)
-        best_move_san = eval_before.get("best_move_san")
-        multipv = eval_before.get("pv", [])
-
-        basic_payload = {
-            "move_no": len(sess["moves"]) + 1,
-            "side": side,
-            "san": san,
-            "uci": uci,
-            "fen_before": fen_before,
-            "cp_before": cp_before,
-            "cp_after": cp_after,
-            "cp_loss": cp_loss,
-            "severity": severity_from_cp_loss(cp_loss),
-            "best_move_san": best_move_san,
-            "multipv": multipv,
-        }
-        basic_text = rule_basic(basic_payload)
-        yield f"event: basic\ndata: {json.dumps({'basic': basic_text, 'preview': basic_payload})}\n\n"
-
-        # Phase 2: full analysis for extended
-        with StockfishAnalyzer(multipv=DEFAULT_MULTIPV) as analyzer:
-            # recompute with full budget (~1M per PV configured in analyzer)
-            eval_before_full = analyzer.analyze_position(board)
-            comparison_full = analyzer.compare_move(board, m)
-
-        # Push the move in session now
-        board.push(m)
-        fen_after = board.fen()
-
-        before_cp_white = eval_before_full.get("score", {}).get("cp")
-        after_cp_white = comparison_full.get("eval_after", {}).get("score", {}).get("cp")
-        cp_before = before_cp_white if mover_is_white else (-before_cp_white if before_cp_white is not None else None)
-        cp_after = after_cp_white if mover_is_white else (-after_cp_white if after_cp_white is not None else None)
-        cp_loss = comparison_full.get("eval_loss", 0.0)
-        best_move_san = eval_before_full.get("best_move_san")
-        multipv = eval_before_full.get("pv", [])
-
-        full_payload = {
-            "move_no": len(sess["moves"]) + 1,
-            "side": side,
-            "san": san,
-            "uci": uci,
-            "fen_before": fen_before,
-            "fen_after": fen_after,
-            "cp_before": cp_before,
-            "cp_after": cp_after,
-            "cp_loss": cp_loss,
-            "severity": severity_from_cp_loss(cp_loss),
-            "best_move_san": best_move_san,
-            "multipv": multipv,
-        }
-
-        level = sess.get("skill_level", "intermediate")
-        coach = await coach_move_with_llm(full_payload, level=level)
-
-        full_payload.update(
-            {
-                "basic": coach.get("basic"),
-                "extended": coach.get("extended"),
-            }
-        )
-
-        # Save to session moves
-        sess["moves"].append(full_payload)
-
-        yield f"event: extended\ndata: {json.dumps(full_payload)}\n\n"
-
-        # Get engine move if in play mode
-        if sess.get("game_mode") == "play" and not board.is_game_over():
-            from stockfish_engine import SKILL_LEVEL_MAPPINGS
-            skill_config = SKILL_LEVEL_MAPPINGS.get(sess.get("skill_level", "intermediate"))
-
-            with StockfishAnalyzer(skill_level=skill_config["skill_level"]) as analyzer:
-                engine_response = analyzer.get_engine_move(board, time_limit_ms=skill_config["move_time_ms"])
-
-            if engine_response.get("move_uci"):
-                # Apply engine move
-                engine_move = chess.Move.from_uci(engine_response["move_uci"])
-                board.push(engine_move)
-
-                engine_payload = {
-                    "san": engine_response.get("move_san"),
-                    "uci": engine_response.get("move_uci"),
-                    "fen_after": board.fen(),
-                    "score": engine_response.get("score", {}),
-                    "skill_level": skill_config["skill_level"]
+        # Moves on one session run one at a time, as in SessionManager.apply_move
+        async with session_manager.session_lock(session_id):
+            # Reload: a move applied while this one waited may have changed the position
+            try:
+                sess = session_manager.get(session_id)
+            except KeyError:
+                yield _sse("error", {"error": "Session not found"})
+                return
+            board = sess["board"]
+            m, san, uci = session_manager._parse_move(board, move)
+            if m is None:
+                yield _sse("error", {"error": "Illegal move"})
+                return
+
+            # Engine calls block, so they run in a worker thread and other requests keep being served.
+            # One engine serves the session's moves, so its hash table stays warm between them
+            async with session_engines.use(session_id) as analyzer:
+                # Compute using the same internal pipeline but split into two phases
+                fen_before = session_fen(sess)
+                side = "white" if board.turn else "black"
+
+                # One search deepens from a quick budget (basic comment) to the full one (extended).
+                # It pushes and pops the move on a copy, so the worker thread never touches the session's board
+                stages = analyzer.compare_move_streaming(
+                    board.copy(), m, (min(50_000, analyzer.nodes_per_pv), analyzer.nodes_per_pv)
+                )
+
+                # Phase 1: quick analysis for basic comment
+                comparison = await run_in_thread(next, stages)
+                eval_before = comparison.get("eval_before", {})
+
+                # Build basic feedback object
+                mover_is_white = (side == "white")
+                cp_before, cp_after = _mover_cps(comparison, mover_is_white)
+                cp_loss = comparison.get("eval_loss", 0.0)
+                best_move_san = eval_before.get("best_move_san")
+                multipv = eval_before.get("pv", [])
+
+                basic_payload = {
+                    "move_no": len(sess["moves"]) + 1,
+                    "side": side,
+                    "san": san,
+                    "uci": uci,
+                    "fen_before": fen_before,
+                    "cp_before": cp_before,
+                    "cp_after": cp_after,
+                    "cp_loss": cp_loss,
+                    "severity": severity_from_cp_loss(cp_loss),
+                    "best_move_san": best_move_san,
+                    "multipv": multipv,
                 }
-
-                # Store engine move in session
-                engine_feedback = {
-                    "move_no": len(sess["moves"]),
-                    "side": "white" if board.turn == chess.BLACK else "black",
-                    "san": engine_response.get("move_san"),
-                    "uci": engine_response.get("move_uci"),
-                    "fen_after": board.fen(),
-                    "is_engine_move": True
+                basic_text = rule_basic(basic_payload)
+                # The move number identifies this move's events to clients merging deltas
+                move_id = basic_payload["move_no"]
+                yield _sse("basic", {'id': move_id, 'basic': basic_text, 'preview': basic_payload})
+
+                # Phase 2: the same search continued to the full budget (~1M per PV configured in analyzer)
+                comparison_full = (await run_in_thread(list, stages))[-1]
+                eval_before_full = comparison_full.get("eval_before", {})
+
+                # Push the move in session now
+                board.push(m)
+                fen_after = board.fen()
+
+                cp_before, cp_after = _mover_cps(comparison_full, mover_is_white)
+                cp_loss = comparison_full.get("eval_loss", 0.0)
+                best_move_san = eval_before_full.get("best_move_san")
+                multipv = eval_before_full.get("pv", [])
+
+                full_payload = {
+                    "move_no": len(sess["moves"]) + 1,
+                    "side": side,
+                    "san": san,
+                    "uci": uci,
+                    "fen_before": fen_before,
+                    "fen_after": fen_after,
+                    "cp_before": cp_before,
+                    "cp_after": cp_after,
+                    "cp_loss": cp_loss,
+                    "severity": severity_from_cp_loss(cp_loss),
+                    "best_move_san": best_move_san,
+                    "multipv": multipv,
                 }
-                sess["moves"].append(engine_feedback)
 
-                yield f"event: engine_move\ndata: {json.dumps(engine_payload)}\n\n"
-
-        session_manager.save(sess)
+                level = sess.get("skill_level", "intermediate")
+                # In play mode the session's engine picks its reply while the move is being
+                # coached, as in SessionManager.apply_move
+                engine_search = None
+                if sess.get("game_mode") == "play" and not board.is_game_over():
+                    engine_search = asyncio.ensure_future(
+                        asyncio.to_thread(session_manager._get_engine_move, sess, analyzer)
+                    )
+                try:
+                    coach = await coach_move_with_llm(full_payload, level=level)
+
+                    full_payload.update(
+                        {
+                            # The Phase-1 text stands in when the coach has no basic comment
+                            "basic": coach.get("basic") or basic_text,
+                            "extended": coach.get("extended"),
+                        }
+                    )
+
+                    # Save to session moves
+                    sess["moves"].append(full_payload)
+
+                    if delta:
+                        changed = {k: v for k, v in full_payload.items() if k not in basic_payload or basic_payload[k] != v}
+                        yield _sse("extended_v2", {"id": move_id, "delta": changed})
+                    else:
+                        yield _sse("extended", full_payload)
+                finally:
+                    # Even if the client left, the engine is only checked in once its search is done
+                    engine_move = await finish_in_thread(engine_search) if engine_search is not None else None
+
+                if engine_move:
+                    # The reply was searched on a copy; it is pushed here, on the event loop
+                    board.push(chess.Move.from_uci(engine_move["uci"]))
+                    # Store engine move in session
+                    engine_feedback = {
+                        "move_no": len(sess["moves"]),
+                        "side": "white" if board.turn == chess.BLACK else "black",
+                        "san": engine_move["san"],
+                        "uci": engine_move["uci"],
+                        "fen_after": engine_move["fen_after"],
+                        "is_engine_move": True
+                    }
+                    sess["moves"].append(engine_feedback)
+
+                    yield _sse("engine_move", {**engine_move, "skill_level": sess.get("engine_skill_level")})
+
+                session_manager.save(sess)
+                if board.is_game_over():
+                    session_engines.release(session_id)
 
     return StreamingResponse(event_gen(), media_type="text/event-stream")
 
@@ -739,7 +869,7 @@ async def run_batch_analysis(
     except EntitlementError as exc:
         raise _payment_required(exc)
 
-    summary = await analyze_pgn_to_feedback(pgn, level=level)
+    summary = await analyze_pgn_to_feedback(pgn, level=level, engine_pool=engine_pool)
     if not summary:
         raise HTTPException(status_code=400, detail="Invalid or empty PGN")
     return summary
@@ -0,0 +1,101 @@
+"""Pool of warm Stockfish analyzers shared by request handlers."""
+import asyncio
+import atexit
+import contextlib
+import logging
+import os
+from typing import AsyncIterator, Callable, List, Optional
+
+from analysis_cache import get_analysis_cache
+from stockfish_engine import StockfishAnalyzer, DEFAULT_MULTIPV, DEFAULT_NODES_PER_PV
+
+logger = logging.getLogger(__name__)
+
+# Pooled engines per process; the CPU cores are split between them
+ENGINE_POOL_SIZE = max(1, int(os.getenv("ENGINE_POOL_SIZE", str(min(4, os.cpu_count() or 1)))))
+
+
+def _default_analyzer(size: int) -> StockfishAnalyzer:
+    return StockfishAnalyzer(
+        multipv=DEFAULT_MULTIPV,
+        nodes_per_pv=DEFAULT_NODES_PER_PV,
+        cache=get_analysis_cache(),
+        threads=max(1, (os.cpu_count() or 1) // size),
+    )
+
+
+class EnginePool:
+    """Lends running analyzers out one caller at a time.
+
+    Engines are started on first use and then kept, so requests skip the UCI
+    handshake and network load. Callers wait on an asyncio.Queue while all
+    engines are busy; holding an analyzer is exclusive, so no extra lock is
+    needed around the single-threaded UCI protocol. Each acquire marks a new
+    game (`ucinewgame`) so one caller's hash table does not leak into the
+    next. The queue belongs to the event loop running acquire and is rebuilt
+    if that loop changes.
+    """
+
+    def __init__(self, size: int = ENGINE_POOL_SIZE, factory: Optional[Callable[[], StockfishAnalyzer]] = None):
+        self.size = max(1, int(size))
+        self._factory = factory or (lambda: _default_analyzer(self.size))
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._analyzers: List[StockfishAnalyzer] = []
+
+    @staticmethod
+    def _alive(analyzer: StockfishAnalyzer) -> bool:
+        return analyzer.engine is not None and not analyzer.engine.protocol.returncode.done()
+
+    @staticmethod
+    def _quit(analyzer: StockfishAnalyzer) -> None:
+        try:
+            analyzer.__exit__(None, None, None)
+        except Exception as e:
+            logger.warning(f"Failed to quit pooled engine: {e}")
+
+    def _start(self) -> StockfishAnalyzer:
+        analyzer = self._factory()
+        analyzer.__enter__()
+        return analyzer
+
+    def _ensure_queue(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            # Engines outlive the loop; empty slots are filled on demand
+            for analyzer in self._analyzers:
+                self._queue.put_nowait(analyzer)
+            for _ in range(self.size - len(self._analyzers)):
+                self._queue.put_nowait(None)
+        return self._queue
+
+    @contextlib.asynccontextmanager
+    async def acquire(self) -> AsyncIterator[StockfishAnalyzer]:
+        """Borrow an analyzer, starting or replacing its engine if needed."""
+        queue = self._ensure_queue()
+        analyzer = await queue.get()
+        try:
+            if analyzer is not None and not self._alive(analyzer):
+                self._analyzers.remove(analyzer)
+                self._quit(analyzer)
+                analyzer = None
+            if analyzer is None:
+                analyzer = await asyncio.to_thread(self._start)
+                self._analyzers.append(analyzer)
+            analyzer.newgame()
+            yield analyzer
+        finally:
+            queue.put_nowait(analyzer)
+
+    def close_all(self) -> None:
+        """Quit every pooled engine; the pool starts fresh ones on next use."""
+        analyzers, self._analyzers = self._analyzers, []
+        self._loop = None
+        for analyzer in analyzers:
+            self._quit(analyzer)
+
+
+engine_pool = EnginePool()
+atexit.register(engine_pool.close_all)
@@ -9,11 +9,16 @@ at different skill levels while receiving real-time coaching feedback.
 import requests
 import json
 
+API_URL = "http://localhost:8000"
+
+# One keep-alive connection reused for every call instead of a new one per request
+http = requests.Session()
+
 
 def create_game_session(skill_level="beginner"):
     """Create a new interactive game session."""
-    response = requests.post(
-        "http://localhost:8000/v1/sessions",
+    response = http.post(
+        f"{API_URL}/v1/sessions",
         params={"skill_level": skill_level, "game_mode": "play"}
     )
     return response.json()
@@ -21,8 +26,8 @@ def create_game_session(skill_level="beginner"):
 
 def make_move(session_id, move):
     """Make a move and get feedback plus engine response."""
-    response = requests.post(
-        f"http://localhost:8000/v1/sessions/{session_id}/move",
+    response = http.post(
+        f"{API_URL}/v1/sessions/{session_id}/move",
         params={"move": move}
     )
     return response.json()
@@ -30,7 +35,7 @@ def make_move(session_id, move):
 
 def get_session_status(session_id):
     """Get current game status."""
-    response = requests.get(f"http://localhost:8000/v1/sessions/{session_id}")
+    response = http.get(f"{API_URL}/v1/sessions/{session_id}")
     return response.json()
 
 
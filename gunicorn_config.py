@@ -4,14 +4,23 @@ import multiprocessing
 
 # Server socket
 # Heroku deployment: bind to PORT environment variable
-# VPS deployment: bind to Unix socket
+# VPS deployment: bind to Unix socket (nginx runs on the same host, so no loopback TCP)
+# BIND overrides either default
 IS_HEROKU = os.getenv("DYNO") is not None  # Heroku sets DYNO env var
 if IS_HEROKU:
     port = os.getenv("PORT", "8000")
-    bind = f"0.0.0.0:{port}"
+    default_bind = f"0.0.0.0:{port}"
 else:
-    bind = "unix:/opt/llm-chess-coach/llm-chess-coach.sock"
+    default_bind = "unix:/opt/llm-chess-coach/llm-chess-coach.sock"
+bind = os.getenv("BIND", default_bind)
+if bind.startswith("unix:"):
     umask = 0o007
+# Trust X-Forwarded-* headers from any peer only when nginx is the sole way in and
+# overwrites X-Forwarded-For. The command line can override bind, so deployments
+# behind nginx opt in explicitly (connections over a Unix socket carry no client
+# address to match against)
+if os.getenv("BEHIND_NGINX") == "1":
+    forwarded_allow_ips = "*"
 
 backlog = 2048
 
@@ -19,11 +28,20 @@ backlog = 2048
 workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
 worker_class = "uvicorn.workers.UvicornWorker"
 worker_connections = 1000
+# Import the app (and parse .env) once in the master; workers inherit it on fork.
+# Module-level state is fork-safe: engines, caches and asyncio primitives start lazily
+# in each worker, and database connections are opened per operation
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0"
 max_requests = 1000
 max_requests_jitter = 50
 timeout = 120
+# Worker heartbeat files on tmpfs, so a slow disk cannot delay them into a timeout kill
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
 graceful_timeout = 30
-keepalive = 5
+# Idle keep-alive seconds (uvicorn's timeout_keep_alive). Behind nginx this must
+# outlast nginx's upstream keepalive_timeout (60s) so pooled connections are not
+# closed under it
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5" if IS_HEROKU else "75"))
 
 # Process naming
 proc_name = "llm-chess-coach"
@@ -63,6 +81,10 @@ certfile = None
 
 def on_starting(server):
     """Called just before the master process is initialized."""
+    # Make sure the master has .env in os.environ even without preload_app;
+    # load_env() is memoized, so this is a no-op after the preload import
+    from env_loader import load_env
+    load_env()
     server.log.info("Starting LLM Chess Coach application")
 
 def on_reload(server):
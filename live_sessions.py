@@ -1,10 +1,17 @@
 import uuid
 import time
 import os
+import asyncio
 import json
+import atexit
+import contextlib
 import logging
-from typing import Dict, Any, Optional, Tuple, List
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Any, AsyncIterator, Optional, Tuple, List
 
+import anyio
 import chess
 
 from env_loader import load_env
@@ -17,6 +24,12 @@ try:
 except ImportError:
     REDIS_AVAILABLE = False
 
+try:
+    import orjson
+except ImportError:  # optional fast JSON encoder
+    orjson = None
+
+from analysis_cache import MemoryAnalysisCache
 from stockfish_engine import StockfishAnalyzer, DEFAULT_MULTIPV, DEFAULT_NODES_PER_PV, SKILL_LEVEL_MAPPINGS
 from llm_coach import coach_move_with_llm, severity_from_cp_loss
 
@@ -25,10 +38,301 @@ logger = logging.getLogger(__name__)
 # Session TTL in seconds (24 hours)
 SESSION_TTL = 24 * 60 * 60
 
+# Live analysis engines kept running per process, one per recently active session
+MAX_SESSION_ENGINES = max(1, int(os.getenv("MAX_SESSION_ENGINES", "4")))
+# Session engines unused for this long are stopped (the session keeps working and starts a new one)
+SESSION_ENGINE_IDLE_SECONDS = float(os.getenv("SESSION_ENGINE_IDLE_SECONDS", str(10 * 60)))
+# In-memory sessions kept per process (least recently used are dropped first)
+MAX_SESSIONS = max(1, int(os.getenv("MAX_SESSIONS", "10000")))
+# Locks shared by sessions to serialize moves on each one
+SESSION_LOCK_STRIPES = 64
+# Transposition table per session engine; it is kept for the whole game
+SESSION_ENGINE_HASH_MB = max(1, int(os.getenv("SESSION_ENGINE_HASH_MB", "128")))
+# Live move analysis by player level: (share of the engine's node budget, most PV lines).
+# Weaker players get cheaper searches; levels not listed use the full budget
+SESSION_ANALYSIS_BY_LEVEL = {
+    "beginner": (0.25, 3),
+    "adv_beginner": (0.25, 3),
+    "intermediate": (0.5, 3),
+}
+
+
+@lru_cache(maxsize=256)
+def _template_board(fen: str) -> chess.Board:
+    return chess.Board(fen)
+
+
+def _new_board(fen: Optional[str] = None) -> chess.Board:
+    """Return a fresh board for a FEN, copied from a parsed template (copying is far cheaper than parsing)."""
+    if not fen:
+        return chess.Board()
+    return _template_board(fen).copy(stack=False)
+
+
+def session_fen(sess: Dict[str, Any]) -> str:
+    """FEN of a session's board, reusing the last recorded fen_after while it is in step with the board.
+
+    Every recorded move is one push on the board, so when the history is as long
+    as the move stack and ends with the last pushed move, its fen_after is the
+    current position and board.fen() (the costliest part of recording a move)
+    can be skipped.
+    """
+    board: chess.Board = sess["board"]
+    moves = sess.get("moves")
+    if moves and len(moves) == len(board.move_stack) and moves[-1].get("uci") == board.peek().uci():
+        fen = moves[-1].get("fen_after")
+        if fen:
+            return fen
+    return board.fen()
+
+
+def _analysis_limits(analyzer: StockfishAnalyzer, level: Optional[str]) -> Dict[str, int]:
+    """compare_move limits for a session's player level, scaled down from the analyzer's defaults."""
+    if level not in SESSION_ANALYSIS_BY_LEVEL:
+        return {}
+    scale, max_lines = SESSION_ANALYSIS_BY_LEVEL[level]
+    return {
+        "nodes_per_pv": max(1, int(analyzer.nodes_per_pv * scale)),
+        "nodes_limit": max(1, int(analyzer.nodes_limit * scale)),
+        "multipv": min(analyzer.multipv, max_lines),
+    }
+
+
+async def finish_in_thread(future: "asyncio.Future[Any]") -> Any:
+    """Wait for a worker-thread call even if the caller is cancelled meanwhile, and return its result.
+
+    Threads cannot be stopped, so a cancelled request still waits here before it
+    lets go of its session lock and engine; the cancellation is raised once the
+    thread is done. ASGI servers cancel through anyio cancel scopes, which are
+    shielded against too.
+    """
+    cancelled = False
+    with anyio.CancelScope(shield=True):
+        while not future.done():
+            try:
+                await asyncio.wait((future,))
+            except asyncio.CancelledError:
+                cancelled = True
+    if cancelled:
+        raise asyncio.CancelledError
+    return future.result()
+
+
+async def run_in_thread(func, *args, **kwargs) -> Any:
+    """asyncio.to_thread that runs to completion even if the caller is cancelled (see finish_in_thread)."""
+    return await finish_in_thread(asyncio.ensure_future(asyncio.to_thread(func, *args, **kwargs)))
+
+
+class SessionEngines:
+    """Long-lived analysis engines keyed by session id, bounded as an LRU.
+
+    Sessions may live in Redis, so engines are tracked here per process rather
+    than on the session dict. Reusing one engine for a session's moves skips
+    engine start-up and keeps Stockfish's hash table warm between moves (no
+    `ucinewgame` is sent). Callers hold an engine with `use()` (or
+    checkout/checkin) while searching; engines in use are never quit. The
+    least recently used idle engine is quit once more than max_engines are
+    running, and idle engines left unused for idle_seconds are quit the next
+    time any engine is checked out. An engine released or evicted while in use
+    is quit when its last user checks it in. Engines consult `cache` unless
+    given another one, so positions already searched for any session (opening
+    lines, transpositions) are not searched again.
+    """
+
+    def __init__(self, max_engines: int = MAX_SESSION_ENGINES, cache=None, idle_seconds: float = SESSION_ENGINE_IDLE_SECONDS):
+        self.max_engines = max_engines
+        self.cache = cache
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        # Least recently used first; the last use of each engine is in _last_used
+        self._analyzers: "OrderedDict[str, StockfishAnalyzer]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        # Checked-out engines by id(): [analyzer, users], and engines to quit once their users are done
+        self._users: Dict[int, List[Any]] = {}
+        self._retired: set = set()
+
+    @staticmethod
+    def _alive(analyzer: StockfishAnalyzer) -> bool:
+        return analyzer.engine is not None and not analyzer.engine.protocol.returncode.done()
+
+    @staticmethod
+    def _quit(analyzer: StockfishAnalyzer) -> None:
+        try:
+            analyzer.__exit__(None, None, None)
+        except Exception as e:
+            logger.warning(f"Failed to quit session engine: {e}")
+
+    def _busy(self, analyzer: StockfishAnalyzer) -> bool:
+        return id(analyzer) in self._users
+
+    def _retire(self, sid: str, stale: List[StockfishAnalyzer]) -> None:
+        """Drop a session's engine (under _lock): quit now if idle, else when checked in."""
+        self._last_used.pop(sid, None)
+        analyzer = self._analyzers.pop(sid)
+        if self._busy(analyzer):
+            self._retired.add(id(analyzer))
+        else:
+            stale.append(analyzer)
+
+    def _evict_idle(self, keep: str, now: float, stale: List[StockfishAnalyzer]) -> None:
+        """Quit idle engines past idle_seconds, then idle ones beyond max_engines (under _lock)."""
+        # _analyzers is in order of last use, so each walk stops at the first engine used
+        # recently, or once enough engines were found; engines in use are skipped
+        expired = []
+        for old_sid, analyzer in self._analyzers.items():
+            if now - self._last_used[old_sid] < self.idle_seconds:
+                break
+            if old_sid != keep and not self._busy(analyzer):
+                expired.append(old_sid)
+        for old_sid in expired:
+            self._retire(old_sid, stale)
+        # The pool shrinks back below max_engines once engines in use are checked in
+        excess = len(self._analyzers) - self.max_engines
+        evicted = []
+        for old_sid, analyzer in self._analyzers.items():
+            if len(evicted) >= excess:
+                break
+            if old_sid != keep and not self._busy(analyzer):
+                evicted.append(old_sid)
+        for old_sid in evicted:
+            self._retire(old_sid, stale)
+
+    def checkout(self, sid: str, cache=None) -> StockfishAnalyzer:
+        """Return the running analyzer for a session, starting one if needed, and mark it in use.
+
+        Every checkout must be matched by checkin(); blocks while Stockfish starts.
+        """
+        stale: List[StockfishAnalyzer] = []
+        with self._lock:
+            analyzer = self._analyzers.get(sid)
+            if analyzer is not None and not self._alive(analyzer):
+                # The engine process died; replace it
+                self._retire(sid, stale)
+                analyzer = None
+        if analyzer is None:
+            # Start Stockfish outside the lock so other sessions are not held up
+            started = StockfishAnalyzer(
+                multipv=DEFAULT_MULTIPV,
+                nodes_per_pv=DEFAULT_NODES_PER_PV,
+                cache=cache if cache is not None else self.cache,
+                hash_mb=SESSION_ENGINE_HASH_MB,
+            )
+            try:
+                started.__enter__()
+            except Exception:
+                for old in stale:
+                    self._quit(old)
+                raise
+        with self._lock:
+            if analyzer is None:
+                analyzer = self._analyzers.get(sid)
+                if analyzer is None:
+                    analyzer = self._analyzers[sid] = started
+                else:
+                    # Another caller started this session's engine first
+                    stale.append(started)
+            self._analyzers.move_to_end(sid)
+            now = time.monotonic()
+            self._last_used[sid] = now
+            self._users.setdefault(id(analyzer), [analyzer, 0])[1] += 1
+            self._evict_idle(sid, now, stale)
+        for old in stale:
+            self._quit(old)
+        return analyzer
+
+    def checkin(self, analyzer: StockfishAnalyzer) -> None:
+        """Mark one use of a checked-out analyzer as done, quitting it if it was retired meanwhile."""
+        with self._lock:
+            entry = self._users.get(id(analyzer))
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._users[id(analyzer)]
+            retired = id(analyzer) in self._retired
+            self._retired.discard(id(analyzer))
+            stale: List[StockfishAnalyzer] = [analyzer] if retired else []
+            if not retired:
+                self._evict_idle("", time.monotonic(), stale)
+        for old in stale:
+            self._quit(old)
+
+    @contextlib.asynccontextmanager
+    async def use(self, sid: str, cache=None) -> AsyncIterator[StockfishAnalyzer]:
+        """Hold a session's analyzer for the block; starting and quitting engines run in worker threads.
+
+        Both run to completion even if the caller is cancelled, so no engine is left checked out.
+        """
+        checkout = asyncio.ensure_future(asyncio.to_thread(self.checkout, sid, cache))
+        try:
+            analyzer = await finish_in_thread(checkout)
+        except asyncio.CancelledError:
+            if not checkout.cancelled() and checkout.exception() is None:
+                await run_in_thread(self.checkin, checkout.result())
+            raise
+        try:
+            yield analyzer
+        finally:
+            await run_in_thread(self.checkin, analyzer)
+
+    def get(self, sid: str, cache=None) -> StockfishAnalyzer:
+        """Return the running analyzer for a session without holding it (it may be evicted afterwards)."""
+        analyzer = self.checkout(sid, cache)
+        self.checkin(analyzer)
+        return analyzer
+
+    def release(self, sid: str) -> None:
+        """Quit the engine of a finished or deleted session, once nobody is using it."""
+        stale: List[StockfishAnalyzer] = []
+        with self._lock:
+            if sid in self._analyzers:
+                self._retire(sid, stale)
+        for old in stale:
+            self._quit(old)
+
+    def close_all(self) -> None:
+        with self._lock:
+            analyzers = list(self._analyzers.values())
+            self._analyzers.clear()
+            self._last_used.clear()
+            self._users.clear()
+            self._retired.clear()
+        for analyzer in analyzers:
+            self._quit(analyzer)
+
 
 class SessionManager:
-    def __init__(self):
-        self.sessions: Dict[str, Dict[str, Any]] = {}
+    """In-memory sessions for a single process.
+
+    Like Redis sessions they expire SESSION_TTL seconds after their last use,
+    and at most MAX_SESSIONS are kept (least recently used go first).
+    Expired sessions are dropped lazily when sessions are created.
+    """
+
+    def __init__(self, max_sessions: Optional[int] = None, ttl: float = SESSION_TTL):
+        # Most recently used last; the deadline of each session is in _expires
+        self.sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._expires: Dict[str, float] = {}
+        self.max_sessions = max_sessions if max_sessions is not None else MAX_SESSIONS
+        self.ttl = ttl
+
+    def _evict(self, sid: str) -> None:
+        self.sessions.pop(sid, None)
+        self._expires.pop(sid, None)
+        session_engines.release(sid)
+
+    def _evict_stale(self) -> None:
+        now = time.monotonic()
+        while self.sessions:
+            oldest = next(iter(self.sessions))
+            if self._expires[oldest] > now and len(self.sessions) < self.max_sessions:
+                break
+            self._evict(oldest)
+
+    def _touch(self, sid: str) -> None:
+        self.sessions.move_to_end(sid)
+        self._expires[sid] = time.monotonic() + self.ttl
 
     def create(
         self,
@@ -38,7 +342,7 @@ class SessionManager:
         owner_user_id: Optional[int] = None,
     ) -> Dict[str, Any]:
         sid = str(uuid.uuid4())
-        board = chess.Board(start_fen) if start_fen else chess.Board()
+        board = _new_board(start_fen)
 
         # Map skill level to Stockfish configuration
         skill_config = SKILL_LEVEL_MAPPINGS.get(skill_level, SKILL_LEVEL_MAPPINGS["intermediate"])
@@ -56,7 +360,9 @@ class SessionManager:
             "board": board,
             "moves": [],  # list of move feedback dicts
         }
+        self._evict_stale()
         self.sessions[sid] = sess
+        self._touch(sid)
         return {
             "session_id": sid,
             "fen_start": board.fen(),
@@ -67,6 +373,10 @@ class SessionManager:
     def get(self, sid: str) -> Dict[str, Any]:
         if sid not in self.sessions:
             raise KeyError("Session not found")
+        if self._expires[sid] <= time.monotonic():
+            self._evict(sid)
+            raise KeyError("Session not found")
+        self._touch(sid)
         return self.sessions[sid]
 
     def save(self, sess: Dict[str, Any]) -> None:
@@ -74,21 +384,23 @@ class SessionManager:
         if not sid:
             raise KeyError("Session id missing")
         self.sessions[sid] = sess
+        self._touch(sid)
 
-    def _get_engine_move(self, sess: Dict[str, Any]) -> Dict[str, Any]:
-        """Get engine move for the current position."""
-        board: chess.Board = sess["board"]
+    def _get_engine_move(self, sess: Dict[str, Any], analyzer: StockfishAnalyzer) -> Optional[Dict[str, Any]]:
+        """Pick the engine's move for the current position on the session's (checked-out) analyzer.
+
+        The search runs on a copy of the board, so a worker thread never changes
+        the session; the caller pushes the returned move.
+        """
+        board = sess["board"].copy()
         skill_level = sess.get("engine_skill_level", 8)
         time_ms = sess.get("engine_time_ms", 2000)
 
-        with StockfishAnalyzer(skill_level=skill_level) as analyzer:
-            engine_response = analyzer.get_engine_move(board, time_limit_ms=time_ms)
+        # The session's analysis engine plays the reply at the session's skill level
+        engine_response = analyzer.get_engine_move(board, time_limit_ms=time_ms, skill_level=skill_level)
 
         if engine_response.get("move_uci"):
-            # Parse the move
-            move = chess.Move.from_uci(engine_response["move_uci"])
-            # Apply the move to the board
-            board.push(move)
+            board.push(chess.Move.from_uci(engine_response["move_uci"]))
 
             return {
                 "san": engine_response.get("move_san"),
@@ -99,109 +411,142 @@ class SessionManager:
         return None
 
     def _parse_move(self, board: chess.Board, move_str: str) -> Tuple[Optional[chess.Move], Optional[str], Optional[str]]:
+        """Parse a UCI or SAN move; the returned move is always legal (None otherwise)."""
         # Try UCI first then SAN
         move = None
-        san = None
-        uci = None
         try:
             if len(move_str) in (4, 5):
-                m = chess.Move.from_uci(move_str)
-                if m in board.legal_moves:
-                    move = m
-        except Exception:
+                move = chess.Move.from_uci(move_str)
+        except ValueError:
             pass
-        if move is None:
+        if move is not None:
+            # Well-formed UCI is not retried as SAN, which could only find the same move
+            if not board.is_legal(move):
+                return None, None, None
+            uci = move_str
+        else:
             try:
+                # parse_san only returns legal moves, apart from null moves ("--", "0000")
                 move = board.parse_san(move_str)
             except Exception:
                 return None, None, None
+            if not move:
+                return None, None, None
+            uci = move.uci()
         try:
             san = board.san(move)
         except Exception:
             san = move_str
-        uci = move.uci()
         return move, san, uci
 
+    def session_lock(self, sid: str) -> asyncio.Lock:
+        """Return the lock serializing moves on a session (one of SESSION_LOCK_STRIPES).
+
+        Sessions share a fixed table of locks, so there is nothing to clean up
+        when a session ends. The table belongs to the running event loop and is
+        rebuilt if that loop changes. Locks are per process; Redis sessions used
+        from several workers are not serialized across them.
+        """
+        loop = asyncio.get_running_loop()
+        if getattr(self, "_locks_loop", None) is not loop:
+            self._locks_loop = loop
+            self._locks = [asyncio.Lock() for _ in range(SESSION_LOCK_STRIPES)]
+        return self._locks[hash(sid) % SESSION_LOCK_STRIPES]
+
     async def apply_move(self, sid: str, move_str: str) -> Dict[str, Any]:
+        """Apply a move and its analysis; concurrent moves on one session run one at a time."""
+        async with self.session_lock(sid):
+            return await self._apply_move(sid, move_str)
+
+    async def _apply_move(self, sid: str, move_str: str) -> Dict[str, Any]:
         sess = self.get(sid)
         board: chess.Board = sess["board"]
         move, san, uci = self._parse_move(board, move_str)
-        if move is None or move not in board.legal_moves:
+        if move is None:
             return {"legal": False, "error": "Illegal move"}
 
-        fen_before = board.fen()
-        move_no = len(sess["moves"]) + 1
-        side = "white" if board.turn else "black"
-
-        # Analyze move with MultiPV
-        with StockfishAnalyzer(multipv=DEFAULT_MULTIPV, nodes_per_pv=DEFAULT_NODES_PER_PV) as analyzer:
-            eval_before = analyzer.analyze_position(board)
-            comparison = analyzer.compare_move(board, move)
-
-        # Push the move now
-        board.push(move)
-        fen_after = board.fen()
-
-        # Derive mover-perspective cp_before/after
-        before_cp_white = eval_before.get("score", {}).get("cp")
-        eval_after = comparison.get("eval_after", {})
-        after_cp_white = eval_after.get("score", {}).get("cp")
-        mover_is_white = (side == "white")
-        cp_before = None
-        cp_after = None
-        if before_cp_white is not None and after_cp_white is not None:
-            cp_before = before_cp_white if mover_is_white else -before_cp_white
-            cp_after = after_cp_white if mover_is_white else -after_cp_white
-
-        cp_loss = comparison.get("eval_loss", 0.0)  # already in pawns, mover perspective
-        best_move_san = eval_before.get("best_move_san")
-
-        # Build multipv entries
-        multipv_raw: List[Dict[str, Any]] = eval_before.get("pv", [])
-        multipv = []
-        for e in multipv_raw:
-            multipv.append(
-                {
-                    "move_san": e.get("move_san"),
-                    "move_uci": e.get("move_uci"),
-                    "cp": e.get("cp"),
-                    "mate": e.get("mate"),
-                    "line_san": e.get("line_san", [])[:10],
-                }
-            )
+        return await self._record_move(sess, move, san, uci)
 
-        feedback = {
-            "move_no": move_no,
-            "side": side,
-            "san": san,
-            "uci": uci,
-            "fen_before": fen_before,
-            "fen_after": fen_after,
-            "cp_before": cp_before,
-            "cp_after": cp_after,
-            "cp_loss": cp_loss,
-            "severity": severity_from_cp_loss(cp_loss),
-            "best_move_san": best_move_san,
-            "multipv": multipv,
-        }
+    async def _record_move(self, sess: Dict[str, Any], move: chess.Move, san: str, uci: str) -> Dict[str, Any]:
+        """Analyze and coach a legal move, then push and record it (and the engine's reply in play mode).
+
+        The session's engine is held throughout, so it is not quit while searching.
+        """
+        sid = sess["id"]
+        board: chess.Board = sess["board"]
+        async with session_engines.use(sid) as analyzer:
+            fen_before = session_fen(sess)
+            move_no = len(sess["moves"]) + 1
+            side = "white" if board.turn else "black"
+
+            # Analyze move with MultiPV on the session's engine, reusing its hash table.
+            # Engine calls block, so they run in a worker thread and other requests keep being served.
+            # The thread searches a copy of the board and is waited for even if this request is cancelled
+            limits = _analysis_limits(analyzer, sess.get("skill_level"))
+            # A move among the MultiPV lines is scored from its line, skipping the search after it
+            comparison = await run_in_thread(
+                analyzer.compare_move, board.copy(), move, eval_after_from_pv=True, **limits
+            )
+            eval_before = comparison["eval_before"]
 
-        # Coach via LLM (with rule-based fallback)
-        level = sess.get("skill_level", "intermediate")
-        coach = await coach_move_with_llm(feedback, level=level)
-        feedback.update(
-            {
-                "basic": coach.get("basic"),
-                "source": coach.get("source", "rules"),
+            # Push the move now
+            board.push(move)
+            fen_after = board.fen()
+
+            # Derive mover-perspective cp_before/after
+            before_cp_white = eval_before.get("score", {}).get("cp")
+            eval_after = comparison.get("eval_after", {})
+            after_cp_white = eval_after.get("score", {}).get("cp")
+            mover_is_white = (side == "white")
+            cp_before = None
+            cp_after = None
+            if before_cp_white is not None and after_cp_white is not None:
+                cp_before = before_cp_white if mover_is_white else -before_cp_white
+                cp_after = after_cp_white if mover_is_white else -after_cp_white
+
+            cp_loss = comparison.get("eval_loss", 0.0)  # already in pawns, mover perspective
+            best_move_san = eval_before.get("best_move_san")
+
+            # The analyzer already builds multipv entries with lines of at most PV_LINE_PLIES moves
+            multipv: List[Dict[str, Any]] = eval_before.get("pv", [])
+
+            feedback = {
+                "move_no": move_no,
+                "side": side,
+                "san": san,
+                "uci": uci,
+                "fen_before": fen_before,
+                "fen_after": fen_after,
+                "cp_before": cp_before,
+                "cp_after": cp_after,
+                "cp_loss": cp_loss,
+                "severity": severity_from_cp_loss(cp_loss),
+                "best_move_san": best_move_san,
+                "multipv": multipv,
             }
-        )
 
-        sess["moves"].append(feedback)
+            # Coach via LLM (with rule-based fallback); in play mode the engine picks its
+            # reply meanwhile, since neither needs the other's result
+            level = sess.get("skill_level", "intermediate")
+            engine_move = None
+            if sess.get("game_mode") == "play" and not board.is_game_over():
+                coach, engine_move = await asyncio.gather(
+                    coach_move_with_llm(feedback, level=level),
+                    run_in_thread(self._get_engine_move, sess, analyzer),
+                )
+            else:
+                coach = await coach_move_with_llm(feedback, level=level)
+            feedback.update(
+                {
+                    "basic": coach.get("basic"),
+                    "source": coach.get("source", "rules"),
+                }
+            )
+
+            sess["moves"].append(feedback)
 
-        # Get engine move if in play mode
-        engine_move = None
-        if sess.get("game_mode") == "play" and not board.is_game_over():
-            engine_move = self._get_engine_move(sess)
             if engine_move:
+                board.push(chess.Move.from_uci(engine_move["uci"]))
                 # Store engine move in session history
                 engine_feedback = {
                     "move_no": len(sess["moves"]),
@@ -213,11 +558,14 @@ class SessionManager:
                 }
                 sess["moves"].append(engine_feedback)
 
-        return {
-            "legal": True,
-            "human_feedback": feedback,
-            "engine_move": engine_move
-        }
+            if board.is_game_over():
+                await asyncio.to_thread(session_engines.release, sid)
+
+            return {
+                "legal": True,
+                "human_feedback": feedback,
+                "engine_move": engine_move
+            }
 
     def snapshot(self, sid: str) -> Dict[str, Any]:
         sess = self.get(sid)
@@ -233,6 +581,19 @@ class SessionManager:
         }
 
 
+# Stored in place of a move's fen_before when it equals the previous move's fen_after
+_SAME_FEN = 0
+
+
+def _json_dumps(data: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, separators=(",", ":"))
+
+
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+
 class RedisSessionManager(SessionManager):
     """
     Redis-backed session manager with sliding TTL.
@@ -260,19 +621,57 @@ class RedisSessionManager(SessionManager):
         return f"session:{sid}"
 
     def _serialize_session(self, sess: Dict[str, Any]) -> str:
-        """Serialize session to JSON, converting Board to FEN."""
+        """Serialize session to JSON, converting Board to its starting FEN and UCI moves."""
         serializable = sess.copy()
         if "board" in serializable:
             board: chess.Board = serializable["board"]
             serializable["board_fen"] = board.fen()
+            serializable["board_root_fen"] = board.root().fen()
+            serializable["board_moves"] = [move.uci() for move in board.move_stack]
             del serializable["board"]
-        return json.dumps(serializable)
+        if serializable.get("moves"):
+            serializable["moves"] = self._pack_moves(serializable["moves"])
+        return _json_dumps(serializable)
+
+    @staticmethod
+    def _pack_moves(moves: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Replace each fen_before that repeats the previous entry's fen_after with _SAME_FEN."""
+        packed = []
+        previous_fen = None
+        for move in moves:
+            if previous_fen is not None and move.get("fen_before") == previous_fen:
+                move = {**move, "fen_before": _SAME_FEN}
+            packed.append(move)
+            previous_fen = move.get("fen_after")
+        return packed
+
+    @staticmethod
+    def _unpack_moves(moves: List[Dict[str, Any]]) -> None:
+        previous_fen = None
+        for move in moves:
+            if move.get("fen_before") == _SAME_FEN:
+                move["fen_before"] = previous_fen
+            previous_fen = move.get("fen_after")
 
     def _deserialize_session(self, data: str) -> Dict[str, Any]:
-        """Deserialize session from JSON, converting FEN back to Board."""
-        sess = json.loads(data)
-        if "board_fen" in sess:
-            sess["board"] = chess.Board(sess["board_fen"])
+        """Deserialize session from JSON, replaying the moves so the Board keeps its history.
+
+        The engine is then sent `position ... moves ...` and sees repetitions;
+        sessions saved with only a FEN are still restored from it.
+        """
+        sess = _json_loads(data)
+        if sess.get("moves"):
+            self._unpack_moves(sess["moves"])
+        moves = sess.pop("board_moves", None)
+        root_fen = sess.pop("board_root_fen", None)
+        if moves is not None and root_fen is not None:
+            board = _new_board(root_fen)
+            for uci in moves:
+                board.push(chess.Move.from_uci(uci))
+            sess["board"] = board
+            sess.pop("board_fen", None)
+        elif "board_fen" in sess:
+            sess["board"] = _new_board(sess["board_fen"])
             del sess["board_fen"]
         return sess
 
@@ -293,7 +692,7 @@ class RedisSessionManager(SessionManager):
     ) -> Dict[str, Any]:
         """Create a new session in Redis with 24h TTL."""
         sid = str(uuid.uuid4())
-        board = chess.Board(start_fen) if start_fen else chess.Board()
+        board = _new_board(start_fen)
 
         # Map skill level to Stockfish configuration
         skill_config = SKILL_LEVEL_MAPPINGS.get(skill_level, SKILL_LEVEL_MAPPINGS["intermediate"])
@@ -328,20 +727,27 @@ class RedisSessionManager(SessionManager):
             "skill_level": skill_level
         }
 
-    def get(self, sid: str) -> Dict[str, Any]:
-        """Retrieve session from Redis and refresh TTL."""
+    def get(self, sid: str, refresh_ttl: bool = True) -> Dict[str, Any]:
+        """Retrieve session from Redis and refresh TTL.
+
+        Pass refresh_ttl=False when the session is written back right away
+        (the SETEX resets the TTL anyway).
+        """
         try:
-            data = self.redis_client.get(self._session_key(sid))
+            key = self._session_key(sid)
+            if refresh_ttl:
+                # GET and the sliding-window EXPIRE share one round trip
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.get(key)
+                pipe.expire(key, SESSION_TTL)
+                data, _ = pipe.execute()
+            else:
+                data = self.redis_client.get(key)
             if data is None:
                 raise KeyError("Session not found")
 
             # Deserialize session
-            sess = self._deserialize_session(data)
-
-            # Refresh TTL (sliding window)
-            self._refresh_ttl(sid)
-
-            return sess
+            return self._deserialize_session(data)
         except redis.RedisError as e:
             logger.error(f"Redis error retrieving session {sid}: {e}")
             raise
@@ -351,98 +757,17 @@ class RedisSessionManager(SessionManager):
             logger.error(f"Error retrieving session {sid}: {e}")
             raise
 
-    async def apply_move(self, sid: str, move_str: str) -> Dict[str, Any]:
+    async def _apply_move(self, sid: str, move_str: str) -> Dict[str, Any]:
         """Apply move to session and update Redis with refreshed TTL."""
-        # Get session (this also refreshes TTL)
-        sess = self.get(sid)
+        # The session is written back with SETEX below, which refreshes the TTL
+        sess = self.get(sid, refresh_ttl=False)
         board: chess.Board = sess["board"]
         move, san, uci = self._parse_move(board, move_str)
-        if move is None or move not in board.legal_moves:
+        if move is None:
+            self._refresh_ttl(sid)
             return {"legal": False, "error": "Illegal move"}
 
-        fen_before = board.fen()
-        move_no = len(sess["moves"]) + 1
-        side = "white" if board.turn else "black"
-
-        # Analyze move with MultiPV
-        with StockfishAnalyzer(multipv=DEFAULT_MULTIPV, nodes_per_pv=DEFAULT_NODES_PER_PV) as analyzer:
-            eval_before = analyzer.analyze_position(board)
-            comparison = analyzer.compare_move(board, move)
-
-        # Push the move now
-        board.push(move)
-        fen_after = board.fen()
-
-        # Derive mover-perspective cp_before/after
-        before_cp_white = eval_before.get("score", {}).get("cp")
-        eval_after = comparison.get("eval_after", {})
-        after_cp_white = eval_after.get("score", {}).get("cp")
-        mover_is_white = (side == "white")
-        cp_before = None
-        cp_after = None
-        if before_cp_white is not None and after_cp_white is not None:
-            cp_before = before_cp_white if mover_is_white else -before_cp_white
-            cp_after = after_cp_white if mover_is_white else -after_cp_white
-
-        cp_loss = comparison.get("eval_loss", 0.0)
-        best_move_san = eval_before.get("best_move_san")
-
-        # Build multipv entries
-        multipv_raw: List[Dict[str, Any]] = eval_before.get("pv", [])
-        multipv = []
-        for e in multipv_raw:
-            multipv.append(
-                {
-                    "move_san": e.get("move_san"),
-                    "move_uci": e.get("move_uci"),
-                    "cp": e.get("cp"),
-                    "mate": e.get("mate"),
-                    "line_san": e.get("line_san", [])[:10],
-                }
-            )
-
-        feedback = {
-            "move_no": move_no,
-            "side": side,
-            "san": san,
-            "uci": uci,
-            "fen_before": fen_before,
-            "fen_after": fen_after,
-            "cp_before": cp_before,
-            "cp_after": cp_after,
-            "cp_loss": cp_loss,
-            "severity": severity_from_cp_loss(cp_loss),
-            "best_move_san": best_move_san,
-            "multipv": multipv,
-        }
-
-        # Coach via LLM (with rule-based fallback)
-        level = sess.get("skill_level", "intermediate")
-        coach = await coach_move_with_llm(feedback, level=level)
-        feedback.update(
-            {
-                "basic": coach.get("basic"),
-                "source": coach.get("source", "rules"),
-            }
-        )
-
-        sess["moves"].append(feedback)
-
-        # Get engine move if in play mode
-        engine_move = None
-        if sess.get("game_mode") == "play" and not board.is_game_over():
-            engine_move = self._get_engine_move(sess)
-            if engine_move:
-                # Store engine move in session history
-                engine_feedback = {
-                    "move_no": len(sess["moves"]),
-                    "side": "white" if board.turn == chess.BLACK else "black",
-                    "san": engine_move["san"],
-                    "uci": engine_move["uci"],
-                    "fen_after": engine_move["fen_after"],
-                    "is_engine_move": True
-                }
-                sess["moves"].append(engine_feedback)
+        result = await self._record_move(sess, move, san, uci)
 
         # Update session in Redis with refreshed TTL
         try:
@@ -453,14 +778,11 @@ class RedisSessionManager(SessionManager):
             logger.error(f"Failed to update session {sid} in Redis: {e}")
             raise
 
-        return {
-            "legal": True,
-            "human_feedback": feedback,
-            "engine_move": engine_move
-        }
+        return result
 
     def delete(self, sid: str) -> bool:
         """Explicitly delete a session from Redis."""
+        session_engines.release(sid)
         try:
             result = self.redis_client.delete(self._session_key(sid))
             return result > 0
@@ -514,3 +836,8 @@ def _create_session_manager() -> SessionManager:
 
 
 session_manager = _create_session_manager()
+# Position evaluations shared by every session in this process; an entry from a
+# full-budget search also serves the quick pass of a later stream on the same position
+session_eval_cache = MemoryAnalysisCache(maxsize=4096)
+session_engines = SessionEngines(cache=session_eval_cache)
+atexit.register(session_engines.close_all)
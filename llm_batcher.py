@@ -0,0 +1,82 @@
+"""Coalesce concurrent LLM requests into batched calls."""
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Set
+
+# Defaults: up to 16 requests per call, collected for at most 50 ms
+MAX_BATCH = 16
+MAX_WAIT_MS = 50
+
+
+class Batcher:
+    """Collects items submitted concurrently and hands them to `handler` in batches.
+
+    A batch is dispatched once it holds max_batch items or max_wait_ms after its
+    first item arrived, whichever comes first. handler receives the list of
+    items and returns one result per item, in order; an exception fails every
+    caller of that batch. The queue and worker belong to the event loop that
+    is running when submit is called, and are rebuilt if that loop changes.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch: int = MAX_BATCH,
+        max_wait_ms: float = MAX_WAIT_MS,
+    ):
+        self._handler = handler
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # Keep running dispatches referenced until they finish
+        self._dispatches: Set[asyncio.Task] = set()
+
+    def _ensure_worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def submit(self, item: Any, timeout: Optional[float] = None) -> Any:
+        """Queue an item and wait for its result (asyncio.TimeoutError after `timeout` seconds)."""
+        self._ensure_worker()
+        future = self._loop.create_future()
+        self._queue.put_nowait((item, future))
+        return await asyncio.wait_for(future, timeout)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Callers that already timed out do not need a result
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if batch:
+                task = loop.create_task(self._dispatch(batch))
+                self._dispatches.add(task)
+                task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch: List[tuple]) -> None:
+        try:
+            results = await self._handler([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+        for _, future in batch[len(results):]:
+            if not future.done():
+                future.set_exception(ValueError("LLM batch returned too few results"))
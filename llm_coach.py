@@ -1,11 +1,24 @@
+import asyncio
+import bisect
+import hashlib
 import os
 import json
 import logging
 import time
-from typing import Dict, Any, List, Optional
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
 
 from env_loader import load_env
 
+try:
+    import redis
+except ImportError:  # pragma: no cover - redis is declared in requirements
+    redis = None
+from llm_batcher import MAX_BATCH, MAX_WAIT_MS, Batcher
+
 load_env()
 
 
@@ -27,6 +40,8 @@ def _env_float(name: str, default: float) -> float:
 
 LLM_REQUEST_TIMEOUT_SECONDS = max(0.5, _env_float("LLM_TIMEOUT_SECONDS", _env_float("LLM_TIMEOUT", 8.0)))
 LLM_TOTAL_TIMEOUT_SECONDS = max(LLM_REQUEST_TIMEOUT_SECONDS, _env_float("LLM_TOTAL_TIMEOUT_SECONDS", 12.0))
+# Ask for a JSON object reply (response_format) from models and endpoints that support it
+LLM_JSON_MODE = os.getenv("OPENAI_JSON_MODE") == "1"
 
 
 def _log_llm_event(message: str, exc: Optional[Exception] = None) -> None:
@@ -57,25 +72,33 @@ def _truncate_words(text: str, max_words: int) -> str:
     return " ".join(words[:max_words])
 
 
+# Tunable thresholds (in pawns): each is the inclusive upper bound of a label
+SEVERITY_THRESHOLDS = (0.15, 0.3, 0.60, 1.50)
+SEVERITY_LABELS = ("best", "good", "inaccuracy", "mistake", "blunder")
+
+
+@lru_cache(maxsize=4096)
 def severity_from_cp_loss(cp_loss_pawns: float) -> str:
-    # Tunable thresholds (in pawns)
     cp = abs(cp_loss_pawns)
-    if cp <= 0.15:
-        return "best"
-    if cp <= 0.3:
-        return "good"
-    if cp <= 0.60:
-        return "inaccuracy"
-    if cp <= 1.50:
-        return "mistake"
-    return "blunder"
+    if cp != cp:  # NaN is above every threshold
+        return SEVERITY_LABELS[-1]
+    # bisect_left lands on the first threshold >= cp, matching np.digitize(right=True)
+    return SEVERITY_LABELS[bisect.bisect_left(SEVERITY_THRESHOLDS, cp)]
+
+
+def severities_from_cp_losses(cp_losses_pawns) -> List[str]:
+    """Classify a whole sequence of pawn losses in one vectorized pass."""
+    codes = np.digitize(np.abs(np.asarray(cp_losses_pawns, dtype=np.float64)), SEVERITY_THRESHOLDS, right=True)
+    return [SEVERITY_LABELS[c] for c in codes.tolist()]
 
 
 def rule_basic(move: Dict[str, Any]) -> str:
+    return _rule_basic_text(float(move.get("cp_loss") or 0.0), move.get("best_move_san"))
+
+
+@lru_cache(maxsize=4096)
+def _rule_basic_text(cp_loss: float, best: Optional[str]) -> str:
     # Simple one-liners under 15 words
-    cp_loss = float(move.get("cp_loss") or 0.0)
-    best = move.get("best_move_san")
-    side = move.get("side")
     if severity_from_cp_loss(cp_loss) in ("best", "good"):
         return _truncate_words("Solid move. Keep building your plan.", 15)
     if best:
@@ -86,15 +109,201 @@ def rule_basic(move: Dict[str, Any]) -> str:
 
 
 
+def _structured_move(move: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "san": move.get("san"),
+        "best_move_san": move.get("best_move_san"),
+        "cp_loss": move.get("cp_loss"),
+        "side": move.get("side"),
+        "multipv": move.get("multipv", []),
+    }
+
+
+def _strip_code_fence(content: str) -> str:
+    content = content.strip()
+    if content.startswith("```json"):
+        content = content[7:]
+    if content.startswith("```"):
+        content = content[3:]
+    if content.endswith("```"):
+        content = content[:-3]
+    return content
+
+
+# AsyncOpenAI client reused across coaching calls, with the loop and settings it was made for
+_openai_client: Any = None
+_openai_client_key: Optional[Tuple[Any, ...]] = None
+
+
+def _async_openai_client():
+    """Return the shared AsyncOpenAI client, building a new one if the loop or settings changed.
+
+    Its HTTP connections (and TLS sessions) are kept between calls; they belong
+    to the event loop they were opened on, so each loop gets its own client.
+    """
+    from openai import AsyncOpenAI
+
+    global _openai_client, _openai_client_key
+    key = (
+        asyncio.get_running_loop(),
+        os.getenv("OPENAI_API_KEY"),
+        os.getenv("OPENAI_API_ENDPOINT", "https://api.openai.com/v1"),
+    )
+    if _openai_client is None or _openai_client_key != key:
+        _openai_client = AsyncOpenAI(api_key=key[1], base_url=key[2], timeout=LLM_REQUEST_TIMEOUT_SECONDS)
+        _openai_client_key = key
+    return _openai_client
+
+
+async def _coach_batch(items: List[Tuple[Dict[str, Any], str]]) -> List[Optional[Dict[str, Any]]]:
+    """Send one chat completion for a batch of (move, level) items.
+
+    A single item keeps the one-move prompt; several share one prompt that asks
+    for a JSON array with an object per move. Items the reply does not cover
+    come back as None.
+    """
+    openai_client = _async_openai_client()
+    model_name = os.getenv("OPENAI_MODEL", "gpt-4")
+
+    if len(items) == 1:
+        move, level = items[0]
+        prompt = (
+            "You are a concise chess coach. Given a move and engine data, "
+            "return JSON with: basic (<=40 words) "
+            f"Player level: {level}. Ground advice in PV; do not contradict engine.\n\n"
+            f"Data:\n{json.dumps(_structured_move(move))}\n\n"
+            "Return only a JSON object with keys: basic."
+        )
+    else:
+        moves = [{**_structured_move(move), "level": level} for move, level in items]
+        prompt = (
+            f"You are a concise chess coach. Given {len(items)} independent moves with engine data, "
+            "write basic advice (<=40 words) for each, suited to its player level. "
+            "Ground advice in PV; do not contradict engine.\n\n"
+            f"Moves:\n{json.dumps(moves)}\n\n"
+        )
+        if LLM_JSON_MODE:
+            # JSON mode replies are always an object, so the array is wrapped in one
+            prompt += (
+                f'Return only a JSON object {{"moves": [...]}} whose array holds {len(items)} objects, '
+                "one per move in the same order, each with keys: basic."
+            )
+        else:
+            prompt += f"Return only a JSON array of {len(items)} objects, one per move in the same order, each with keys: basic."
+
+    completion = await openai_client.chat.completions.create(
+        model=model_name,
+        messages=[
+            {"role": "system", "content": "You are a concise chess coach that outputs strict JSON."},
+            {"role": "user", "content": prompt},
+        ],
+        **({"response_format": {"type": "json_object"}} if LLM_JSON_MODE else {}),
+    )
+    # Some compatible endpoints fence the reply even in JSON mode; stripping is a no-op otherwise
+    parsed = json.loads(_strip_code_fence(completion.choices[0].message.content))
+    if len(items) == 1:
+        return [parsed]
+    if isinstance(parsed, dict):
+        parsed = parsed.get("moves")
+    if not isinstance(parsed, list):
+        raise ValueError("expected a JSON array for a batched coaching request")
+    objects = [obj if isinstance(obj, dict) else None for obj in parsed[: len(items)]]
+    return objects + [None] * (len(items) - len(objects))
+
+
+# Concurrent coaching requests (live streams, critical moves of one game) share calls
+_coach_batcher = Batcher(
+    _coach_batch,
+    max_batch=int(os.getenv("LLM_BATCH_MAX_SIZE", str(MAX_BATCH))),
+    max_wait_ms=_env_float("LLM_BATCH_MAX_WAIT_MS", float(MAX_WAIT_MS)),
+)
+
+
+# LLM coaching for the same move from the same position is reused across sessions
+LLM_COACH_CACHE_SIZE = max(0, int(os.getenv("LLM_COACH_CACHE_SIZE", "10000")))
+LLM_COACH_CACHE_TTL_SECONDS = _env_float("LLM_COACH_CACHE_TTL_SECONDS", 24 * 60 * 60)
+_coach_cache: "OrderedDict[Tuple[str, str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+
+def _coach_cache_key(move: Dict[str, Any], level: str) -> Optional[Tuple[str, str, str]]:
+    fen = move.get("fen_before")
+    uci = move.get("uci")
+    if not fen or not uci:
+        return None
+    # Placement, side to move, castling and en passant; the move clocks do not change the advice
+    return (fen.rsplit(" ", 2)[0], uci, level)
+
+
+def _cached_coaching(key: Tuple[str, str, str]) -> Optional[Dict[str, Any]]:
+    entry = _coach_cache.get(key)
+    if entry is None:
+        return None
+    stored_at, obj = entry
+    if time.monotonic() - stored_at > LLM_COACH_CACHE_TTL_SECONDS:
+        del _coach_cache[key]
+        return None
+    _coach_cache.move_to_end(key)
+    return dict(obj)
+
+
+def _store_coaching(key: Tuple[str, str, str], obj: Dict[str, Any]) -> None:
+    _coach_cache[key] = (time.monotonic(), dict(obj))
+    _coach_cache.move_to_end(key)
+    while len(_coach_cache) > LLM_COACH_CACHE_SIZE:
+        _coach_cache.popitem(last=False)
+
+
+@lru_cache(maxsize=1)
+def _coach_redis():
+    """Redis client sharing cached coaching between workers, or None when REDIS_URL is not set."""
+    redis_url = os.getenv("REDIS_URL")
+    if not redis_url or redis is None:
+        return None
+    try:
+        return redis.from_url(redis_url, decode_responses=True, socket_connect_timeout=1, socket_timeout=1)
+    except Exception as e:
+        logger.warning(f"Coaching cache not shared through Redis: {e}")
+        return None
+
+
+def _redis_coach_key(key: Tuple[str, str, str]) -> str:
+    return "coach:" + hashlib.sha1("|".join(key).encode()).hexdigest()
+
+
+def _shared_coaching(key: Tuple[str, str, str]) -> Optional[Dict[str, Any]]:
+    """Coaching another worker stored in Redis. Blocks on Redis, so it runs in a worker thread."""
+    client = _coach_redis()
+    if client is None:
+        return None
+    try:
+        raw = client.get(_redis_coach_key(key))
+        obj = json.loads(raw) if raw else None
+    except Exception as e:
+        logger.debug(f"Shared coaching cache lookup failed: {e}")
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
+def _share_coaching(key: Tuple[str, str, str], obj: Dict[str, Any]) -> None:
+    client = _coach_redis()
+    if client is None:
+        return
+    try:
+        client.setex(_redis_coach_key(key), int(LLM_COACH_CACHE_TTL_SECONDS), json.dumps(obj))
+    except Exception as e:
+        logger.debug(f"Shared coaching cache store failed: {e}")
+
+
 async def coach_move_with_llm(move: Dict[str, Any], level: str = "intermediate", use_llm: bool = True) -> Dict[str, Any]:
     """Attempt to get LLM-generated basic feedback. Fallback to rules on error.
 
     move: dict with fields (san, cp_loss, best_move_san, multipv[], fen_before, side, ...)
+    Requests made at the same time are coalesced into batched LLM calls, and
+    LLM answers are cached by (position, uci, level) for LLM_COACH_CACHE_TTL_SECONDS,
+    and shared with the other workers through Redis when REDIS_URL is set.
     """
     # Use OPENAI_API_KEY consistently
     API_KEY = os.getenv("OPENAI_API_KEY")
-    API_ENDPOINT = os.getenv("OPENAI_API_ENDPOINT", "https://api.openai.com/v1")
-    MODEL_NAME = os.getenv("OPENAI_MODEL", "gpt-4")
 
     # Always build safe defaults
     result = {
@@ -109,50 +318,29 @@ async def coach_move_with_llm(move: Dict[str, Any], level: str = "intermediate",
         _log_missing_key()
         return result
 
-    from openai import AsyncOpenAI
-
-    # Instantiate async client
-    openai_client = AsyncOpenAI(
-        api_key=API_KEY,
-        base_url=API_ENDPOINT,
-    )
-    structured = {
-        "san": move.get("san"),
-        "best_move_san": move.get("best_move_san"),
-        "cp_loss": move.get("cp_loss"),
-        "side": move.get("side"),
-        "multipv": move.get("multipv", []),
-    }
-
-    prompt = (
-        "You are a concise chess coach. Given a move and engine data, "
-        "return JSON with: basic (<=40 words) "
-        f"Player level: {level}. Ground advice in PV; do not contradict engine.\n\n"
-        f"Data:\n{json.dumps(structured)}\n\n"
-        "Return only a JSON object with keys: basic."
-    )
-
+    cache_key = _coach_cache_key(move, level) if LLM_COACH_CACHE_SIZE else None
+    if cache_key is not None:
+        cached = _cached_coaching(cache_key)
+        if cached is None:
+            # Redis calls block, so they run in a worker thread and keep the event loop free
+            cached = await asyncio.to_thread(_shared_coaching, cache_key)
+            if cached is not None:
+                # Kept in this worker's cache too
+                _store_coaching(cache_key, cached)
+        if cached is not None:
+            return cached
 
     last_err: Optional[Exception] = None
     try:
-        completion = await openai_client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": "You are a concise chess coach that outputs strict JSON."},
-                {"role": "user", "content": prompt},
-            ],
-        )
-        content = completion.choices[0].message.content.strip()
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-        obj = json.loads(content)
+        obj = await _coach_batcher.submit((move, level), timeout=LLM_TOTAL_TIMEOUT_SECONDS)
+        if obj is None:
+            raise ValueError("no coaching returned for this move")
         # Enforce length limits
         obj["basic"] = _truncate_words(obj.get("basic", result["basic"]) or result["basic"], 50)
         obj["source"] = "llm"
+        if cache_key is not None:
+            _store_coaching(cache_key, obj)
+            await asyncio.to_thread(_share_coaching, cache_key, obj)
         return obj
     except Exception as e:
         last_err = e
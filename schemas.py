@@ -35,6 +35,7 @@ class MoveFeedback(BaseModel):
     cp_before: Optional[int] = None  # from mover perspective
     cp_after: Optional[int] = None   # from mover perspective
     cp_loss: Optional[float] = None  # in pawns (positive is worse for mover)
+    cp_loss_cp: Optional[int] = None  # same loss in whole centipawns
     severity: Severity = "good"
     best_move_san: Optional[str] = None
     multipv: List[MultiPVEntry] = Field(default_factory=list)
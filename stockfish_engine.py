@@ -3,9 +3,15 @@
 import chess
 import chess.engine
 import chess.pgn
+import contextlib
 import os
 import io
-from typing import Dict, List, Optional, Any
+import itertools
+from typing import Dict, Iterator, List, Optional, Any, Sequence
+
+import numpy as np
+
+from analysis_cache import AnalysisCache, get_analysis_cache
 
 # Set STOCKFISH_PATH from environment or default path
 STOCKFISH_PATH = os.getenv('STOCKFISH_PATH', 'stockfish')
@@ -13,6 +19,8 @@ STOCKFISH_PATH = os.getenv('STOCKFISH_PATH', 'stockfish')
 # Defaults for MVP
 DEFAULT_MULTIPV = int(os.getenv('MULTIPV', '5'))
 DEFAULT_NODES_PER_PV = int(os.getenv('NODES_PER_PV', '1000000'))
+# Moves of each principal variation rendered as SAN in analysis results
+PV_LINE_PLIES = 10
 
 # Skill level mappings for different player levels
 SKILL_LEVEL_MAPPINGS = {
@@ -34,6 +42,9 @@ class StockfishAnalyzer:
         multipv: int = DEFAULT_MULTIPV,
         nodes_per_pv: int = DEFAULT_NODES_PER_PV,
         skill_level: Optional[int] = None,
+        cache: Optional[AnalysisCache] = None,
+        threads: Optional[int] = None,
+        hash_mb: Optional[int] = None,
     ):
         """Initialize the Stockfish analyzer.
 
@@ -42,6 +53,9 @@ class StockfishAnalyzer:
         - multipv: number of PVs to compute
         - nodes_per_pv: approximate nodes budget per PV (total nodes ≈ multipv * nodes_per_pv)
         - skill_level: Stockfish skill level (0-20) for playing moves, None for analysis mode
+        - cache: optional AnalysisCache (or MemoryAnalysisCache) consulted before searching a position
+        - threads: engine search threads (default: min(8, CPU count))
+        - hash_mb: transposition table size in MB (default: the engine's own)
         """
         self.engine_path = engine_path
         self.depth = depth
@@ -49,8 +63,12 @@ class StockfishAnalyzer:
         self.multipv = max(1, int(multipv))
         self.nodes_per_pv = max(10_000, int(nodes_per_pv))
         self.skill_level = skill_level
+        self.cache = cache
         self.engine = None
-        self.num_threads = min(8, os.cpu_count())
+        self.num_threads = max(1, int(threads)) if threads else min(8, os.cpu_count())
+        self.hash_mb = max(1, int(hash_mb)) if hash_mb else None
+        # Changing this token makes python-chess send `ucinewgame` on the next search
+        self._game_token = None
 
     
     def __enter__(self):
@@ -58,6 +76,8 @@ class StockfishAnalyzer:
         self.engine = chess.engine.SimpleEngine.popen_uci(self.engine_path)
         # Configure base settings
         config = {"Threads": self.num_threads}
+        if self.hash_mb is not None:
+            config["Hash"] = self.hash_mb
         # Add skill level if specified (for playing mode)
         if self.skill_level is not None:
             config["Skill Level"] = max(0, min(20, self.skill_level))
@@ -68,6 +88,11 @@ class StockfishAnalyzer:
         """Context manager exit - quit the engine."""
         if self.engine:
             self.engine.quit()
+            self.engine = None
+
+    def newgame(self) -> None:
+        """Tell the engine the next position belongs to a new game (UCI `ucinewgame`)."""
+        self._game_token = object()
     
     def analyze_position(
         self,
@@ -95,6 +120,11 @@ class StockfishAnalyzer:
         npp = nodes_per_pv if nodes_per_pv is not None else self.nodes_per_pv
         # Aim for ~1M nodes per PV by scaling total node budget
         analysis_node_limit = max(npp * mpv, nodes_limit if nodes_limit is not None else self.nodes_limit)
+
+        if self.cache is not None:
+            cached = self.cache.get(board, mpv, analysis_node_limit)
+            if cached is not None:
+                return cached
         
         try:
             # Request MultiPV analysis
@@ -102,93 +132,156 @@ class StockfishAnalyzer:
                 board,
                 chess.engine.Limit(nodes=analysis_node_limit),
                 multipv=mpv,
+                game=self._game_token,
             )
 
             # Normalize to list
             if isinstance(infos, dict):
                 infos = [infos]
 
-            multipv_entries: List[Dict[str, Any]] = []
-            best_move = None
-            best_move_san = None
-            top_score_dict = {}
-
-            # Collect PVs
-            for idx, info in enumerate(infos):
-                score = info.get('score', chess.engine.Cp(0))
-                score_dict = {}
-                if score.is_mate():
-                    score_dict['mate'] = score.white().mate()
-                else:
-                    cp_score = score.white().score()
-                    score_dict['cp'] = cp_score if cp_score is not None else 0
-
-                pv = info.get('pv', [])
-                pv_san = []
-                move_uci = str(pv[0]) if pv else None
-                move_san = None
-
-                if pv:
-                    temp_board = board.copy()
-                    for j, move in enumerate(pv[:10]):
-                        try:
-                            san = temp_board.san(move)
-                            pv_san.append(san)
-                            if j == 0:
-                                move_san = san
-                            temp_board.push(move)
-                        except Exception:
-                            break
-
-                entry = {
-                    'move_san': move_san,
-                    'move_uci': move_uci,
-                    'cp': score_dict.get('cp'),
-                    'mate': score_dict.get('mate'),
-                    'line_san': pv_san,
-                }
-                multipv_entries.append(entry)
-
-                if idx == 0:
-                    best_move = move_uci
-                    best_move_san = move_san
-                    top_score_dict = score_dict
-
-            # Use info from the top PV to populate summary fields
-            # Try to pick nodes/time from first info object
-            nodes_val = 0
-            time_val = 0.0
-            if infos:
-                nodes_val = infos[0].get('nodes', 0)
-                time_val = infos[0].get('time', 0.0)
-
-            return {
-                'score': top_score_dict,
-                'best_move': best_move,
-                'best_move_san': best_move_san,
-                'pv': multipv_entries,  # MultiPV list
-                'depth': analysis_depth,
-                'nodes': nodes_val,
-                'time': time_val,
-            }
+            result = self._result_from_infos(board, infos, analysis_depth)
+            if self.cache is not None:
+                self.cache.put(board, mpv, analysis_node_limit, result)
+            return result
             
         except Exception as e:
-            print(f"Error analyzing position: {e}")
-            return {
-                'score': {'cp': 0},
-                'best_move': None,
-                'best_move_san': None,
-                'pv': [],
-                'pv_san': [],
-                'depth': analysis_depth,
-                'error': str(e)
-            }
+            return self._error_result(e, analysis_depth)
     
+    def analyze_position_streaming(
+        self,
+        board: chess.Board,
+        node_budgets: Sequence[int],
+        multipv: Optional[int] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Analyze a position with a single search, reporting as it deepens.
+
+        node_budgets are increasing nodes-per-PV budgets; the search runs to the
+        last one and yields one analyze_position-shaped result as each budget is
+        reached. If the search stops early (or the cache covers the full
+        budget), the remaining budgets all get the final result.
+        """
+        if not self.engine:
+            raise RuntimeError("Engine not initialized. Use within context manager.")
+
+        mpv = multipv if multipv is not None else self.multipv
+        pending = [budget * mpv for budget in node_budgets]
+        full_budget = pending[-1]
+
+        if self.cache is not None:
+            cached = self.cache.get(board, mpv, full_budget)
+            if cached is not None:
+                for _ in pending:
+                    yield cached
+                return
+
+        # Positions with fewer legal moves than MultiPV report fewer lines
+        expected_lines = min(mpv, board.legal_moves.count())
+        try:
+            with self.engine.analysis(
+                board, chess.engine.Limit(nodes=full_budget), multipv=mpv, game=self._game_token
+            ) as analysis:
+                for info in analysis:
+                    while (
+                        len(pending) > 1
+                        and info.get('nodes', 0) >= pending[0]
+                        and len(analysis.multipv) >= expected_lines
+                    ):
+                        pending.pop(0)
+                        yield self._result_from_infos(board, analysis.multipv, self.depth)
+                final = self._result_from_infos(board, analysis.multipv, self.depth)
+            if self.cache is not None:
+                self.cache.put(board, mpv, full_budget, final)
+        except Exception as e:
+            final = self._error_result(e, self.depth)
+        for _ in pending:
+            yield final
+    
+    @staticmethod
+    def _result_from_infos(board: chess.Board, infos: List[Dict[str, Any]], analysis_depth: int) -> Dict[str, Any]:
+        """Build the analyze_position result from the engine's info dicts, one per PV."""
+        multipv_entries: List[Dict[str, Any]] = []
+        best_move = None
+        best_move_san = None
+        top_score_dict = {}
+
+        # Collect PVs
+        for idx, info in enumerate(infos):
+            score = info.get('score', chess.engine.Cp(0))
+            score_dict = {}
+            if score.is_mate():
+                score_dict['mate'] = score.white().mate()
+            else:
+                cp_score = score.white().score()
+                score_dict['cp'] = cp_score if cp_score is not None else 0
+
+            pv = info.get('pv', [])
+            pv_san = []
+            move_uci = str(pv[0]) if pv else None
+            move_san = None
+
+            if pv:
+                temp_board = board.copy()
+                for j, move in enumerate(itertools.islice(pv, PV_LINE_PLIES)):
+                    try:
+                        san = temp_board.san_and_push(move)
+                        pv_san.append(san)
+                        if j == 0:
+                            move_san = san
+                    except Exception:
+                        break
+
+            entry = {
+                'move_san': move_san,
+                'move_uci': move_uci,
+                'cp': score_dict.get('cp'),
+                'mate': score_dict.get('mate'),
+                'line_san': pv_san,
+            }
+            multipv_entries.append(entry)
+
+            if idx == 0:
+                best_move = move_uci
+                best_move_san = move_san
+                top_score_dict = score_dict
+
+        # Use info from the top PV to populate summary fields
+        # Try to pick nodes/time from first info object
+        nodes_val = 0
+        time_val = 0.0
+        if infos:
+            nodes_val = infos[0].get('nodes', 0)
+            time_val = infos[0].get('time', 0.0)
+
+        return {
+            'score': top_score_dict,
+            'best_move': best_move,
+            'best_move_san': best_move_san,
+            'pv': multipv_entries,  # MultiPV list
+            'depth': analysis_depth,
+            'nodes': nodes_val,
+            'time': time_val,
+        }
+
+    @staticmethod
+    def _error_result(error: Exception, analysis_depth: int) -> Dict[str, Any]:
+        print(f"Error analyzing position: {error}")
+        return {
+            'score': {'cp': 0},
+            'best_move': None,
+            'best_move_san': None,
+            'pv': [],
+            'pv_san': [],
+            'depth': analysis_depth,
+            'error': str(error)
+        }
+
     def get_engine_move(
         self,
         board: chess.Board,
         time_limit_ms: Optional[int] = None,
         depth: Optional[int] = None,
+        skill_level: Optional[int] = None,
     ) -> Dict[str, Any]:
         """
         Get engine's move for the current position at the configured skill level.
@@ -197,6 +290,8 @@ class StockfishAnalyzer:
             board: Current board position
             time_limit_ms: Time limit in milliseconds for the move
             depth: Optional depth limit
+            skill_level: Play this one move at another skill level (0-20); the
+                engine's configured level is restored afterwards
 
         Returns:
             Dictionary containing:
@@ -216,8 +311,16 @@ class StockfishAnalyzer:
             # Default: 2 seconds for move selection at skill level
             limit = chess.engine.Limit(time=2.0)
 
+        level = self.skill_level if skill_level is None else max(0, min(20, skill_level))
         try:
-            result = self.engine.play(board, limit)
+            if level != self.skill_level:
+                self.engine.configure({"Skill Level": level})
+            try:
+                result = self.engine.play(board, limit)
+            finally:
+                if level != self.skill_level:
+                    # Unset skill level means full strength
+                    self.engine.configure({"Skill Level": 20 if self.skill_level is None else self.skill_level})
             move = result.move
 
             # Get the move in SAN format
@@ -239,7 +342,7 @@ class StockfishAnalyzer:
                 'move_uci': move_uci,
                 'move_san': move_san,
                 'score': score_dict,
-                'skill_level': self.skill_level
+                'skill_level': level
             }
 
         except Exception as e:
@@ -248,7 +351,7 @@ class StockfishAnalyzer:
                 'move_uci': None,
                 'move_san': None,
                 'score': {'cp': 0},
-                'skill_level': self.skill_level,
+                'skill_level': level,
                 'error': str(e)
             }
 
@@ -258,9 +361,20 @@ class StockfishAnalyzer:
         move_played: chess.Move,
         depth: Optional[int] = None,
         nodes_limit: Optional[int] = None,
+        nodes_per_pv: Optional[int] = None,
+        eval_before: Optional[Dict[str, Any]] = None,
+        multipv: Optional[int] = None,
+        eval_after_from_pv: bool = False,
     ) -> Dict[str, Any]:
         """
         Compare the move played with the engine's best move.
+
+        Pass eval_before when the position was already searched with the same
+        limits (e.g. the previous move's eval_after) to skip searching it again.
+        With eval_after_from_pv, a move that heads one of eval_before's MultiPV
+        lines is scored from that line instead of searching the position after
+        it; eval_after then holds only that line, so do not chain it into the
+        next move's eval_before.
         
         Returns:
             Dictionary containing:
@@ -268,12 +382,92 @@ class StockfishAnalyzer:
             - best_move: The engine's recommended move
             - eval_before: Evaluation before the move
             - eval_after: Evaluation after the move
-            - eval_loss: Evaluation loss from the move (if not best)
+            - eval_loss: Evaluation loss from the move in pawns (if not best)
+            - eval_loss_cp: The same loss as integer centipawns
             - is_best: Whether the played move was the best
         """
-        # Analyze position before the move
-        eval_before = self.analyze_position(board, depth, nodes_limit)
+        # Analyze position before the move unless a usable evaluation was given
+        if eval_before is None or 'error' in eval_before:
+            eval_before = self.analyze_position(board, depth, nodes_limit, multipv=multipv, nodes_per_pv=nodes_per_pv)
         
+        # Analyze position after the move, unless the search before it already scored the move
+        eval_after = self._eval_after_from_pv(board, move_played, eval_before) if eval_after_from_pv else None
+        if eval_after is None:
+            board.push(move_played)
+            eval_after = self.analyze_position(board, depth, nodes_limit, multipv=multipv, nodes_per_pv=nodes_per_pv)
+            board.pop()  # Restore position
+        
+        return self._comparison(board, move_played, eval_before, eval_after)
+
+    @staticmethod
+    def _eval_after_from_pv(
+        board: chess.Board, move_played: chess.Move, eval_before: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """Evaluation after move_played taken from the MultiPV line it starts, or None if no line does."""
+        if 'error' in eval_before:
+            return None
+        move_uci = move_played.uci()
+        entry = next((e for e in eval_before.get('pv', []) if e.get('move_uci') == move_uci), None)
+        if entry is None:
+            return None
+        score = {'mate': entry['mate']} if entry.get('mate') is not None else {'cp': entry.get('cp') or 0}
+        line = entry.get('line_san') or []
+        reply_san = line[1] if len(line) > 1 else None
+        reply_uci = None
+        if reply_san:
+            after = board.copy(stack=False)
+            after.push(move_played)
+            reply_uci = after.parse_san(reply_san).uci()
+        return {
+            'score': score,
+            'best_move': reply_uci,
+            'best_move_san': reply_san,
+            # The rest of the line, as the single PV of the position after the move
+            'pv': [{
+                'move_san': reply_san,
+                'move_uci': reply_uci,
+                'cp': score.get('cp'),
+                'mate': score.get('mate'),
+                'line_san': line[1:],
+            }] if reply_san else [],
+            'depth': eval_before.get('depth'),
+            'nodes': eval_before.get('nodes', 0),
+            'time': 0.0,
+        }
+
+    def compare_move_streaming(
+        self,
+        board: chess.Board,
+        move_played: chess.Move,
+        node_budgets: Sequence[int],
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        compare_move at increasing nodes-per-PV budgets, yielding one comparison per budget.
+
+        The position before the move is searched once with
+        analyze_position_streaming. The position after the move is searched at
+        the smaller budgets first, because the engine runs one search at a
+        time, and at the full budget once the streamed search is done.
+        """
+        board.push(move_played)
+        evals_after = [self.analyze_position(board, nodes_per_pv=budget) for budget in node_budgets[:-1]]
+        board.pop()
+
+        for stage, eval_before in enumerate(self.analyze_position_streaming(board, node_budgets)):
+            if stage == len(evals_after):
+                board.push(move_played)
+                evals_after.append(self.analyze_position(board, nodes_per_pv=node_budgets[-1]))
+                board.pop()
+            yield self._comparison(board, move_played, eval_before, evals_after[stage])
+
+    @staticmethod
+    def _comparison(
+        board: chess.Board,
+        move_played: chess.Move,
+        eval_before: Dict[str, Any],
+        eval_after: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        """Build the compare_move result from the evaluations before and after the move."""
         # Get the best move
         best_move = eval_before.get('best_move')
         move_played_uci = str(move_played)
@@ -281,11 +475,6 @@ class StockfishAnalyzer:
         # Check if played move is the best move
         is_best = (best_move == move_played_uci) if best_move else False
         
-        # Analyze position after the move
-        board.push(move_played)
-        eval_after = self.analyze_position(board, depth, nodes_limit)
-        board.pop()  # Restore position
-        
         # Calculate evaluation loss from the mover's perspective
         eval_loss_cp = 0
         mover_is_white = board.turn  # True if white to move before pushing
@@ -311,6 +500,7 @@ class StockfishAnalyzer:
             'eval_before': eval_before,
             'eval_after': eval_after,
             'eval_loss': (eval_loss_cp / 100.0) if eval_loss_cp else 0.0,  # pawns, positive means worse for mover
+            'eval_loss_cp': int(eval_loss_cp),  # same loss in whole centipawns
             'is_best': is_best
         }
 
@@ -337,16 +527,19 @@ def evaluate_game(pgn_path: str, depth: int = 15, nodes_limit: int = 500000) ->
     
     with StockfishAnalyzer(depth=depth, nodes_limit=nodes_limit) as analyzer:
         move_num = 0
+        # Each move's eval_after is the next move's eval_before
+        eval_before = None
         for move_node in game.mainline():
             move = move_node.move
             
             # Analyze the move
-            comparison = analyzer.compare_move(board, move, depth, nodes_limit)
+            comparison = analyzer.compare_move(board, move, depth, nodes_limit, eval_before=eval_before)
+            eval_before = comparison['eval_after']
             
             evaluations.append({
                 'move_number': move_num // 2 + 1,
                 'side': 'white' if move_num % 2 == 0 else 'black',
-                'move': board.san(move),
+                'move': comparison['move_played_san'],
                 'evaluation': comparison
             })
             
@@ -376,21 +569,47 @@ def evaluate_game_detailed(pgn_content: str, depth: int = 15,
     
     if not game:
         return {}
+
+    return evaluate_game_detailed_from_game(game, depth, nodes_limit)
+
+
+def evaluate_game_detailed_from_game(game: chess.pgn.Game, depth: int = 15,
+                                     nodes_limit: int = 500000,
+                                     threads: Optional[int] = None,
+                                     analyzer: Optional[StockfishAnalyzer] = None) -> Dict[int, Dict[str, Any]]:
+    """
+    Same as evaluate_game_detailed, for a game that has already been parsed.
     
+    Args:
+        game: Parsed PGN game
+        depth: Analysis depth
+        threads: Stockfish search threads (default: analyzer default)
+        analyzer: Already-running analyzer to reuse; one is started for this game if omitted
+    
+    Returns:
+        Dictionary mapping move numbers to detailed evaluations
+    """
     # Validate the game has moves
-    move_list = list(game.mainline_moves())
-    if not move_list:
+    if game.next() is None:
         print("Warning: Game has no valid moves for analysis")
         return {}
     
     analysis = {}
     board = game.board()
     
+    if analyzer is not None:
+        analyzer.newgame()
+        engine_ctx = contextlib.nullcontext(analyzer)
+    else:
+        engine_ctx = StockfishAnalyzer(depth=depth, cache=get_analysis_cache(), threads=threads)
+    
     try:
-        with StockfishAnalyzer(depth=depth) as analyzer:
+        with engine_ctx as analyzer:
             # Analyze starting position
             initial_eval = analyzer.analyze_position(board, depth)
             analysis[-1] = initial_eval  # Position before first move
+            # Evaluation of the current position, reused as the next move's eval_before
+            current_eval = initial_eval
             
             move_num = 0
             for move_node in game.mainline():
@@ -403,7 +622,8 @@ def evaluate_game_detailed(pgn_content: str, depth: int = 15,
                     continue
                 
                 # Compare the move with best move
-                comparison = analyzer.compare_move(board, move, depth)
+                comparison = analyzer.compare_move(board, move, depth, eval_before=current_eval)
+                current_eval = comparison['eval_after']
                 
                 # Store the analysis
                 analysis[move_num] = comparison
@@ -412,9 +632,10 @@ def evaluate_game_detailed(pgn_content: str, depth: int = 15,
                 board.push(move)
                 move_num += 1
             
-            # Analyze final position
-            final_eval = analyzer.analyze_position(board, depth)
-            analysis[move_num] = final_eval
+            # The final position was searched as the last move's eval_after
+            if 'error' in current_eval:
+                current_eval = analyzer.analyze_position(board, depth)
+            analysis[move_num] = current_eval
     
     except Exception as e:
         print(f"Error during Stockfish analysis: {e}")
@@ -522,6 +743,59 @@ def get_game_statistics(analysis: List[Dict[str, Any]]) -> Dict[str, Any]:
     }
 
 
+def _win_percentage(cp: np.ndarray) -> np.ndarray:
+    """Win chance (0-100) for a centipawn score from the mover's perspective."""
+    return 50 + 50 * (2 / (1 + np.exp(-0.00368208 * cp)) - 1)
+
+
+def get_game_statistics_from_arrays(
+    is_white: np.ndarray,
+    eval_loss: np.ndarray,
+    cp_before: np.ndarray,
+    cp_after: np.ndarray,
+    is_best: np.ndarray,
+) -> Dict[str, Any]:
+    """
+    Calculate game statistics from per-move arrays (one entry per analyzed move).
+
+    Args:
+        is_white: True where White made the move
+        eval_loss: evaluation loss in pawns from the mover's perspective
+        cp_before: centipawn score before the move, White's perspective
+        cp_after: centipawn score after the move, White's perspective
+        is_best: True where the move matched the engine's best move
+
+    Returns:
+        Per-side accuracy, average loss and best-move rate, plus total moves.
+    """
+    if not len(is_white):
+        return {}
+
+    is_white = np.asarray(is_white, dtype=bool)
+    eval_loss = np.asarray(eval_loss, dtype=np.float64)
+    is_best = np.asarray(is_best, dtype=bool)
+    # Score both sides from the mover's point of view
+    sign = np.where(is_white, 1.0, -1.0)
+    win_before = _win_percentage(sign * np.asarray(cp_before, dtype=np.float64))
+    win_after = _win_percentage(sign * np.asarray(cp_after, dtype=np.float64))
+    accuracy = np.clip(103.1668 * np.exp(-0.04354 * (win_before - win_after)) - 3.1669, 0.0, 100.0)
+
+    def _side(mask: np.ndarray) -> Dict[str, Any]:
+        n = int(mask.sum())
+        return {
+            'accuracy': float(accuracy[mask].mean()) if n else 0.0,
+            'accuracy_per_move': accuracy[mask].tolist(),
+            'avg_centipawn_loss': float(eval_loss[mask].mean()) if n else 0.0,  # pawns
+            'best_move_percentage': float(is_best[mask].sum() * 100.0 / n) if n else 0,
+            'total_moves': n,
+        }
+
+    return {
+        'white': _side(is_white),
+        'black': _side(~is_white),
+        'total_moves': int(len(is_white)),
+    }
+
 if __name__ == "__main__":
     # Example usage
     import sys
@@ -545,7 +819,7 @@ if __name__ == "__main__":
         pgn_content = pgn_file.read()
 
     game = get_game_from_pgn(pgn_content)
-    analysis = evaluate_game_detailed(pgn_content, depth, nodes_limit)
+    analysis = evaluate_game_detailed_from_game(game, depth, nodes_limit) if game else {}
 
 
     # import pdb; pdb.set_trace()
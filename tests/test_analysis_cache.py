@@ -0,0 +1,92 @@
+import chess
+
+from analysis_cache import AnalysisCache, MemoryAnalysisCache
+
+
+def _result(n_pv: int, cp: int = 20):
+    return {
+        "score": {"cp": cp},
+        "best_move": "e2e4",
+        "best_move_san": "e4",
+        "pv": [{"move_san": f"m{i}", "cp": cp - i} for i in range(n_pv)],
+        "depth": 15,
+        "nodes": 1000,
+        "time": 0.1,
+    }
+
+
+def test_cache_hit_requires_covering_budget(tmp_path):
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite3"))
+    board = chess.Board()
+
+    assert cache.get(board, 3, 30_000) is None
+    cache.put(board, 3, 30_000, _result(3))
+
+    assert cache.get(board, 3, 30_000)["score"] == {"cp": 20}
+    assert len(cache.get(board, 2, 10_000)["pv"]) == 2
+    assert cache.get(board, 3, 60_000) is None
+    assert cache.get(board, 5, 30_000) is None
+
+
+def test_cache_keeps_deepest_entry_and_skips_errors(tmp_path):
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite3"))
+    board = chess.Board()
+
+    cache.put(board, 3, 90_000, _result(3, cp=30))
+    cache.put(board, 3, 30_000, _result(3, cp=10))
+    assert cache.get(board, 3, 30_000)["score"] == {"cp": 30}
+
+    other = chess.Board()
+    other.push_san("e4")
+    cache.put(other, 3, 30_000, {**_result(3), "error": "engine died"})
+    assert cache.get(other, 3, 30_000) is None
+
+
+def test_transposed_positions_share_entry(tmp_path):
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite3"))
+    a = chess.Board()
+    for san in ("Nf3", "Nf6", "Nc3"):
+        a.push_san(san)
+    b = chess.Board()
+    for san in ("Nc3", "Nf6", "Nf3"):
+        b.push_san(san)
+
+    cache.put(a, 1, 10_000, _result(1))
+
+    assert cache.get(b, 1, 10_000) is not None
+
+
+def test_max_ply_limits_cached_positions(tmp_path):
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite3"), max_ply=1)
+    opening = chess.Board()
+    opening.push_san("e4")
+    later = opening.copy()
+    later.push_san("e5")
+
+    cache.put(opening, 1, 10_000, _result(1))
+    cache.put(later, 1, 10_000, _result(1))
+
+    assert cache.get(opening, 1, 10_000) is not None
+    assert cache.get(later, 1, 10_000) is None
+
+
+def test_memory_cache_serves_covered_budgets_and_evicts_lru():
+    cache = MemoryAnalysisCache(maxsize=2)
+    boards = []
+    for san in ("e4", "d4", "c4"):
+        board = chess.Board()
+        board.push_san(san)
+        boards.append(board)
+
+    cache.put(boards[0], 3, 1_000_000, _result(3))
+    assert len(cache.get(boards[0], 2, 50_000)["pv"]) == 2
+    assert cache.get(boards[0], 3, 2_000_000) is None
+    cache.get(boards[0], 3, 50_000)["pv"].clear()
+    assert len(cache.get(boards[0], 3, 50_000)["pv"]) == 3
+
+    cache.put(boards[1], 3, 50_000, _result(3))
+    cache.get(boards[0], 3, 50_000)
+    cache.put(boards[2], 3, 50_000, _result(3))
+
+    assert cache.get(boards[1], 3, 50_000) is None
+    assert cache.get(boards[0], 3, 50_000) is not None
@@ -0,0 +1,112 @@
+import asyncio
+
+import analysis_pipeline
+
+
+PGN = (
+    "[Event \"Test\"]\n[White \"W\"]\n[Black \"B\"]\n[Opening \"Ruy Lopez\"]\n\n"
+    "1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 1-0\n"
+)
+
+# cp_loss (pawns) per ply: best, inaccuracy, best, mistake, blunder, good
+CP_LOSSES = [0.0, 0.5, 0.1, 1.0, 2.0, 0.2]
+
+
+class FakeAnalyzer:
+    def __init__(self, *args, **kwargs):
+        self.calls = 0
+        self.newgames = 0
+
+    def newgame(self):
+        self.newgames += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def analyze_position(self, board, *args, **kwargs):
+        return {"score": {"cp": 10}, "best_move_san": "e4", "pv": []}
+
+    def compare_move(self, board, move, *args, eval_before=None, **kwargs):
+        self.calls += 1
+        self.given_evals = getattr(self, "given_evals", []) + [eval_before]
+        ply = len(board.move_stack)
+        return {
+            "move_played_san": board.san(move),
+            "eval_before": eval_before or self.analyze_position(board),
+            "eval_after": {"score": {"cp": 0}, "ply": ply + 1},
+            "eval_loss": CP_LOSSES[ply],
+        }
+
+
+def test_summary_counts_per_side(monkeypatch):
+    monkeypatch.setattr(analysis_pipeline, "StockfishAnalyzer", FakeAnalyzer)
+
+    summary = asyncio.run(analysis_pipeline.analyze_pgn_to_feedback(PGN, use_llm=False))
+
+    assert [m["severity"] for m in summary["moves"]] == [
+        "best", "inaccuracy", "best", "mistake", "blunder", "good",
+    ]
+    assert all(m["source"] == "rules" for m in summary["moves"])
+    moves = summary["moves"]
+    assert [m["san"] for m in moves] == ["e4", "e5", "Nf3", "Nc6", "Bb5", "a6"]
+    assert [m["cp_loss_cp"] for m in moves] == [0, 50, 10, 100, 200, 20]
+    assert all(type(m["cp_before"]) is int for m in moves)
+    assert moves[0]["fen_before"] == "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+    assert all(a["fen_after"] == b["fen_before"] for a, b in zip(moves, moves[1:]))
+    assert summary["acpl_white"] == (0.0 + 0.1 + 2.0) / 3
+    assert summary["acpl_black"] == (0.5 + 1.0 + 0.2) / 3
+    assert summary["best_move_rate_white"] == 200.0 / 3
+    assert summary["best_move_rate_black"] == 100.0 / 3
+    assert (summary["mistakes_white"], summary["mistakes_black"]) == (0, 1)
+    assert (summary["blunders_white"], summary["blunders_black"]) == (1, 0)
+    assert summary["critical_positions"] == [4, 5]
+    assert summary["openings"] == ["Ruy Lopez"]
+
+
+def test_max_plies_truncates_moves(monkeypatch):
+    monkeypatch.setattr(analysis_pipeline, "StockfishAnalyzer", FakeAnalyzer)
+
+    summary = asyncio.run(analysis_pipeline.analyze_pgn_to_feedback(PGN, max_plies=3, use_llm=False))
+
+    assert len(summary["moves"]) == 3
+    assert summary["acpl_black"] == 0.5
+
+
+def test_reuses_passed_analyzer(monkeypatch):
+    def _no_new_engine(*args, **kwargs):
+        raise AssertionError("a new engine was started")
+
+    monkeypatch.setattr(analysis_pipeline, "StockfishAnalyzer", _no_new_engine)
+    analyzer = FakeAnalyzer()
+
+    for _ in range(2):
+        summary = asyncio.run(analysis_pipeline.analyze_pgn_to_feedback(PGN, use_llm=False, analyzer=analyzer))
+        assert len(summary["moves"]) == 6
+
+    assert analyzer.newgames == 2
+
+
+def test_each_position_is_searched_once():
+    analyzer = FakeAnalyzer()
+
+    asyncio.run(analysis_pipeline.analyze_pgn_to_feedback(PGN, use_llm=False, analyzer=analyzer))
+
+    # Only the first move searches its starting position; later moves reuse the previous eval_after
+    assert analyzer.calls == 6
+    assert analyzer.given_evals[0] is None
+    assert [e["ply"] for e in analyzer.given_evals[1:]] == [1, 2, 3, 4, 5]
+
+
+def test_headers_only_pgn_fails_fast(monkeypatch):
+    def _no_parse(*args, **kwargs):
+        raise AssertionError("PGN was tokenized")
+
+    monkeypatch.setattr(analysis_pipeline.chess.pgn, "read_game", _no_parse)
+
+    assert analysis_pipeline._safe_read_game('[Event "Aborted"]\n[White "W"]\n\n*\n') is None
+    assert analysis_pipeline._safe_read_game("") is None
+    assert analysis_pipeline.has_movetext("e4 e5 *")
+    assert analysis_pipeline.has_movetext('[Site "a1"]\n\n12. O-O Nf6')
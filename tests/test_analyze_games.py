@@ -0,0 +1,178 @@
+import json
+import re
+import threading
+import types
+
+import analyze_games
+
+
+MULTI_GAME_PGN = """[Event "One"]
+[White "A"]
+[Black "B"]
+
+1. e4 e5 {a comment
+[%clk 0:01:00] spanning lines} 2. Nf3 1-0
+
+[Event "Two"]
+[White "C"]
+[Black "D"]
+
+1. d4 d5 0-1
+"""
+
+
+def test_iter_pgn_games_splits_multi_game_file(tmp_path):
+    path = tmp_path / "games.pgn"
+    path.write_text(MULTI_GAME_PGN)
+
+    games = list(analyze_games.iter_pgn_games(str(path)))
+
+    assert len(games) == 2
+    assert "[%clk 0:01:00] spanning lines} 2. Nf3 1-0" in games[0]
+    assert games[1].startswith('[Event "Two"]')
+
+
+def test_iter_games_walks_folder(tmp_path):
+    (tmp_path / "multi.pgn").write_text(MULTI_GAME_PGN)
+    (tmp_path / "notes.txt").write_text("not a game")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "single.pgn").write_text('[Event "Three"]\n\n1. c4 *\n')
+
+    found = [(index, path) for _, path, index in analyze_games.iter_games(str(tmp_path))]
+
+    assert found == [
+        (1, str(tmp_path / "multi.pgn")),
+        (2, str(tmp_path / "multi.pgn")),
+        (1, str(tmp_path / "sub" / "single.pgn")),
+    ]
+
+
+def test_get_game_from_pgn_reuses_parse_but_returns_fresh_games(monkeypatch):
+    calls = []
+    real_parse = analyze_games._parse_game_from_pgn
+    monkeypatch.setattr(analyze_games, "_parse_game_from_pgn", lambda pgn, *a: calls.append(pgn) or real_parse(pgn, *a))
+    pgn = '[White "W"]\n[Black "B"]\n\n1. d4 d5 2. c4 *\n'
+
+    first = analyze_games.get_game_from_pgn(pgn)
+    first.headers["White"] = "changed"
+    second = analyze_games.get_game_from_pgn(pgn)
+
+    assert len(calls) == 1
+    assert second is not first
+    assert second.headers["White"] == "W"
+    assert [m.uci() for m in second.mainline_moves()] == ["d2d4", "d7d5", "c2c4"]
+
+
+def test_extract_players_reads_headers_only():
+    assert analyze_games.extract_players_from_pgn(MULTI_GAME_PGN) == ("A", "B")
+    assert analyze_games.extract_players_from_pgn("") == ("Unknown", "Unknown")
+
+
+def test_get_game_from_pgn_repairs_games_with_parse_errors():
+    game = analyze_games.get_game_from_pgn("1. e4 e5 2. Ke3 Nc6 3. Nf3 *")
+
+    # The standard parse stops at Ke3; repair skips the bad tokens and keeps going
+    assert [m.uci() for m in game.mainline_moves()] == ["e2e4", "e7e5", "g1f3"]
+
+
+def test_batches_run_concurrently_and_keep_move_order(monkeypatch):
+    barrier = threading.Barrier(3, timeout=5)
+
+    class FakeCompletions:
+        def create(self, messages, **kwargs):
+            # Every batch must be in flight at once to get past the barrier
+            barrier.wait()
+            prompt = messages[-1]["content"]
+            numbers = [int(n) for n in re.findall(r'"move_number": ?(\d+)', prompt)]
+            content = json.dumps([f"comment {n}" for n in numbers])
+            return types.SimpleNamespace(
+                choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))]
+            )
+
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=FakeCompletions()))
+    monkeypatch.setattr(analyze_games, "_get_openai_client", lambda: client)
+    positions = [
+        {"move_number": n, "side": "white", "move": "e4", "stockfish_eval": {}, "game_phase": "opening"}
+        for n in range(1, 8)
+    ]
+
+    commentaries = analyze_games.analyze_all_positions_batch(positions, "W", "B", "me", max_moves_per_batch=3)
+
+    assert commentaries == [f"comment {n}" for n in range(1, 8)]
+
+
+def test_short_games_share_one_request(monkeypatch):
+    prompts = []
+
+    class FakeCompletions:
+        def create(self, messages, **kwargs):
+            prompts.append(messages[-1]["content"])
+            # Game 2 is left out of the reply to exercise the per-game fallback
+            content = json.dumps({"game_1": ["one", "two"], "game_3": ["three"]})
+            return types.SimpleNamespace(
+                choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))]
+            )
+
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=FakeCompletions()))
+    monkeypatch.setattr(analyze_games, "_get_openai_client", lambda: client)
+
+    def _positions(count):
+        return [
+            {"move_number": n, "side": "white", "move": "e4", "stockfish_eval": {}, "game_phase": "opening"}
+            for n in range(1, count + 1)
+        ]
+
+    games = [(_positions(2), "A", "B"), (_positions(1), "C", "D"), (_positions(2), "E", "F")]
+    commentaries = analyze_games.analyze_games_batch(games, "me")
+
+    assert len(prompts) == 1
+    assert "=== GAME 3 === E (White) vs F (Black)" in prompts[0]
+    assert commentaries[0] == ["one", "two"]
+    assert commentaries[1] == ["Move 1: Analysis unavailable due to parsing error."]
+    assert commentaries[2] == ["three", "Position analysis unavailable."]
+    assert analyze_games._is_packable(_positions(2), batch_size=140)
+    assert not analyze_games._is_packable(_positions(2), batch_size=1)
+
+
+def test_summary_index_keeps_latest_record_and_skips_torn_lines(tmp_path):
+    path = str(tmp_path / "summary.jsonl")
+    analysis = {"white": "A", "black": "B", "result": "1-0", "moves": [{}, {}], "statistics": {}}
+
+    analyze_games._append_summary(path, analyze_games._summary_record("g1", analysis))
+    analyze_games._append_summary(path, analyze_games._summary_record("g1", {**analysis, "result": "0-1"}))
+    with open(path, "ab") as f:
+        f.write(b'{"game": "g2", "whi')
+
+    index = analyze_games._load_summary_index(path)
+
+    assert list(index) == ["g1"]
+    assert index["g1"]["result"] == "0-1"
+    assert index["g1"]["move_count"] == 2
+
+
+def test_overall_analysis_aggregates_records(monkeypatch):
+    class FailingCompletions:
+        def create(self, **kwargs):
+            raise RuntimeError("offline")
+
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=FailingCompletions()))
+    monkeypatch.setattr(analyze_games, "_get_openai_client", lambda: client)
+    games = [
+        {"move_count": 40, "opening": "Sicilian", "statistics": {"white": {"accuracy": 80.0}}},
+        {"move_count": 20, "opening": "Sicilian", "statistics": {"white": {"accuracy": 90.0}, "black": {"accuracy": 70.0}}},
+        {"moves": [{}] * 10, "opening": "Unknown", "statistics": None},
+    ]
+
+    text = analyze_games.generate_overall_analysis(games, "me")
+
+    assert "Total moves: 70" in text
+    assert "Average accuracy as White: 85.0% (across 2 games)" in text
+    assert "Average accuracy as Black: 70.0% (across 1 games)" in text
+    assert "Most common openings: Sicilian (2)" in text
+
+
+def test_repair_pgn_normalizes_sloppy_san():
+    game = analyze_games.repair_pgn('[White "X"]\n\n1.e4 e5 2.nf3 Nc6+ 3.Bb5 a6!? 4.0-0 Nf6 5.C3 *')
+
+    assert game.headers["White"] == "X"
+    assert str(game.mainline_moves()) == "1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 4. O-O Nf6 5. c3"
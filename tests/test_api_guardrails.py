@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi.testclient import TestClient
 
 from apple_auth import build_test_identity_token
@@ -68,6 +70,18 @@ def test_development_api_key_bypass_can_use_v1_endpoints(app_client_factory):
     assert entitlements.json()["daily_free_remaining"] == 4
 
 
+def test_oversized_batch_upload_is_rejected_before_reading(app_client_factory):
+    client, module = app_client_factory(api_key="dev-key", db_name="oversized_run.db")
+    headers = {"Authorization": "Bearer dev-key"}
+
+    response = client.post("/v1/runs", data={"pgn": "1" * module.MAX_PGN_BODY_BYTES}, headers=headers)
+    entitlements = client.get("/v1/entitlements", headers=headers)
+
+    assert response.status_code == 413
+    assert "X-Request-ID" in response.headers
+    assert entitlements.json()["daily_free_remaining"] == 5
+
+
 def test_purchase_endpoint_rejects_unexpected_product(app_client_factory):
     client, _module = app_client_factory(db_name="wrong_product.db")
     headers = _auth_headers(client, "wrong-product-user")
@@ -114,3 +128,41 @@ def test_unknown_webhook_transaction_is_ignored(app_client_factory):
 
     assert response.status_code == 200
     assert response.json()["status"] == "ignored"
+
+
+def test_legacy_analysis_and_schedule_endpoints_read_files(app_client_factory, monkeypatch, tmp_path):
+    client, _module = app_client_factory(db_name="legacy_files.db")
+    monkeypatch.chdir(tmp_path)
+    analysis_dir = tmp_path / "games" / "run1" / "analysis"
+    analysis_dir.mkdir(parents=True)
+    (analysis_dir / "a_readable.txt").write_text("report a")
+    (analysis_dir / "summary.json").write_text("{}")
+    (analysis_dir / "nested").mkdir()
+    (analysis_dir / "binary.bin").write_bytes(b"\xff\xfe\x00")
+
+    response = client.get("/api/analysis/run1")
+    assert response.json() == {"a_readable.txt": "report a", "summary.json": "{}"}
+    assert client.get("/api/analysis/missing").json() == {}
+
+    # Schedules saved by the old JSON store are imported on first use
+    (tmp_path / "schedules.json").write_text('[{"date": "2023-12-01", "frequency": "weekly", "id": "old"}]')
+    assert client.post("/api/schedule", params={"date": "2024-01-01", "frequency": "daily"}).status_code == 200
+    jobs = client.get("/api/dashboard/me").json()["scheduled_jobs"]
+    assert [(job["date"], job["frequency"]) for job in jobs] == [("2023-12-01", "weekly"), ("2024-01-01", "daily")]
+    assert (tmp_path / "schedules.db").exists()
+
+
+def test_analysis_endpoint_stays_inside_games_folder(app_client_factory, monkeypatch, tmp_path):
+    client, module = app_client_factory(db_name="legacy_traversal.db")
+    monkeypatch.chdir(tmp_path)
+    analysis_dir = tmp_path / "games" / "run1" / "analysis"
+    analysis_dir.mkdir(parents=True)
+    (analysis_dir / "report.txt").write_text("ok")
+    outside = tmp_path / "analysis"
+    outside.mkdir()
+    (outside / "secret.txt").write_text("secret")
+    (analysis_dir / "leak.txt").symlink_to(outside / "secret.txt")
+
+    # HTTP clients collapse "..", so call the endpoint directly
+    assert asyncio.run(module.get_analysis("..")) == {}
+    assert client.get("/api/analysis/run1").json() == {"report.txt": "ok"}
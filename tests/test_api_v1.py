@@ -104,6 +104,29 @@ def test_sse_basic_and_extended(client: TestClient):
         assert got_basic and got_extended
 
 
+@pytest.mark.skipif(not stockfish_available(), reason="Stockfish binary not available")
+def test_sse_delta_extended(client: TestClient):
+    r = client.post("/v1/sessions", params={"skill_level": "intermediate", "game_mode": "training"}, headers=auth_headers())
+    assert r.status_code == 200
+    sid = r.json()["session_id"]
+
+    events = {}
+    with client.stream("GET", f"/v1/sessions/{sid}/stream", params={"move": "e4", "delta": "true"}, headers=auth_headers()) as s:
+        assert s.status_code == 200
+        for evt in s.read().decode().split("\n\n"):
+            if evt.startswith("event: "):
+                name, data = evt.split("\n", 1)
+                events[name.split(": ", 1)[1]] = json.loads(data.split(": ", 1)[1])
+
+    assert "extended" not in events
+    basic, update = events["basic"], events["extended_v2"]
+    assert update["id"] == basic["id"] == 1
+    assert "san" not in update["delta"] and "fen_after" in update["delta"]
+    merged = {**basic["preview"], **update["delta"]}
+    assert merged["san"] == "e4" and "extended" in merged
+    assert client.get(f"/v1/sessions/{sid}", headers=auth_headers()).json()["moves"][0]["fen_after"] == merged["fen_after"]
+
+
 @pytest.mark.skipif(not stockfish_available(), reason="Stockfish binary not available")
 def test_batch_run(client: TestClient):
     pgn = """[Event \"Test\"]\n[White \"White\"]\n[Black \"Black\"]\n\n1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 1-0\n"""
@@ -72,7 +72,7 @@ def _stub_apply_move(module):
 
 
 def _stub_batch_analysis(module):
-    async def fake_analyze_pgn_to_feedback(pgn: str, level: str = "intermediate"):
+    async def fake_analyze_pgn_to_feedback(pgn: str, level: str = "intermediate", **_kwargs):
         return {
             "moves": [
                 {
@@ -0,0 +1,80 @@
+import asyncio
+import types
+
+from engine_pool import EnginePool
+
+
+class FakeAnalyzer:
+    def __init__(self):
+        self.engine = None
+        self.newgames = 0
+        self.exits = 0
+
+    def __enter__(self):
+        returncode = types.SimpleNamespace(done=lambda: False)
+        self.engine = types.SimpleNamespace(protocol=types.SimpleNamespace(returncode=returncode))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.exits += 1
+        self.engine = None
+        return False
+
+    def newgame(self):
+        self.newgames += 1
+
+
+def test_pool_reuses_engines_and_bounds_concurrency():
+    started = []
+
+    def factory():
+        started.append(FakeAnalyzer())
+        return started[-1]
+
+    pool = EnginePool(size=2, factory=factory)
+    active = 0
+    peak = 0
+
+    async def job():
+        nonlocal active, peak
+        async with pool.acquire() as analyzer:
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return analyzer
+
+    async def main():
+        return await asyncio.gather(*(job() for _ in range(6)))
+
+    used = asyncio.run(main())
+
+    assert peak == 2
+    assert len(started) == 2
+    assert set(map(id, used)) == set(map(id, started))
+    assert sum(a.newgames for a in started) == 6
+
+    # A new event loop reuses the running engines
+    asyncio.run(main())
+    assert len(started) == 2
+
+    pool.close_all()
+    assert all(a.exits == 1 for a in started)
+
+
+def test_pool_replaces_dead_engine():
+    pool = EnginePool(size=1, factory=FakeAnalyzer)
+
+    async def borrow():
+        async with pool.acquire() as analyzer:
+            return analyzer
+
+    async def main():
+        first = await borrow()
+        first.engine.protocol.returncode.done = lambda: True
+        return first, await borrow()
+
+    first, second = asyncio.run(main())
+
+    assert second is not first
+    assert first.exits == 1
@@ -0,0 +1,414 @@
+import asyncio
+import time
+import types
+
+import pytest
+
+import live_sessions
+
+
+class FakeAnalyzer:
+    def __init__(self, *args, **kwargs):
+        self.cache = kwargs.get("cache")
+        self.multipv = kwargs.get("multipv", 5)
+        self.nodes_per_pv = kwargs.get("nodes_per_pv", 1_000_000)
+        self.nodes_limit = 500_000
+        self.engine = None
+        self.exits = 0
+
+    def __enter__(self):
+        returncode = types.SimpleNamespace(done=lambda: False)
+        self.engine = types.SimpleNamespace(protocol=types.SimpleNamespace(returncode=returncode))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.exits += 1
+        self.engine = None
+        return False
+
+
+def test_session_engines_reuse_and_evict_lru(monkeypatch):
+    monkeypatch.setattr(live_sessions, "StockfishAnalyzer", FakeAnalyzer)
+    engines = live_sessions.SessionEngines(max_engines=2)
+
+    a = engines.get("a", cache="c")
+    assert engines.get("a") is a and a.cache == "c"
+    b = engines.get("b")
+    engines.get("a")
+    engines.get("c")
+
+    # "b" was least recently used
+    assert b.exits == 1 and a.exits == 0
+    assert engines.get("b") is not b
+
+    engines.release("a")
+    assert a.exits == 1
+    engines.close_all()
+    assert engines.get("a") is not a
+
+
+def test_session_engines_share_default_cache(monkeypatch):
+    monkeypatch.setattr(live_sessions, "StockfishAnalyzer", FakeAnalyzer)
+    shared = object()
+    engines = live_sessions.SessionEngines(cache=shared)
+
+    assert engines.get("a").cache is shared and engines.get("b").cache is shared
+    assert live_sessions.session_engines.cache is live_sessions.session_eval_cache
+
+
+def test_session_engines_stop_idle_engines(monkeypatch):
+    monkeypatch.setattr(live_sessions, "StockfishAnalyzer", FakeAnalyzer)
+    clock = [1000.0]
+    monkeypatch.setattr(live_sessions.time, "monotonic", lambda: clock[0])
+    engines = live_sessions.SessionEngines(idle_seconds=60)
+
+    a = engines.get("a")
+    clock[0] += 30
+    b = engines.get("b")
+    clock[0] += 45
+    assert engines.get("b") is b
+
+    # "a" sat unused for 75s; "b" was used just now
+    assert a.exits == 1 and b.exits == 0
+    assert engines.get("a") is not a
+
+
+def test_session_engines_replace_dead_engine(monkeypatch):
+    monkeypatch.setattr(live_sessions, "StockfishAnalyzer", FakeAnalyzer)
+    engines = live_sessions.SessionEngines()
+
+    first = engines.get("s")
+    first.engine.protocol.returncode.done = lambda: True
+
+    assert engines.get("s") is not first
+    assert first.exits == 1
+
+
+def test_session_engines_keep_checked_out_engines_running(monkeypatch):
+    monkeypatch.setattr(live_sessions, "StockfishAnalyzer", FakeAnalyzer)
+    engines = live_sessions.SessionEngines(max_engines=1)
+
+    a = engines.checkout("a")
+    engines.get("b")
+    engines.release("a")
+
+    # In use: neither the LRU limit nor a release stops it mid-search
+    assert a.exits == 0
+    engines.checkin(a)
+    assert a.exits == 1
+
+
+def test_cancelled_callers_keep_the_engine_until_its_thread_is_done(monkeypatch):
+    monkeypatch.setattr(live_sessions, "StockfishAnalyzer", FakeAnalyzer)
+    engines = live_sessions.SessionEngines()
+    events = []
+    checkin = engines.checkin
+    monkeypatch.setattr(engines, "checkin", lambda analyzer: (events.append("checked in"), checkin(analyzer)))
+
+    def search():
+        time.sleep(0.2)
+        events.append("searched")
+
+    async def move():
+        async with engines.use("s"):
+            await live_sessions.run_in_thread(search)
+
+    async def main():
+        task = asyncio.ensure_future(move())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert events == ["searched", "checked in"]
+
+
+def test_redis_sessions_keep_move_history():
+    manager = live_sessions.RedisSessionManager.__new__(live_sessions.RedisSessionManager)
+    board = live_sessions.chess.Board()
+    for san in ("Nf3", "Nf6", "Ng1", "Ng8"):
+        board.push_san(san)
+
+    restored = manager._deserialize_session(manager._serialize_session({"id": "s", "board": board}))
+
+    assert restored["board"].move_stack == board.move_stack
+    assert restored["board"].fen() == board.fen()
+    assert restored["board"].is_repetition(2)
+
+    # Sessions stored before move lists were kept still load from their FEN
+    legacy = manager._deserialize_session('{"id": "s", "board_fen": "%s"}' % board.fen())
+    assert legacy["board"].fen() == board.fen()
+
+
+class SlowAnalyzer(FakeAnalyzer):
+    def compare_move(self, board, move, **limits):
+        time.sleep(0.2)
+        evaluation = {"score": {"cp": 0}, "best_move_san": board.san(move), "pv": []}
+        return {"eval_before": evaluation, "eval_after": evaluation, "eval_loss": 0.0}
+
+
+def test_apply_move_searches_off_the_event_loop(monkeypatch):
+    monkeypatch.setattr(live_sessions, "StockfishAnalyzer", SlowAnalyzer)
+    monkeypatch.setattr(live_sessions, "session_engines", live_sessions.SessionEngines())
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    manager = live_sessions.SessionManager()
+    sids = [manager.create(game_mode="training")["session_id"] for _ in range(2)]
+
+    async def main():
+        return await asyncio.gather(*(manager.apply_move(sid, "e4") for sid in sids))
+
+    started = time.perf_counter()
+    results = asyncio.run(main())
+
+    # Both searches ran at once instead of one after the other
+    assert time.perf_counter() - started < 0.35
+    assert [r["human_feedback"]["san"] for r in results] == ["e4", "e4"]
+
+
+def test_redis_session_moves_roundtrip_without_repeated_fens():
+    manager = live_sessions.RedisSessionManager.__new__(live_sessions.RedisSessionManager)
+    board = live_sessions.chess.Board()
+    moves = []
+    for san in ("e4", "e5", "Nf3"):
+        fen_before = board.fen()
+        uci = board.push_san(san).uci()
+        moves.append({"san": san, "uci": uci, "fen_before": fen_before, "fen_after": board.fen()})
+    # Engine replies carry no fen_before
+    moves[1] = {k: v for k, v in moves[1].items() if k != "fen_before"}
+    sess = {"id": "s", "board": board, "moves": moves}
+
+    data = manager._serialize_session(sess)
+    restored = manager._deserialize_session(data)
+
+    assert restored["moves"] == moves
+    assert data.count(moves[2]["fen_before"]) == 1
+    assert "fen_before" in sess["moves"][2] and sess["moves"][2]["fen_before"] != 0
+
+
+def test_concurrent_moves_on_one_session_are_serialized(monkeypatch):
+    monkeypatch.setattr(live_sessions, "StockfishAnalyzer", SlowAnalyzer)
+    monkeypatch.setattr(live_sessions, "session_engines", live_sessions.SessionEngines())
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    manager = live_sessions.SessionManager()
+    sid = manager.create(game_mode="training")["session_id"]
+
+    async def main():
+        return await asyncio.gather(manager.apply_move(sid, "e4"), manager.apply_move(sid, "e4"))
+
+    first, second = asyncio.run(main())
+
+    # The second e4 is checked against the board after the first one
+    assert first["legal"] is True and second["legal"] is False
+    assert len(manager.get(sid)["moves"]) == 1
+
+
+def test_cancelled_move_leaves_the_session_board_alone(monkeypatch):
+    searched = []
+
+    class RecordingAnalyzer(SlowAnalyzer):
+        def compare_move(self, board, move, **limits):
+            searched.append(board)
+            return super().compare_move(board, move, **limits)
+
+    monkeypatch.setattr(live_sessions, "StockfishAnalyzer", RecordingAnalyzer)
+    monkeypatch.setattr(live_sessions, "session_engines", live_sessions.SessionEngines())
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    manager = live_sessions.SessionManager()
+    sid = manager.create(game_mode="training")["session_id"]
+
+    async def main():
+        task = asyncio.ensure_future(manager.apply_move(sid, "e4"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The cancelled search has finished, so the next move finds the engine free
+        assert len(searched) == 1 and not live_sessions.session_engines._users
+        return await manager.apply_move(sid, "e4")
+
+    result = asyncio.run(main())
+
+    assert result["legal"] is True
+    assert all(board is not manager.get(sid)["board"] for board in searched)
+
+
+def test_memory_sessions_expire_and_evict_least_recently_used(monkeypatch):
+    monkeypatch.setattr(live_sessions, "StockfishAnalyzer", FakeAnalyzer)
+    monkeypatch.setattr(live_sessions, "session_engines", live_sessions.SessionEngines())
+    clock = [1000.0]
+    monkeypatch.setattr(live_sessions.time, "monotonic", lambda: clock[0])
+    manager = live_sessions.SessionManager(max_sessions=2, ttl=60)
+
+    a = manager.create()["session_id"]
+    b = manager.create()["session_id"]
+    engine = live_sessions.session_engines.get(b)
+    manager.get(a)
+    c = manager.create()["session_id"]
+
+    # b was least recently used, and its engine is stopped with it
+    assert set(manager.sessions) == {a, c}
+    assert engine.exits == 1
+
+    clock[0] += 30
+    manager.get(c)
+    clock[0] += 45
+    with pytest.raises(KeyError):
+        manager.get(a)
+    assert manager.get(c)["id"] == c
+
+
+def test_boards_from_the_same_fen_are_independent():
+    fen = "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3"
+    first = live_sessions._new_board(fen)
+    first.push_san("Bb5")
+    second = live_sessions._new_board(fen)
+
+    assert second.fen() == fen and not second.move_stack
+    assert first.root().fen() == fen
+
+
+def test_parse_move_returns_only_legal_moves():
+    manager = live_sessions.SessionManager()
+    board = live_sessions.chess.Board()
+
+    assert manager._parse_move(board, "e2e4") == (live_sessions.chess.Move.from_uci("e2e4"), "e4", "e2e4")
+    assert manager._parse_move(board, "Nf3")[2] == "g1f3"
+    for move in ("e2e5", "e5", "0000", "--", "xyz"):
+        assert manager._parse_move(board, move) == (None, None, None)
+
+
+def test_live_analysis_budget_scales_with_skill_level(monkeypatch):
+    calls = []
+
+    class RecordingAnalyzer(SlowAnalyzer):
+        def compare_move(self, board, move, eval_after_from_pv=False, **limits):
+            calls.append(limits)
+            return super().compare_move(board, move)
+
+    monkeypatch.setattr(live_sessions, "StockfishAnalyzer", RecordingAnalyzer)
+    monkeypatch.setattr(live_sessions, "session_engines", live_sessions.SessionEngines())
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    manager = live_sessions.SessionManager()
+
+    for level in ("beginner", "intermediate", "expert"):
+        sid = manager.create(skill_level=level, game_mode="training")["session_id"]
+        asyncio.run(manager.apply_move(sid, "e4"))
+
+    beginner, intermediate, expert = calls
+    assert beginner["nodes_per_pv"] < intermediate["nodes_per_pv"] < live_sessions.DEFAULT_NODES_PER_PV
+    assert beginner["nodes_limit"] < intermediate["nodes_limit"]
+    assert beginner["multipv"] == intermediate["multipv"] == min(3, live_sessions.DEFAULT_MULTIPV)
+    # Stronger players keep the analyzer's full budget
+    assert expert == {}
+
+
+def test_session_fen_reuses_recorded_fen_only_in_step_with_board():
+    board = live_sessions.chess.Board()
+    sess = {"board": board, "moves": []}
+    assert live_sessions.session_fen(sess) == board.fen()
+
+    board.push_san("e4")
+    sess["moves"].append({"uci": "e2e4", "fen_after": "recorded"})
+    assert live_sessions.session_fen(sess) == "recorded"
+
+    # A push that was never recorded falls back to the board
+    board.push_san("e5")
+    assert live_sessions.session_fen(sess) == board.fen()
+
+
+def test_engine_reply_overlaps_coaching(monkeypatch):
+    class ReplyingAnalyzer(SlowAnalyzer):
+        def compare_move(self, board, move, **limits):
+            evaluation = {"score": {"cp": 0}, "best_move_san": board.san(move), "pv": []}
+            return {"eval_before": evaluation, "eval_after": evaluation, "eval_loss": 0.0}
+
+        def get_engine_move(self, board, **kwargs):
+            time.sleep(0.2)
+            return {"move_uci": "e7e5", "move_san": "e5"}
+
+    async def slow_coach(feedback, level):
+        await asyncio.sleep(0.2)
+        return {"basic": "Fine.", "source": "llm"}
+
+    monkeypatch.setattr(live_sessions, "StockfishAnalyzer", ReplyingAnalyzer)
+    monkeypatch.setattr(live_sessions, "session_engines", live_sessions.SessionEngines())
+    monkeypatch.setattr(live_sessions, "coach_move_with_llm", slow_coach)
+    manager = live_sessions.SessionManager()
+    sid = manager.create(game_mode="play")["session_id"]
+
+    started = time.perf_counter()
+    result = asyncio.run(manager.apply_move(sid, "e4"))
+
+    assert time.perf_counter() - started < 0.35
+    assert result["human_feedback"]["basic"] == "Fine."
+    assert [m["san"] for m in manager.get(sid)["moves"]] == ["e4", "e5"]
+
+
+def test_engine_move_is_searched_on_a_copy_of_the_board(monkeypatch):
+    monkeypatch.setattr(live_sessions, "StockfishAnalyzer", FakeAnalyzer)
+    manager = live_sessions.SessionManager()
+    sess = manager.get(manager.create(game_mode="play")["session_id"])
+
+    def get_engine_move(board, **kwargs):
+        assert board is not sess["board"]
+        return {"move_uci": "e2e4", "move_san": "e4"}
+
+    engine_move = manager._get_engine_move(sess, types.SimpleNamespace(get_engine_move=get_engine_move))
+
+    assert engine_move["san"] == "e4" and " b " in engine_move["fen_after"]
+    assert sess["board"].move_stack == []
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.round_trips = []
+
+    def get(self, key):
+        self.round_trips.append(["get"])
+        return self.data.get(key)
+
+    def setex(self, key, ttl, value):
+        self.round_trips.append(["setex"])
+        self.data[key] = value
+
+    def expire(self, key, ttl):
+        self.round_trips.append(["expire"])
+        return key in self.data
+
+    def pipeline(self, transaction=True):
+        redis = self
+
+        class Pipeline:
+            def __init__(self):
+                self.commands = []
+
+            def get(self, key):
+                self.commands.append(("get", key))
+
+            def expire(self, key, ttl):
+                self.commands.append(("expire", key))
+
+            def execute(self):
+                redis.round_trips.append([name for name, _ in self.commands])
+                return [redis.data.get(key) if name == "get" else key in redis.data for name, key in self.commands]
+
+        return Pipeline()
+
+
+def test_redis_session_reads_use_one_round_trip(monkeypatch):
+    monkeypatch.setattr(live_sessions, "StockfishAnalyzer", SlowAnalyzer)
+    monkeypatch.setattr(live_sessions, "session_engines", live_sessions.SessionEngines())
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    manager = live_sessions.RedisSessionManager.__new__(live_sessions.RedisSessionManager)
+    manager.redis_client = FakeRedis()
+    sid = manager.create(game_mode="training")["session_id"]
+
+    manager.redis_client.round_trips.clear()
+    assert manager.get(sid)["id"] == sid
+    asyncio.run(manager.apply_move(sid, "e4"))
+
+    # GET + EXPIRE are pipelined; a move reads, then writes with SETEX (which resets the TTL)
+    assert manager.redis_client.round_trips == [["get", "expire"], ["get"], ["setex"]]
+    assert manager.get(sid)["moves"][0]["san"] == "e4"
@@ -54,3 +54,157 @@ def test_coach_move_with_llm_returns_llm_source(monkeypatch):
     assert result["source"] == "llm"
     assert result["basic"] == fake_response["basic"]
     assert result["extended"].startswith("Detailed extended coaching")
+
+
+def test_severities_from_cp_losses_matches_scalar_thresholds():
+    losses = [0.0, 0.15, 0.16, 0.3, -0.45, 0.6, 1.0, 1.5, 1.51, 9.0]
+    assert llm_coach.severities_from_cp_losses(losses) == [
+        llm_coach.severity_from_cp_loss(x) for x in losses
+    ]
+    assert llm_coach.severities_from_cp_losses(losses[:4]) == ["best", "best", "good", "good"]
+
+
+def test_concurrent_coaching_calls_share_one_request(monkeypatch):
+    calls = []
+
+    class FakeCompletions:
+        async def create(self, messages, **kwargs):
+            calls.append(messages[-1]["content"])
+            # The second move is missing from the reply and falls back to rules
+            content = json.dumps([{"basic": "first"}, "not an object", {"basic": "third"}])
+            return types.SimpleNamespace(
+                choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))]
+            )
+
+    import openai
+
+    monkeypatch.setattr(
+        openai, "AsyncOpenAI",
+        lambda *args, **kwargs: types.SimpleNamespace(chat=types.SimpleNamespace(completions=FakeCompletions())),
+    )
+    monkeypatch.setenv("OPENAI_API_KEY", "test-openai-key")
+    moves = [{"san": san, "cp_loss": 1.0, "best_move_san": "e4", "side": "white"} for san in ("a3", "h3", "g4")]
+
+    async def _run():
+        return await asyncio.gather(*(llm_coach.coach_move_with_llm(m) for m in moves))
+
+    results = asyncio.run(_run())
+
+    assert len(calls) == 1 and "3 independent moves" in calls[0]
+    assert [r["source"] for r in results] == ["llm", "rules", "llm"]
+    assert results[0]["basic"] == "first" and results[2]["basic"] == "third"
+
+
+def test_llm_coaching_is_cached_per_position_move_and_level(monkeypatch):
+    calls = []
+
+    class FakeCompletions:
+        async def create(self, messages, **kwargs):
+            calls.append(messages[-1]["content"])
+            content = json.dumps({"basic": f"advice {len(calls)}"})
+            return types.SimpleNamespace(
+                choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))]
+            )
+
+    import openai
+
+    monkeypatch.setattr(
+        openai, "AsyncOpenAI",
+        lambda *args, **kwargs: types.SimpleNamespace(chat=types.SimpleNamespace(completions=FakeCompletions())),
+    )
+    monkeypatch.setenv("OPENAI_API_KEY", "test-openai-key")
+    monkeypatch.setattr(llm_coach, "_coach_cache", llm_coach.OrderedDict())
+    move = {
+        "san": "e4", "uci": "e2e4", "cp_loss": 0.0, "best_move_san": "e4", "side": "white",
+        "fen_before": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    }
+    # Same position reached later in another game: only the move clocks differ
+    transposed = {**move, "fen_before": move["fen_before"].replace("- 0 1", "- 4 3")}
+
+    first = asyncio.run(llm_coach.coach_move_with_llm(move))
+    first["basic"] = "changed by caller"
+    again = asyncio.run(llm_coach.coach_move_with_llm(transposed))
+    other_level = asyncio.run(llm_coach.coach_move_with_llm(move, level="advanced"))
+
+    assert len(calls) == 2
+    assert again == {"basic": "advice 1", "source": "llm"}
+    assert other_level["basic"] == "advice 2"
+
+
+def test_llm_coaching_is_shared_through_redis(monkeypatch):
+    store = {}
+
+    class FakeRedis:
+        def get(self, key):
+            return store.get(key)
+
+        def setex(self, key, ttl, value):
+            store[key] = value
+
+    async def fake_batch(items):
+        return [{"basic": "from the model"} for _ in items]
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test-openai-key")
+    monkeypatch.setattr(llm_coach, "_coach_redis", lambda: FakeRedis())
+    monkeypatch.setattr(llm_coach, "_coach_cache", llm_coach.OrderedDict())
+    monkeypatch.setattr(llm_coach, "_coach_batcher", llm_coach.Batcher(fake_batch))
+    move = {"san": "e4", "uci": "e2e4", "fen_before": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"}
+
+    first = asyncio.run(llm_coach.coach_move_with_llm(move))
+    assert len(store) == 1
+
+    # Another worker (empty local cache, no model call) gets the stored answer
+    monkeypatch.setattr(llm_coach, "_coach_cache", llm_coach.OrderedDict())
+    monkeypatch.setattr(llm_coach, "_coach_batcher", None)
+    assert asyncio.run(llm_coach.coach_move_with_llm(move)) == first == {"basic": "from the model", "source": "llm"}
+
+
+def test_openai_client_is_reused_on_one_event_loop(monkeypatch):
+    made = []
+
+    import openai
+
+    monkeypatch.setattr(openai, "AsyncOpenAI", lambda **kwargs: made.append(kwargs) or object())
+    monkeypatch.setenv("OPENAI_API_KEY", "test-openai-key")
+
+    async def two_calls():
+        return llm_coach._async_openai_client(), llm_coach._async_openai_client()
+
+    first, second = asyncio.run(two_calls())
+    assert first is second and len(made) == 1
+    assert made[0]["timeout"] == llm_coach.LLM_REQUEST_TIMEOUT_SECONDS
+
+    # Connections belong to their loop, so a new loop gets a new client
+    asyncio.run(two_calls())
+    assert len(made) == 2
+
+
+def test_json_mode_requests_an_object_reply(monkeypatch):
+    calls = []
+
+    class FakeCompletions:
+        async def create(self, messages, **kwargs):
+            calls.append((messages[-1]["content"], kwargs.get("response_format")))
+            content = json.dumps({"moves": [{"basic": "first"}, {"basic": "second"}]})
+            return types.SimpleNamespace(
+                choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))]
+            )
+
+    import openai
+
+    monkeypatch.setattr(
+        openai, "AsyncOpenAI",
+        lambda *args, **kwargs: types.SimpleNamespace(chat=types.SimpleNamespace(completions=FakeCompletions())),
+    )
+    monkeypatch.setenv("OPENAI_API_KEY", "test-openai-key")
+    monkeypatch.setattr(llm_coach, "LLM_JSON_MODE", True)
+    moves = [{"san": san, "cp_loss": 1.0, "best_move_san": "e4", "side": "white"} for san in ("a3", "h3")]
+
+    async def _run():
+        return await asyncio.gather(*(llm_coach.coach_move_with_llm(m) for m in moves))
+
+    results = asyncio.run(_run())
+
+    assert len(calls) == 1 and calls[0][1] == {"type": "json_object"}
+    assert '{"moves": [...]}' in calls[0][0]
+    assert [r["basic"] for r in results] == ["first", "second"]
@@ -0,0 +1,62 @@
+import os
+import shutil
+
+import chess
+import pytest
+
+from analysis_cache import MemoryAnalysisCache
+from stockfish_engine import StockfishAnalyzer
+
+
+def stockfish_available() -> bool:
+    return bool(shutil.which(os.getenv("STOCKFISH_PATH", "stockfish")))
+
+
+@pytest.mark.skipif(not stockfish_available(), reason="Stockfish binary not available")
+def test_streaming_comparison_yields_once_per_budget():
+    board = chess.Board()
+    move = chess.Move.from_uci("e2e4")
+    cache = MemoryAnalysisCache()
+
+    with StockfishAnalyzer(multipv=2, nodes_per_pv=40_000, cache=cache) as analyzer:
+        stages = list(analyzer.compare_move_streaming(board, move, (10_000, 40_000)))
+
+        assert len(stages) == 2
+        quick, full = stages
+        assert quick["eval_before"]["nodes"] < full["eval_before"]["nodes"]
+        assert full["move_played_san"] == "e4"
+        assert len(full["eval_before"]["pv"]) == 2
+        assert board.fen() == chess.STARTING_FEN
+
+        # The full search was cached, so repeating it is served without searching
+        again = list(analyzer.analyze_position_streaming(board, (10_000, 40_000)))
+        assert again == [full["eval_before"]] * 2
+
+
+def test_compare_move_scores_multipv_moves_from_their_line():
+    board = chess.Board()
+    eval_before = {
+        "score": {"cp": 30},
+        "best_move": "e2e4",
+        "best_move_san": "e4",
+        "pv": [
+            {"move_san": "e4", "move_uci": "e2e4", "cp": 30, "mate": None, "line_san": ["e4", "e5", "Nf3"]},
+            {"move_san": "d4", "move_uci": "d2d4", "cp": 10, "mate": None, "line_san": ["d4", "d5"]},
+        ],
+        "depth": 15,
+        "nodes": 1000,
+    }
+    analyzer = StockfishAnalyzer()
+    searched = []
+    analyzer.analyze_position = lambda board, *args, **kwargs: searched.append(board.fen()) or eval_before
+
+    comparison = analyzer.compare_move(board, chess.Move.from_uci("d2d4"), eval_before=eval_before, eval_after_from_pv=True)
+
+    assert not searched
+    assert comparison["eval_loss"] == 0.2
+    assert comparison["eval_after"]["best_move"] == "d7d5"
+    assert comparison["eval_after"]["pv"][0]["line_san"] == ["d5"]
+
+    # A move outside the lines is still searched
+    analyzer.compare_move(board, chess.Move.from_uci("a2a3"), eval_before=eval_before, eval_after_from_pv=True)
+    assert len(searched) == 1 and board.fen() == chess.STARTING_FEN
@@ -0,0 +1,30 @@
+import numpy as np
+
+from stockfish_engine import get_game_statistics_from_arrays
+
+
+def test_statistics_from_arrays_per_side():
+    stats = get_game_statistics_from_arrays(
+        is_white=np.array([True, False, True, False]),
+        eval_loss=np.array([0.0, 0.5, 2.0, 0.0]),
+        cp_before=np.array([20, 20, 30, -170]),
+        cp_after=np.array([20, 70, -170, -170]),
+        is_best=np.array([True, False, False, True]),
+    )
+
+    assert stats["total_moves"] == 4
+    white, black = stats["white"], stats["black"]
+    assert (white["total_moves"], black["total_moves"]) == (2, 2)
+    assert white["avg_centipawn_loss"] == 1.0
+    assert black["avg_centipawn_loss"] == 0.25
+    assert white["best_move_percentage"] == 50.0
+    # Lossless moves score ~100, a blunder scores far lower; all within 0-100
+    assert all(0.0 <= a <= 100.0 for a in white["accuracy_per_move"] + black["accuracy_per_move"])
+    assert white["accuracy_per_move"][0] > 99.0
+    assert white["accuracy_per_move"][1] < black["accuracy_per_move"][0] < 99.0
+    assert white["accuracy"] == np.mean(white["accuracy_per_move"])
+
+
+def test_statistics_from_arrays_empty():
+    empty = np.array([])
+    assert get_game_statistics_from_arrays(empty, empty, empty, empty, empty) == {}